@@ -0,0 +1,136 @@
+"""Statistics over the training history of a store.
+
+The history is streamed once: memory grows with the number of distinct
+challenges, not with the number of records, and latencies go into a
+fixed histogram.
+"""
+
+import heapq
+
+from . import history
+
+
+# Challenges answered fewer times are not reported as the hardest ones
+MIN_ATTEMPTS = 3
+# Response times are counted in buckets of this many milliseconds up to
+# LATENCY_CAP seconds, slower ones share the last bucket
+LATENCY_BUCKET = 100
+LATENCY_CAP = 120
+
+
+class Latency:
+    """Distribution of response times with a fixed precision.
+
+    Unlike stats.Metric, whose buckets double in size, percentiles are
+    at most LATENCY_BUCKET off, which matters for times of seconds.
+    """
+
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = self.max = 0.0
+        self.buckets = [0] * (LATENCY_CAP * 1000 // LATENCY_BUCKET + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = round(seconds * 1000) // LATENCY_BUCKET
+        self.buckets[min(bucket, len(self.buckets) - 1)] += 1
+
+    def percentile(self, fraction):
+        """Upper bound (in seconds) of the fraction of fastest answers."""
+        rank = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                if bucket == len(self.buckets) - 1:
+                    break
+                return min((bucket + 1) * LATENCY_BUCKET / 1000, self.max)
+        return self.max
+
+
+class Analytics:
+
+    def __init__(self, reverse=None, learner=None):
+        # only records of this kind (None is any) and learner (None is
+        # anyone) are counted
+        self.reverse = reverse
+        self.learner = learner
+        # correct includes the answers accepted as near misses
+        self.answers = self.correct = self.skipped = 0
+        self.latency = Latency()
+        # [attempts, errors] by (reverse, challenge), a skip is both
+        self.words = {}
+
+    def add(self, record):
+        reverse = bool(record.flags & history.REVERSE)
+        if ((self.reverse is not None and reverse != self.reverse) or
+                (self.learner is not None and
+                 record.learner != self.learner)):
+            return
+        counts = self.words.get((reverse, record.challenge))
+        if counts is None:
+            counts = self.words[reverse, record.challenge] = [0, 0]
+        counts[0] += 1
+        if record.flags & history.SKIPPED:
+            self.skipped += 1
+            counts[1] += 1
+            return
+        self.answers += 1
+        self.latency.add(record.latency)
+        if record.flags & (history.CORRECT | history.NEAR_MISS):
+            self.correct += 1
+        else:
+            counts[1] += 1
+
+    def error_rate(self, challenge, reverse=False):
+        attempts, errors = self.words.get((reverse, challenge), (0, 0))
+        return errors / attempts if attempts else None
+
+    def hardest(self, limit, min_attempts=MIN_ATTEMPTS):
+        """Up to limit (challenge, reverse, attempts, errors) tuples.
+
+        Sorted by the error rate, then by the number of errors.
+        """
+        found = heapq.nlargest(
+            limit,
+            ((key, counts) for (key, counts) in self.words.items()
+             if counts[1] and counts[0] >= min_attempts),
+            key=lambda item: (item[1][1] / item[1][0], item[1][1]))
+        return [(challenge, reverse, attempts, errors)
+                for ((reverse, challenge), (attempts, errors)) in found]
+
+
+def analyze(filename, reverse=None, learner=None):
+    """Return Analytics of the records of a history file."""
+    result = Analytics(reverse, learner)
+    for record in history.read(filename):
+        result.add(record)
+    return result
+
+
+def report(result, limit=10, min_attempts=MIN_ATTEMPTS):
+    if not result.answers and not result.skipped:
+        return 'Nothing trained yet\n'
+    lines = ['Answers: %d, correct: %d (%.1f%%), skipped: %d' % (
+        result.answers, result.correct,
+        100.0 * result.correct / result.answers if result.answers else 0,
+        result.skipped)]
+    if result.answers:
+        lines.append('Response time, s: p50 %.1f, p90 %.1f, p99 %.1f, '
+                     'max %.1f' % (result.latency.percentile(0.5),
+                                   result.latency.percentile(0.9),
+                                   result.latency.percentile(0.99),
+                                   result.latency.max))
+    hardest = result.hardest(limit, min_attempts)
+    if hardest:
+        lines.append('Hardest words (errors of attempts):')
+        for challenge, reverse, attempts, errors in hardest:
+            lines.append('  %s%s: %d of %d (%.0f%%)' % (
+                challenge, ' (reverse)' if reverse else '', errors,
+                attempts, 100.0 * errors / attempts))
+    return '\n'.join(lines) + '\n'
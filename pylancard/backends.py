@@ -0,0 +1,444 @@
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import urllib.request
+
+from . import binary
+from . import index
+from . import journal
+from . import locking
+
+
+LOG = logging.getLogger(__name__)
+
+JOURNAL_SUFFIX = '.journal'
+# The journal moved aside while a new snapshot is being written
+ROTATED_SUFFIX = '.journal.old'
+SQLITE_MAGIC = b'SQLite format 3\x00'
+# Attempts to load a snapshot replaced by another process meanwhile
+OPEN_ATTEMPTS = 5
+# Decompressed bytes searched for the metadata of a JSON snapshot
+PEEK_SIZE = 1 << 16
+
+
+class JsonBackend:
+    """Gzipped JSON snapshot plus an append-only journal of changes.
+
+    The snapshot is only ever replaced atomically. Its ``revision`` is
+    increased on every compaction and the journal names the revision it
+    applies to, so readers not holding the lock can tell they loaded a
+    snapshot and a journal that do not match and try again.
+
+    A compaction moves the journal aside and starts a new one, the new
+    snapshot is written from a copy of the words and tables. Until it is
+    in place both journals are replayed over the old snapshot.
+    """
+
+    name = 'json'
+    version = 1
+
+    def __init__(self, filename, buffered=False, read_only=False):
+        self.filename = filename
+        self.buffered = buffered
+        self.read_only = read_only
+        self._journal = self._index = self._identity = None
+        self._rotated = False
+
+    @classmethod
+    def create(cls, filename, languages):
+        cls.dump(filename, {'languages': languages, 'revision': 0}, {}, {})
+        for suffix in (JOURNAL_SUFFIX, ROTATED_SUFFIX):
+            try:
+                os.remove(filename + suffix)
+            except FileNotFoundError:
+                pass
+
+    @classmethod
+    def dump(cls, filename, meta, index, tables):
+        """Atomically write a complete snapshot of a store."""
+        data = dict(meta, version=cls.version, index=dict(index.items()))
+        tables = {name: dict(table.items())
+                  for (name, table) in tables.items()}
+        if tables:
+            data['tables'] = tables
+
+        def write(fp):
+            with gzip.GzipFile(fileobj=fp, mode='wb') as gzip_fp:
+                gzip_fp.write(json.dumps(data, ensure_ascii=False,
+                                         separators=(',', ':'))
+                              .encode('utf-8'))
+        locking.replace(filename, write)
+
+    @classmethod
+    def peek(cls, filename):
+        """Read metadata (e.g. languages) without loading the words."""
+        with open(filename, 'rb') as fp:
+            meta = cls._read_meta(fp)
+        meta.pop('tables', None)
+        return meta
+
+    def open(self):
+        for _ in range(OPEN_ATTEMPTS):
+            identity = locking.identity(self.filename)
+            meta = self._load()
+            if ((self._rotated or
+                 self._journal.revision <= meta.get('revision', 0)) and
+                    locking.identity(self.filename) == identity):
+                self._identity = identity
+                break
+            LOG.info("Store %s was replaced while loading, retrying",
+                     self.filename)
+        else:
+            raise locking.ConflictError("%s keeps changing while loading" %
+                                        self.filename)
+
+        if not self.read_only:
+            if self._rotated:
+                # a crash while the new snapshot was being written
+                meta['revision'] = self._journal.revision
+                self._snapshot(meta)()
+            for name, table in self._tables.items():
+                table.listeners.append(self._logger(name))
+        return meta, self._index
+
+    def table(self, name):
+        table = self._tables.get(name)
+        if table is None:
+            table = self._tables[name] = index.Table(
+                self._table_data.pop(name, {}))
+            if not self.read_only:
+                table.listeners.append(self._logger(name))
+        return table
+
+    def snapshot(self, store):
+        """Take the changes of store, return a function writing them.
+
+        The function may run while the store is changed further.
+        """
+        # the journal only records changes of the tables
+        if (self._journal.size > store.compact_threshold or
+                store.meta_dirty):
+            store['revision'] = store.get('revision', 0) + 1
+            return self._snapshot(store)
+        self._journal.flush()
+        return self._journal.fsync
+
+    def set_buffered(self, buffered):
+        self.buffered = buffered
+        if self._journal is not None:
+            self._journal.buffered = buffered
+            if not buffered:
+                self._journal.flush()
+
+    def flush(self):
+        self._journal.flush()
+
+    def compact(self, store):
+        store['revision'] = store.get('revision', 0) + 1
+        self._snapshot(store)()
+
+    def tables(self):
+        """All auxiliary tables by name."""
+        tables = dict(self._table_data)
+        tables.update((name, table) for (name, table) in self._tables.items()
+                      if name != 'index')
+        return tables
+
+    def close(self):
+        self._journal.close()
+
+    def _snapshot(self, meta):
+        # the lock only keeps out processes which respect it
+        if locking.identity(self.filename) != self._identity:
+            raise locking.ConflictError("%s was replaced by another process" %
+                                        self.filename)
+        meta = dict(meta)
+        words = dict(self._index.items())
+        tables = {name: dict(table.items())
+                  for (name, table) in self.tables().items()}
+        self._journal.rotate(self.filename + ROTATED_SUFFIX, meta['revision'])
+        self._rotated = True
+
+        def write():
+            LOG.info("Compacting store %s", self.filename)
+            self.dump(self.filename, meta, words, tables)
+            self._identity = locking.identity(self.filename)
+            self._rotated = False
+            # The moved journal is of the previous revision now, so after
+            # crashing before the removal it is skipped on the next open.
+            os.remove(self.filename + ROTATED_SUFFIX)
+        return write
+
+    def _load(self):
+        with open(self.filename, 'rb') as fp:
+            meta, words = self._read(fp)
+        self._index = index.Index(words)
+        self._tables = {'index': self._index}
+        self._table_data = meta.pop('tables', {})
+
+        rotated = journal.Journal(self.filename + ROTATED_SUFFIX,
+                                  read_only=self.read_only)
+        rotated.revision = meta.get('revision', 0)
+        self._journal = journal.Journal(self.filename + JOURNAL_SUFFIX,
+                                        self.buffered, self.read_only)
+        self._journal.revision = meta.get('revision', 0)
+        replayed = 0
+        for record in self._replay(rotated):
+            self._apply(record)
+            replayed += 1
+        if replayed:
+            LOG.info("Replayed %d journal records", replayed)
+        return meta
+
+    def _replay(self, rotated):
+        yield from rotated.replay()
+        # the journal started by a compaction continues the moved one
+        self._rotated = bool(rotated.size) and not rotated.stale
+        if self._rotated:
+            self._journal.revision = rotated.revision + 1
+        yield from self._journal.replay()
+
+    @staticmethod
+    def _read(fp):
+        with gzip.GzipFile(fileobj=fp, mode='rb') as gzip_fp:
+            meta = json.loads(gzip_fp.read().decode('utf-8'))
+        return meta, meta.pop('index')
+
+    @classmethod
+    def _read_meta(cls, fp):
+        # dump() writes the index after the metadata, so decompressing
+        # the beginning is enough unless the file was written otherwise
+        with gzip.GzipFile(fileobj=fp, mode='rb') as gzip_fp:
+            head = gzip_fp.read(PEEK_SIZE).decode('utf-8', 'ignore')
+        meta, sep, _ = head.partition(',"index":')
+        if sep:
+            try:
+                return json.loads(meta + '}')
+            except ValueError:
+                pass
+        fp.seek(0)
+        return cls._read(fp)[0]
+
+    def _apply(self, record):
+        name, key, *value = record
+        table = self._tables.get(name)
+        if table is None:
+            table = self._tables[name] = index.Table(
+                self._table_data.pop(name, {}))
+        if value:
+            table[key] = value[0]
+        else:
+            table.pop(key, None)
+
+    def _logger(self, name):
+        def log_change(key, value):
+            if value is None:
+                self._journal.append([name, key])
+            else:
+                self._journal.append([name, key, value])
+        return log_change
+
+
+class BinaryBackend(JsonBackend):
+    """The same as JsonBackend, but with a compact binary snapshot."""
+
+    name = 'binary'
+    version = 2
+
+    @classmethod
+    def dump(cls, filename, meta, index, tables):
+        meta = dict(meta, version=cls.version)
+        tables = {name: dict(table.items())
+                  for (name, table) in tables.items()}
+        if tables:
+            meta['tables'] = tables
+        locking.replace(filename,
+                        lambda fp: binary.dump(fp, meta, index.items()))
+
+    @staticmethod
+    def _read(fp):
+        return binary.load(fp)
+
+    @staticmethod
+    def _read_meta(fp):
+        return binary.load_meta(fp)
+
+
+class SqliteBackend:
+    """SQLite database, words are only read when they are looked up."""
+
+    name = 'sqlite'
+
+    SCHEMA = """
+        PRAGMA journal_mode = WAL;
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE words (id INTEGER PRIMARY KEY,
+                            word TEXT NOT NULL UNIQUE,
+                            meaning TEXT NOT NULL);
+    """
+
+    # the reverse index, formatted with the schema (main or temp)
+    MEANINGS_SCHEMA = """
+        CREATE TABLE %s.meanings (id INTEGER PRIMARY KEY,
+                                  meaning TEXT NOT NULL,
+                                  word TEXT NOT NULL,
+                                  UNIQUE (meaning, word));
+        CREATE INDEX %s.meanings_word ON meanings (word);
+    """
+
+    TABLES_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tables (name TEXT NOT NULL,
+                                           key TEXT NOT NULL,
+                                           value TEXT NOT NULL,
+                                           PRIMARY KEY (name, key));
+    """
+
+    def __init__(self, filename, buffered=False, read_only=False):
+        # changes are only committed on save() anyway
+        self.filename = filename
+        self.read_only = read_only
+        self._db = None
+        self._tables = {}
+
+    version = 1
+
+    @classmethod
+    def create(cls, filename, languages):
+        cls.dump(filename, {'languages': languages}, {}, {})
+
+    @classmethod
+    def dump(cls, filename, meta, index, tables):
+        """Write a new database with the contents of a store."""
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+        db = sqlite3.connect(filename)
+        try:
+            db.executescript(cls.SCHEMA + cls.MEANINGS_SCHEMA % ('main',
+                                                                 'main') +
+                             cls.TABLES_SCHEMA)
+            cls._write_meta(db, dict(meta, version=cls.version))
+            db.executemany('INSERT INTO words (word, meaning) '
+                           'VALUES (?, ?)', index.items())
+            cls._fill_meanings(db)
+            db.executemany('INSERT INTO tables (name, key, value) '
+                           'VALUES (?, ?, ?)',
+                           ((name, key, json.dumps(value))
+                            for (name, table) in tables.items()
+                            for (key, value) in table.items()))
+            db.commit()
+        finally:
+            db.close()
+
+    @classmethod
+    def peek(cls, filename):
+        """Read metadata (e.g. languages) without loading the words."""
+        db = cls._connect(filename, read_only=True)
+        try:
+            return cls._read_meta(db)
+        finally:
+            db.close()
+
+    def open(self):
+        self._db = self._connect(self.filename, self.read_only)
+        if not self._db.execute("SELECT 1 FROM sqlite_master "
+                                "WHERE name = 'meanings'").fetchone():
+            self._add_meanings()
+        return self._read_meta(self._db), index.SqliteIndex(self._db)
+
+    def table(self, name):
+        table = self._tables.get(name)
+        if table is None:
+            # stores created before named tables existed lack this table
+            if not self.read_only:
+                self._db.execute(self.TABLES_SCHEMA)
+            elif not self._db.execute("SELECT 1 FROM sqlite_master "
+                                      "WHERE name = 'tables'").fetchone():
+                return self._tables.setdefault(name, index.Table())
+            table = self._tables[name] = index.SqliteTable(self._db, name)
+        return table
+
+    def tables(self):
+        """All auxiliary tables by name."""
+        if self._db.execute("SELECT 1 FROM sqlite_master "
+                            "WHERE name = 'tables'").fetchone():
+            for (name,) in self._db.execute('SELECT DISTINCT name '
+                                            'FROM tables').fetchall():
+                self.table(name)
+        return dict(self._tables)
+
+    def save(self, store):
+        self._write_meta(self._db, store)
+        self._db.commit()
+
+    def snapshot(self, store):
+        # committing does not take long, nothing is left for later
+        self.save(store)
+
+    def compact(self, store):
+        self.save(store)
+        self._db.execute('VACUUM')
+
+    def set_buffered(self, buffered):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._db.close()
+
+    def _add_meanings(self):
+        # stores created before a word could have several meanings lack
+        # this table, readers build a temporary one
+        LOG.info("Adding the meanings of the words of %s", self.filename)
+        schema = 'temp' if self.read_only else 'main'
+        self._db.executescript(self.MEANINGS_SCHEMA % (schema, schema))
+        self._fill_meanings(self._db)
+        self._db.commit()
+
+    @staticmethod
+    def _fill_meanings(db):
+        words = db.execute('SELECT word, meaning FROM words '
+                           'ORDER BY id').fetchall()
+        db.executemany('INSERT INTO meanings (meaning, word) VALUES (?, ?)',
+                       index.meaning_pairs(words))
+
+    @staticmethod
+    def _connect(filename, read_only):
+        # callers serialize access, but may save from another thread
+        if read_only:
+            return sqlite3.connect(
+                'file:%s?mode=ro' %
+                urllib.request.pathname2url(os.path.abspath(filename)),
+                uri=True, check_same_thread=False)
+        return sqlite3.connect(filename, check_same_thread=False)
+
+    @staticmethod
+    def _read_meta(db):
+        return {key: json.loads(value) for (key, value)
+                in db.execute('SELECT key, value FROM meta')}
+
+    @staticmethod
+    def _write_meta(db, meta):
+        db.executemany('INSERT OR REPLACE INTO meta (key, value) '
+                       'VALUES (?, ?)',
+                       [(key, json.dumps(value))
+                        for (key, value) in meta.items()])
+
+
+BACKENDS = {backend.name: backend
+            for backend in (JsonBackend, BinaryBackend, SqliteBackend)}
+
+
+def detect(filename):
+    with open(filename, 'rb') as fp:
+        header = fp.read(max(len(SQLITE_MAGIC), len(binary.MAGIC)))
+    if header.startswith(SQLITE_MAGIC):
+        return SqliteBackend
+    if header.startswith(binary.MAGIC):
+        return BinaryBackend
+    return JsonBackend
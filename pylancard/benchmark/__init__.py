@@ -0,0 +1,162 @@
+"""Performance benchmarks.
+
+Run with::
+
+    python -m pylancard.benchmark --sizes 1000,100000 --output results.json
+    python -m pylancard.benchmark --sizes 1000,100000 --compare results.json
+
+Every case is timed on synthetic dictionaries of each size, the best of
+several runs is reported. With --compare, cases slower than the saved
+results by more than --threshold are reported and the exit code is 1.
+"""
+
+import argparse
+import contextlib
+import json
+import platform
+import sys
+import tempfile
+import time
+
+
+CASES = {}
+# Cases not depending on the dictionary size, run only once
+UNSIZED = set()
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+# Relative slowdown reported as a regression
+THRESHOLD = 0.2
+
+
+def case(name, sized=True):
+    """Register a benchmark case.
+
+    The case is a generator function taking (words, directory), doing
+    the setup and yielding the function to time and the number of
+    operations it does; whatever follows the yield is the teardown.
+    """
+    def register(function):
+        CASES[name] = contextlib.contextmanager(function)
+        if not sized:
+            UNSIZED.add(name)
+        return function
+    return register
+
+
+def generate(count):
+    return {'word%07d' % i: 'meaning %d' % i for i in range(count)}
+
+
+def run(names=None, sizes=DEFAULT_SIZES, repeat=3, report=None):
+    """Run cases (all by default), return a list of results."""
+    from . import cases  # noqa: registers the cases
+
+    names = sorted(CASES) if names is None else names
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            words = generate(size)
+            for name in names:
+                if name in UNSIZED and size != sizes[0]:
+                    continue
+                result = measure(name, words, directory, repeat)
+                if name in UNSIZED:
+                    result['size'] = None
+                results.append(result)
+                if report is not None:
+                    report(result)
+    return results
+
+
+def measure(name, words, directory, repeat=3):
+    best = ops = None
+    for _ in range(repeat):
+        with CASES[name](words, directory) as (function, ops):
+            started = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return {'name': name, 'size': len(words), 'ops': ops,
+            'seconds': best, 'per_op': best / ops}
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """Return (result, baseline seconds) for regressions.
+
+    Results without a counterpart in the baseline are ignored.
+    """
+    previous = {(x['name'], x['size']): x['seconds'] for x in baseline}
+    regressions = []
+    for result in results:
+        seconds = previous.get((result['name'], result['size']))
+        if seconds and result['seconds'] > seconds * (1 + threshold):
+            regressions.append((result, seconds))
+    return regressions
+
+
+def format_result(result):
+    return '%-28s %8s %8d %12.6f %12.3f' % (
+        result['name'], result['size'] or '-', result['ops'],
+        result['seconds'], result['per_op'] * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PyLanCard benchmarks")
+    parser.add_argument("names", nargs='*', metavar='CASE',
+                        help="cases to run (default: all), "
+                        "a name prefix selects several")
+    parser.add_argument("--sizes", default=','.join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated dictionary sizes "
+                        "(default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="best of this many runs is reported")
+    parser.add_argument("--output", metavar='FILE',
+                        help="save results as JSON")
+    parser.add_argument("--compare", metavar='FILE',
+                        help="compare with results saved by --output")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="relative slowdown reported as a regression "
+                        "(default: %(default)s)")
+    parser.add_argument("--list", action='store_true',
+                        help="list cases and exit")
+    args = parser.parse_args()
+
+    from . import cases  # noqa: registers the cases
+
+    if args.list:
+        print('\n'.join(sorted(CASES)))
+        return
+    names = sorted(name for name in CASES
+                   if not args.names or
+                   any(name.startswith(x) for x in args.names))
+    if not names:
+        parser.error("no such cases: %s" % ', '.join(args.names))
+    try:
+        sizes = [int(x) for x in args.sizes.split(',')]
+    except ValueError:
+        parser.error("sizes must be integers")
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)['results']
+
+    print('%-28s %8s %8s %12s %12s' %
+          ('case', 'size', 'ops', 'seconds', 'us/op'))
+    results = run(names, sizes, args.repeat,
+                  report=lambda result: print(format_result(result)))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'results': results}, fp, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for result, seconds in regressions:
+            print("REGRESSION: %s (size %s): %.6fs, was %.6fs (%+.0f%%)" %
+                  (result['name'], result['size'] or '-', result['seconds'],
+                   seconds, (result['seconds'] / seconds - 1) * 100))
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
@@ -0,0 +1,158 @@
+import itertools
+import os
+
+from pylancard import backends
+from pylancard import cli
+from pylancard import store
+from pylancard import trainer
+from pylancard import utils
+from pylancard.plugins import base
+from pylancard.plugins import cz
+
+from . import case
+
+
+# Operations done by the cases timing single calls
+OPERATIONS = 1000
+# Distinct words retyped by learners in the conversion cases
+VOCABULARY = 300
+CONVERSIONS = 10000
+
+
+def _dump(words, directory, format='json'):
+    filename = os.path.join(directory, 'store.%s' % format)
+    backends.BACKENDS[format].dump(
+        filename, {'languages': ['Oo', 'Oo'], 'revision': 0}, words, {})
+    # left by the previous case
+    try:
+        os.remove(filename + store.JOURNAL_SUFFIX)
+    except FileNotFoundError:
+        pass
+    return filename
+
+
+def _new_words(count):
+    return [('new%07d' % i, 'new meaning %d' % i) for i in range(count)]
+
+
+def _open_case(format):
+    def open_(words, directory):
+        filename = _dump(words, directory, format)
+        yield lambda: store.Store(filename, read_only=True).close(), 1
+    return open_
+
+
+def _compact_case(format):
+    def compact(words, directory):
+        with store.Store(_dump(words, directory, format)) as new_store:
+            yield new_store.compact, 1
+    return compact
+
+
+for _format in store.FORMATS:
+    case('store.open.%s' % _format)(_open_case(_format))
+    case('store.compact.%s' % _format)(_compact_case(_format))
+
+
+@case('store.save')
+def save(words, directory):
+    with store.Store(_dump(words, directory)) as new_store:
+        new_store.add_many(_new_words(OPERATIONS))
+        yield new_store.save, 1
+
+
+@case('store.add')
+def add(words, directory):
+    with store.Store(_dump(words, directory)) as new_store:
+        pairs = _new_words(OPERATIONS)
+
+        def run():
+            for word, meaning in pairs:
+                new_store.add(word, meaning)
+        yield run, len(pairs)
+
+
+@case('store.add_many')
+def add_many(words, directory):
+    with store.Store(_dump(words, directory)) as new_store:
+        pairs = _new_words(OPERATIONS)
+        yield lambda: new_store.add_many(pairs), len(pairs)
+
+
+@case('store.delete')
+def delete(words, directory):
+    with store.Store(_dump(words, directory)) as new_store:
+        deleted = list(itertools.islice(words, OPERATIONS))
+
+        def run():
+            for word in deleted:
+                new_store.delete(word)
+        yield run, len(deleted)
+
+
+@case('store.delete_many')
+def delete_many(words, directory):
+    with store.Store(_dump(words, directory)) as new_store:
+        deleted = list(itertools.islice(words, OPERATIONS))
+        yield lambda: new_store.delete_many(deleted), len(deleted)
+
+
+def _convert_case(plugin):
+    def convert(words, directory):
+        vocabulary = ['p~r`ili~s %d' % i for i in range(VOCABULARY)]
+        typed = [vocabulary[i % VOCABULARY] for i in range(CONVERSIONS)]
+        convert_word = plugin().convert_word
+
+        def run():
+            for word in typed:
+                convert_word(word)
+        yield run, len(typed)
+    return convert
+
+
+class _UncachedCzech(cz.Czech):
+    cache_size = 0
+
+
+case('convert_word.base', sized=False)(_convert_case(base.BaseLanguage))
+case('convert_word.cz', sized=False)(_convert_case(_UncachedCzech))
+case('convert_word.cz.cached', sized=False)(_convert_case(cz.Czech))
+
+
+def _trainer_init_case(spaced):
+    def init(words, directory):
+        with store.Store(_dump(words, directory)) as new_store:
+            yield (lambda: trainer.Trainer(new_store, spaced=spaced)), 1
+    return init
+
+
+def _trainer_next_case(spaced):
+    def next_(words, directory):
+        with store.Store(_dump(words, directory)) as new_store:
+            tr = trainer.Trainer(new_store, spaced=spaced)
+
+            def run():
+                for _ in range(OPERATIONS):
+                    tr.next()
+            yield run, OPERATIONS
+    return next_
+
+
+case('trainer.init')(_trainer_init_case(False))
+case('trainer.init.srs')(_trainer_init_case(True))
+case('trainer.next')(_trainer_next_case(False))
+case('trainer.next.srs')(_trainer_next_case(True))
+
+
+@case('matching_command', sized=False)
+def matching_command(words, directory):
+    typed = ['a', 'add!', 'del', 'l', 'fi', 'gr', 'imp', 'e', 'dir', 'r']
+    typed = [typed[i % len(typed)] for i in range(CONVERSIONS)]
+
+    def run():
+        for command in typed:
+            try:
+                utils.matching_command(command, cli.DEFAULT_COMMANDS)
+            except KeyError:
+                pass
+    yield run, len(typed)
@@ -0,0 +1,95 @@
+"""Compact binary snapshot of a store.
+
+The file starts with MAGIC followed by frames of ``kind`` (one byte),
+compressed ``size`` (uint32) and zlib-compressed payload:
+
+- ``M``: JSON object with metadata and auxiliary tables, comes first;
+- ``S``: up to CHUNK_SIZE words and meanings, alternating, UTF-8 encoded
+  and separated by NUL;
+- ``J``: the same as a JSON list of pairs, used when some word contains
+  NUL itself.
+
+Decoding a chunk is one decompress, decode and split call, which is
+several times faster than parsing the equivalent JSON.
+"""
+
+import itertools
+import json
+import struct
+import zlib
+
+
+MAGIC = b'PYLANCARD\x00'
+FRAME = struct.Struct('<cI')
+# Pairs per frame
+CHUNK_SIZE = 1 << 16
+# Compression level, speed matters more than size here
+LEVEL = 1
+SEPARATOR = '\0'
+
+
+def dump(fp, meta, items):
+    """Write meta (a JSON-compatible dict) and (word, meaning) items."""
+    fp.write(MAGIC)
+    _write_frame(fp, b'M', json.dumps(meta, ensure_ascii=False,
+                                      separators=(',', ':')))
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, CHUNK_SIZE))
+        if not chunk:
+            break
+        text = SEPARATOR.join(itertools.chain.from_iterable(chunk))
+        if text.count(SEPARATOR) == 2 * len(chunk) - 1:
+            _write_frame(fp, b'S', text)
+        else:
+            _write_frame(fp, b'J', json.dumps(chunk, ensure_ascii=False))
+
+
+def load(fp):
+    """Read a snapshot, return (meta, index dict)."""
+    if fp.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a binary store")
+    meta = None
+    index = {}
+    while True:
+        header = fp.read(FRAME.size)
+        if not header:
+            break
+        if len(header) != FRAME.size:
+            raise ValueError("Truncated frame header")
+        kind, size = FRAME.unpack(header)
+        data = fp.read(size)
+        if len(data) != size:
+            raise ValueError("Truncated frame")
+        payload = zlib.decompress(data).decode('utf-8')
+        if kind == b'S':
+            strings = iter(payload.split(SEPARATOR))
+            index.update(zip(strings, strings))
+        elif kind == b'J':
+            index.update(json.loads(payload))
+        elif kind == b'M':
+            meta = json.loads(payload)
+        else:
+            raise ValueError("Unknown frame kind %r" % kind)
+    if meta is None:
+        raise ValueError("Metadata is missing")
+    return meta, index
+
+
+def load_meta(fp):
+    """Read only the metadata of a snapshot."""
+    if fp.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a binary store")
+    header = fp.read(FRAME.size)
+    if len(header) != FRAME.size:
+        raise ValueError("Truncated frame header")
+    kind, size = FRAME.unpack(header)
+    if kind != b'M':
+        raise ValueError("Metadata is missing")
+    return json.loads(zlib.decompress(fp.read(size)).decode('utf-8'))
+
+
+def _write_frame(fp, kind, payload):
+    data = zlib.compress(payload.encode('utf-8'), LEVEL)
+    fp.write(FRAME.pack(kind, len(data)))
+    fp.write(data)
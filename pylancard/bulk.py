@@ -0,0 +1,151 @@
+import contextlib
+import csv
+import itertools
+import json
+import logging
+import os
+import sys
+
+
+LOG = logging.getLogger(__name__)
+
+FORMATS = ('tsv', 'csv', 'jsonl')
+
+BATCH_SIZE = 1000
+
+
+def detect_format(filename):
+    extension = os.path.splitext(filename)[1].lstrip('.').lower()
+    if extension in FORMATS:
+        return extension
+    if extension in ('txt', 'tab'):
+        return 'tsv'
+    if extension in ('json', 'ndjson'):
+        return 'jsonl'
+    if filename == '-':
+        return 'tsv'
+    raise ValueError("Cannot guess format of %s, use one of %s" %
+                     (filename, ', '.join(FORMATS)))
+
+
+def read_pairs(fp, format='tsv'):
+    """Yield (word, meaning) pairs from a text stream."""
+    if format == 'csv':
+        lines = enumerate(csv.reader(fp), 1)
+    elif format == 'tsv':
+        lines = ((lineno, line.rstrip('\r\n').split('\t'))
+                 for (lineno, line) in enumerate(fp, 1))
+    elif format == 'jsonl':
+        lines = ((lineno, _json_record(lineno, line))
+                 for (lineno, line) in enumerate(fp, 1))
+    else:
+        raise ValueError("Unknown format: %s" % format)
+
+    for lineno, fields in lines:
+        if not fields or fields == [''] or fields[0].startswith('#'):
+            continue
+        if len(fields) != 2:
+            raise ValueError("Line %d: expected word and meaning, got %r" %
+                             (lineno, fields))
+        word, meaning = (field.strip() for field in fields)
+        if not word or not meaning:
+            raise ValueError("Line %d: empty word or meaning" % lineno)
+        yield word, meaning
+
+
+def write_pairs(fp, pairs, format='tsv'):
+    if format == 'csv':
+        writer = csv.writer(fp)
+        for chunk in _chunks(pairs, BATCH_SIZE):
+            writer.writerows(chunk)
+        return
+    if format == 'tsv':
+        template = '%s\t%s\n'
+    elif format == 'jsonl':
+        pairs = ((json.dumps(word, ensure_ascii=False),
+                  json.dumps(meaning, ensure_ascii=False))
+                 for (word, meaning) in pairs)
+        template = '{"word": %s, "meaning": %s}\n'
+    else:
+        raise ValueError("Unknown format: %s" % format)
+    for chunk in _chunks(pairs, BATCH_SIZE):
+        fp.write(''.join(template % pair for pair in chunk))
+
+
+def import_file(store, filename, format=None, may_overwrite=False,
+                batch_size=BATCH_SIZE):
+    """Import words from a file, returns (added, skipped) counts.
+
+    The whole file is checked first, so a malformed one adds nothing.
+    Standard input (``-``) cannot be read twice: batches added before
+    a malformed line are kept.
+    """
+    format = format or detect_format(filename)
+    if filename != '-':
+        with _open(filename, 'r') as fp:
+            for _ in read_pairs(fp, format):
+                pass
+    added = skipped = 0
+    with _open(filename, 'r') as fp:
+        for batch in _chunks(read_pairs(fp, format), batch_size):
+            existing = store.add_many(batch, may_overwrite=may_overwrite)
+            skipped += len(existing)
+            added += len(batch) - len(existing)
+    LOG.info("Imported %d words from %s, %d skipped",
+             added, filename, skipped)
+    return added, skipped
+
+
+def export_file(store, filename, format=None):
+    """Export words sorted by the original word, returns their count.
+
+    The sorted view of the store is used, in-memory stores keep it for
+    later searches.
+    """
+    format = format or detect_format(filename)
+    count = 0
+
+    def counted(items):
+        nonlocal count
+        for item in items:
+            count += 1
+            yield item
+
+    with _open(filename, 'w') as fp:
+        write_pairs(fp, counted(store.sorted_items()), format)
+    LOG.info("Exported %d words to %s", count, filename)
+    return count
+
+
+def _json_record(lineno, line):
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        record = json.loads(line)
+    except ValueError as exc:
+        raise ValueError("Line %d: %s" % (lineno, exc))
+    if isinstance(record, dict):
+        try:
+            return [record['word'], record['meaning']]
+        except KeyError as exc:
+            raise ValueError("Line %d: missing key %s" % (lineno, exc))
+    return record
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@contextlib.contextmanager
+def _open(filename, mode):
+    if filename == '-':
+        yield sys.stdin if mode == 'r' else sys.stdout
+    else:
+        with open(filename, mode, encoding='utf-8', newline='') as fp:
+            yield fp
@@ -1,9 +1,18 @@
 import argparse
+import contextlib
+import cProfile
+import itertools
 import logging
 import os
+import pstats
 import shlex
 import sys
 
+from . import analytics
+from . import bulk
+from . import engine
+from . import plugins
+from . import stats
 from . import store
 from . import trainer
 from . import utils
@@ -11,6 +20,9 @@ from . import utils
 
 LOG = logging.getLogger(__name__)
 
+# Lines written to the terminal at once
+OUTPUT_CHUNK_SIZE = 1000
+
 
 HELP = """
 Welcome to PyLancard, tool for learning words.
@@ -21,18 +33,49 @@ Commands:
   Will never overwrite anything.
 > add! word1=meaning1 word2="quoted meaning2"
   The same as `add`, but will silently overwrite words.
+> add+ word1="meaning1; meaning2"
+  Add meanings to the ones words already have (or add the words).
+  Several meanings are separated by semicolons, an answer matching any
+  of them is correct.
 > delete word1 word2 ...
-  Delete given words from dictionary
-> list
-  List all words
+  Delete given words from dictionary (nothing is deleted if some of them
+  are not found)
+> list [filter=substring] [reverse=yes] [offset=N] [limit=N]
+  List all words (or meanings with reverse=yes) sorted, optionally
+  only the ones containing substring and only a page of them
+> find prefix [reverse=yes] [offset=N] [limit=N]
+  List words starting with prefix (meanings with reverse=yes)
+> grep substring [reverse=yes] [offset=N] [limit=N]
+  List words containing substring (meanings with reverse=yes)
+> import file.tsv [format]
+  Import words from a TSV, CSV or JSON lines file, format is guessed
+  from the extension if not given. Existing words are skipped, nothing
+  is imported from a malformed file.
+> import! file.tsv [format]
+  The same as `import`, but will silently overwrite words.
+> export file.tsv [format]
+  Export all words sorted to a TSV, CSV or JSON lines file.
+> alias [name=command ...]
+  Define short names for commands (e.g. `alias ls=list`), an empty
+  command removes the alias, without arguments list all aliases
+> stats [on|off|reset]
+  Show timings of operations, start or stop measuring them or forget
+  the ones measured so far
+> analytics [kind=direct|reverse] [learner=NAME] [limit=N]
+  Show error and response time statistics of training sessions and the
+  words with the most errors
 > help
   Display this help
 > quit
   Exit the program
-> direct
+> direct [srs] [fuzzy]
   Start direct training mode (translate from foreign language)
-> reverse
+> reverse [srs] [fuzzy]
   Start reverse training mode (translate to foreign language)
+  With `srs` words are asked using spaced repetition: the ones you are
+  due to review first, then a few new ones.
+  With `fuzzy` answers with missing diacritics are accepted, and with a
+  typo too if the word has at least 4 letters.
 
 When in training mode, commands are the following (note the slash):
 > /quit
@@ -45,11 +88,37 @@ Languages:
 """
 
 
-def add(command, store, arguments):
+def error(command, message, location=''):
+    """Report an error of a command, location is "file:line: " if any.
+
+    Commands report errors through their ``report`` argument, which is
+    this function unless they run in batch mode.
+    """
+    print("%sERROR: `%s`: %s" % (location, command, message))
+
+
+class _Reporter:
+    """Reports the errors of one line of a script and counts them."""
+
+    def __init__(self, location):
+        self.location = location
+        self.count = 0
+
+    def __call__(self, command, message):
+        self.count += 1
+        error(command, message, self.location)
+
+
+def add(command, store, arguments, report=error):
     try:
         words = utils.split_key_value(arguments)
     except ValueError as exc:
-        print("ERROR: `add`: %s" % exc)
+        report(command, exc)
+        return
+
+    if command == 'add+':
+        for word, meaning in words:
+            store.add_meanings(word, meaning)
         return
 
     may_overwrite = command.endswith('!')
@@ -60,124 +129,587 @@ def add(command, store, arguments):
             print(str(ex))
 
 
-def delete(command, store, arguments):
+def delete(command, store, arguments, report=error):
     # TODO: implement silent deletion
-    for word in arguments:
-        try:
-            store.delete(word.strip())
-        except KeyError:
-            print("ERROR: `delete`: word '%s' was not found" % word)
-            return
+    try:
+        store.delete_many([word.strip() for word in arguments])
+    except KeyError as exc:
+        for word in exc.args:
+            report(command, "word '%s' was not found" % word)
+
+
+def list_(command, store, arguments, report=error):
+    try:
+        unknown, options = utils.parse_options(
+            arguments, filter='', reverse=False, offset=0, limit=0)
+    except ValueError as exc:
+        report(command, exc)
+        return
+    if unknown:
+        report(command, "unknown arguments: %s" % ', '.join(unknown))
+        return
+
+    limit = options['limit'] or None
+    if options['filter']:
+        items = store.grep(options['filter'], reverse=options['reverse'],
+                           offset=options['offset'], limit=limit)
+    else:
+        items = store.sorted_items(reverse=options['reverse'],
+                                   offset=options['offset'])
+        if limit is not None:
+            items = itertools.islice(items, limit)
+    write_items(items)
+
+
+def write_items(items, chunk_size=OUTPUT_CHUNK_SIZE):
+    items = iter(items)
+    while True:
+        chunk = ''.join('%s\t%s\n' % item
+                        for item in itertools.islice(items, chunk_size))
+        if not chunk:
+            break
+        print(chunk, end='')
+
+
+PAGE_SIZE = 20
+
+
+def find(command, store, arguments, report=error):
+    try:
+        words, options = utils.parse_options(
+            arguments, reverse=False, offset=0, limit=PAGE_SIZE)
+    except ValueError as exc:
+        report(command, exc)
+        return
+    if len(words) != 1:
+        report(command, "exactly one search string expected")
+        return
+
+    search = store.grep if command == 'grep' else store.find
+    # one more to know whether there is another page
+    limit = options['limit']
+    found = search(words[0], reverse=options['reverse'],
+                   offset=options['offset'], limit=limit + 1)
+    write_items(found[:limit])
+    if len(found) > limit:
+        print("... more results, use offset=%d" %
+              (options['offset'] + limit))
+    elif not found:
+        print("Nothing found")
+
+
+def import_(command, store, arguments, report=error):
+    if not 1 <= len(arguments) <= 2:
+        report(command, "expected file name and optional format")
+        return
+    try:
+        added, skipped = bulk.import_file(
+            store, *arguments, may_overwrite=command.endswith('!'))
+    except (OSError, ValueError) as exc:
+        report(command, exc)
+        return
+    print("Imported %d words, skipped %d existing" % (added, skipped))
+
+
+def export(command, store, arguments, report=error):
+    if not 1 <= len(arguments) <= 2:
+        report(command, "expected file name and optional format")
+        return
+    try:
+        count = bulk.export_file(store, *arguments)
+    except (OSError, ValueError) as exc:
+        report(command, exc)
+        return
+    print("Exported %d words" % count)
+
 
+def stats_(command, store, arguments, report=error):
+    if arguments == ['on']:
+        stats.enable()
+    elif arguments == ['off']:
+        stats.disable()
+    elif arguments == ['reset']:
+        stats.reset()
+    elif arguments:
+        report(command, "expected on, off or reset")
+    elif not stats.enabled and not stats.metrics:
+        print("Nothing measured, use `stats on` to start measuring")
+    else:
+        print(stats.report(), end='')
 
-def list_(command, store, arguments):
-    for tpl in sorted(store.direct_index.items()):
-        print("%s\t%s" % tpl)
+
+def analytics_(command, store, arguments, report=error):
+    try:
+        unknown, options = utils.parse_options(
+            arguments, kind='', learner='', limit=10)
+    except ValueError as exc:
+        report(command, exc)
+        return
+    if unknown:
+        report(command, "unknown arguments: %s" % ', '.join(unknown))
+        return
+    if options['kind'] not in ('', trainer.DIRECT, trainer.REVERSE):
+        report(command, "expected kind direct or reverse")
+        return
+    if store.history is not None:
+        store.history.flush()
+    try:
+        result = analytics.analyze(
+            store.history_filename,
+            reverse=(options['kind'] == trainer.REVERSE
+                     if options['kind'] else None),
+            learner=options['learner'] or None)
+    except (OSError, ValueError) as exc:
+        report(command, exc)
+        return
+    print(analytics.report(result, options['limit']), end='')
 
 
-def help_(command, store, arguments):
+def help_(command, store, arguments, report=error):
     languages = ['%s: %s' % (x.__class__.__name__, x.help_text)
                  for x in (store.original_plugin, store.meaning_plugin)
                  if x is not None]
     print(HELP % dict(languages='\n\n'.join(languages)))
 
 
-def train(command, store, arguments):
+def train(command, store, arguments, report=error):
     class Stop(Exception):
         @classmethod
         def stop(cls, *args):
             raise cls()
 
-    tr = trainer.Trainer(store, command)
+    unknown = set(arguments) - {'srs', 'fuzzy'}
+    if unknown:
+        report(command, "unknown options: %s" % ', '.join(sorted(unknown)))
+        return
+    tr = trainer.Trainer(store, command, spaced='srs' in arguments,
+                         tolerant='fuzzy' in arguments)
+    # saving and the history are written in the background
+    session = engine.Engine(tr)
 
     def go_next(*args):
-        challenge = tr.next()
+        challenge = session.next()
         print("Next word: %s" % challenge)
         return challenge
 
     def check(word, *args):
-        if not tr.check(word):
+        if not session.check(word):
             print("Wrong, try again")
             return tr.challenge
         else:
+            if tr.near_miss is not None:
+                print("Almost, the correct answer is: %s" % tr.near_miss)
             return go_next()
 
-    train_commands = {
+    train_commands = utils.CommandTable({
         '/quit': Stop.stop,
         '/skip': go_next,
         None: check,  # the default
-    }
+    })
 
-    go_next()
     try:
+        try:
+            go_next()
+        except IndexError as exc:
+            report(command, exc)
+            return
         run(store, train_commands, tr.challenge)
     except (Stop, SystemExit):
         pass
+    finally:
+        session.close()
 
 
 def run(store, commands_set, prompt=''):
-    while True:
+    if not isinstance(commands_set, utils.CommandTable):
+        commands_set = utils.CommandTable(commands_set)
+    with _completion(commands_set):
+        while True:
+            try:
+                line = input('%s > ' % prompt)
+            except (EOFError, KeyboardInterrupt):
+                print()
+                sys.exit(0)
+            command, *arguments = shlex.split(line.strip())
+            if not command:
+                continue
+
+            try:
+                command, function = _lookup(command, commands_set)
+            except KeyError as exc:
+                print(str(exc))
+                print("Type ? for help")
+                continue
+
+            prompt = function(command, store, arguments) or ''
+
+
+@contextlib.contextmanager
+def _completion(commands_set):
+    """Complete command names with Tab if readline is in use."""
+    readline = sys.modules.get('readline')
+    if readline is None:
+        yield
+        return
+
+    def complete(text, state):
+        if readline.get_begidx() != 0:
+            return None
+        matches = commands_set.complete(text)
+        return matches[state] if state < len(matches) else None
+
+    completer = readline.get_completer()
+    delimiters = readline.get_completer_delims()
+    readline.set_completer(complete)
+    # training commands start with a slash
+    readline.set_completer_delims(' \t\n')
+    try:
+        yield
+    finally:
+        readline.set_completer(completer)
+        readline.set_completer_delims(delimiters)
+
+
+def _lookup(command, commands_set):
+    command, function = utils.matching_command(command, commands_set)
+    if stats.enabled:
+        name = command if command in commands_set else 'default'
+        function = stats.timed('command.%s' % name, function)
+    return command, function
+
+
+# Commands needing a terminal, refused in batch mode
+INTERACTIVE_COMMANDS = {'direct', 'reverse'}
+
+
+class _Batch:
+    """Pending run of consecutive add or delete lines of a script."""
+
+    def __init__(self, store):
+        self.store = store
+        self.command = None
+        self.lines = []
+
+    def append(self, location, command, arguments):
+        """Add a line, return the number of failed lines run meanwhile."""
+        failed = 0
+        if self.command != command:
+            failed = self.flush()
+            self.command = command
+        self.lines.append((location, arguments))
+        return failed
+
+    def flush(self):
+        """Run the pending lines, return the number of failed ones."""
+        command, lines = self.command, self.lines
+        self.command, self.lines = None, []
+        if not lines:
+            return 0
+        elif command == 'delete':
+            return self._delete(lines)
+        else:
+            return self._add(command, lines)
+
+    def _add(self, command, lines):
+        failed = set()
+        pairs, owners = [], []
+        for location, arguments in lines:
+            try:
+                words = utils.split_key_value(arguments)
+            except ValueError as exc:
+                error(command, exc, location)
+                failed.add(location)
+                continue
+            pairs.extend(words)
+            owners.extend(location for _ in words)
+
+        skipped = self.store.add_many(pairs,
+                                      may_overwrite=command.endswith('!'))
+        # skipped words come in order; of repeated words the first one
+        # may be added, so match them with their lines from the end
+        errors = []
+        for (word, _), location in zip(reversed(pairs), reversed(owners)):
+            if skipped and skipped[-1] == word:
+                skipped.pop()
+                errors.append((location, word))
+        for location, word in reversed(errors):
+            error(command, "This word already in dictionary: %s" % word,
+                  location)
+            failed.add(location)
+        return len(failed)
+
+    def _delete(self, lines):
+        lines = [(location, [word.strip() for word in arguments])
+                 for location, arguments in lines]
+        convert_word = self.store.original_plugin.convert_word
+        # a word repeated in several lines fails in all but the first
+        # one, delete_many would take it once
+        if len(lines) == 1 or _disjoint(
+                {convert_word(word) for word in arguments}
+                for _, arguments in lines):
+            try:
+                self.store.delete_many(
+                    itertools.chain.from_iterable(x[1] for x in lines))
+                return 0
+            except KeyError:
+                pass
+
+        # as if the lines were run one by one: a line deletes nothing
+        # if any of its words is missing or deleted by a previous line
+        deleted = set()
+        words = []
+        failed = 0
+        for location, arguments in lines:
+            keys = [convert_word(word) for word in arguments]
+            missing = [word for word, key in zip(arguments, keys)
+                       if key in deleted or key not in self.store.direct_index]
+            if missing:
+                for word in missing:
+                    error('delete', "word '%s' was not found" % word,
+                          location)
+                failed += 1
+            else:
+                deleted.update(keys)
+                words.extend(arguments)
+        self.store.delete_many(words, silent=True)
+        return failed
+
+
+def _disjoint(sets):
+    seen = set()
+    for keys in sets:
+        if not seen.isdisjoint(keys):
+            return False
+        seen |= keys
+    return True
+
+
+def run_batch(store, lines, name='<stdin>', commands_set=None):
+    """Run a script of commands, return the number of failed lines.
+
+    Consecutive add and delete lines are run as bulk operations, lines
+    after a failed one are still run.
+    """
+    if commands_set is None:
+        commands_set = store_commands(store)
+    elif not isinstance(commands_set, utils.CommandTable):
+        commands_set = utils.CommandTable(commands_set)
+    batch = _Batch(store)
+    failed = 0
+    for lineno, line in enumerate(lines, 1):
+        location = '%s:%d: ' % (name, lineno)
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
         try:
-            line = input('%s > ' % prompt)
-        except (EOFError, KeyboardInterrupt):
-            print()
-            sys.exit(0)
-        command, *arguments = shlex.split(line.strip())
-        if not command:
+            command, *arguments = shlex.split(line) or ['']
+            command, function = _lookup(command, commands_set)
+        except (KeyError, ValueError) as exc:
+            error(line.split()[0], exc.args[0], location)
+            failed += 1
             continue
 
-        try:
-            command, function = utils.matching_command(command, commands_set)
-        except KeyError as exc:
-            print(str(exc))
-            print("Type ? for help")
+        if command in ('add', 'add!', 'delete'):
+            failed += batch.append(location, command, arguments)
             continue
 
-        prompt = function(command, store, arguments) or ''
+        failed += batch.flush()
+        if command == 'quit':
+            return failed
+        if command in INTERACTIVE_COMMANDS:
+            error(command, "not available in batch mode", location)
+            failed += 1
+            continue
 
+        report = _Reporter(location)
+        function(command, store, arguments, report=report)
+        if report.count:
+            failed += 1
+    return failed + batch.flush()
 
-DEFAULT_COMMANDS = {
+
+def alias(command, store, arguments, report=error):
+    aliases = store.table('aliases')
+    if not arguments:
+        if aliases:
+            write_items(sorted(aliases.items()))
+        else:
+            print("No aliases defined")
+        return
+    try:
+        pairs = utils.split_key_value(arguments)
+    except ValueError as exc:
+        report(command, exc)
+        return
+
+    for name, target in pairs:
+        if not target:
+            aliases.pop(name, None)
+        elif name in DEFAULT_COMMANDS:
+            report(command, "%s is a command" % name)
+        else:
+            try:
+                target, _ = DEFAULT_COMMANDS.match(target)
+            except KeyError as exc:
+                report(command, exc.args[0])
+                continue
+            aliases[name] = target
+
+
+def store_commands(store):
+    """Default commands with the aliases defined in the store."""
+    return utils.CommandTable(DEFAULT_COMMANDS,
+                              aliases=store.table('aliases'))
+
+
+DEFAULT_COMMANDS = utils.CommandTable({
     'quit': lambda *_: sys.exit(0),
     '?': help_,
     'help': help_,
     'add': add,
     'add!': add,
+    'add+': add,
     'delete': delete,
     'list': list_,
+    'find': find,
+    'grep': find,
+    'import': import_,
+    'import!': import_,
+    'export': export,
+    'stats': stats_,
+    'analytics': analytics_,
+    'alias': alias,
     'direct': train,
     'reverse': train,
-}
+})
 
 
+# Functions shown by --cprofile
+PROFILE_LINES = 30
+
 LANGUAGE_PROMPT = """Data file does not exists, create?
 Input pair of languages (e.g. ru,cz) "
 or empty string to quit> """
 
 
 def main():
-    import readline  # noqa
+    import readline
+    readline.parse_and_bind('tab: complete')
 
     parser = argparse.ArgumentParser(description="PyLanCard command line")
     parser.add_argument("filename", type=str, help="data file name")
     parser.add_argument("--debug", action='store_true', help="debug mode")
+    parser.add_argument("--format", choices=store.FORMATS, default='json',
+                        help="format of a newly created data file "
+                        "(binary is faster to load and save, sqlite is "
+                        "better for very large dictionaries)")
+    parser.add_argument("--languages", type=str,
+                        help="pair of languages for a newly created data "
+                        "file (e.g. ru,cz), do not ask for them")
+    parser.add_argument("--import", dest='import_', metavar='FILE',
+                        action='append', default=[],
+                        help="import words from a TSV, CSV or JSON lines "
+                        "file (- for TSV on stdin) and exit")
+    parser.add_argument("--export", metavar='FILE',
+                        help="export words to a TSV, CSV or JSON lines "
+                        "file (- for TSV on stdout) and exit")
+    parser.add_argument("--batch", metavar='FILE',
+                        help="run commands from a file (- for stdin) "
+                        "and exit, the exit code is 1 if some of them "
+                        "failed")
+    parser.add_argument("--overwrite", action='store_true',
+                        help="overwrite existing words on --import")
+    parser.add_argument("--convert", choices=store.FORMATS,
+                        help="rewrite the data file in another format "
+                        "(e.g. to migrate an old json file to binary) "
+                        "and exit")
+    parser.add_argument("--autosave", type=int, default=0, metavar='N',
+                        help="save after every N changes instead of only "
+                        "on exit")
+    parser.add_argument("--autosave-interval", type=float, default=0,
+                        metavar='SECONDS',
+                        help="save changes older than this on the next "
+                        "change")
+    parser.add_argument("--profile", action='store_const', const='stats',
+                        help="measure operations and print their timings "
+                        "on exit")
+    parser.add_argument("--cprofile", dest='profile', action='store_const',
+                        const='cprofile',
+                        help="profile everything with cProfile and print "
+                        "the slowest functions on exit")
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARN)
 
+    profiler = None
+    if args.profile == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif args.profile:
+        stats.enable()
+    try:
+        _main(parser, args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats(
+                'cumulative').print_stats(PROFILE_LINES)
+        elif args.profile:
+            sys.stderr.write(stats.report())
+
+
+def _main(parser, args):
     if not os.path.exists(args.filename):
-        languages = input(LANGUAGE_PROMPT)
+        languages = args.languages or input(LANGUAGE_PROMPT)
         if not languages:
             sys.exit()
         languages = [s.strip() for s in languages.split(',')]
-        store.create(args.filename, languages)
+        store.create(args.filename, languages, format=args.format)
+
+    try:
+        if args.convert:
+            store.convert(args.filename, args.convert)
+            return
+        # a batch saves once when it is done
+        store_file = store.Store(args.filename, buffered=bool(args.batch))
+    except store.LockedError as exc:
+        parser.exit(1, "ERROR: %s\n" % exc)
+    store_file.autosave_changes = args.autosave
+    store_file.autosave_interval = args.autosave_interval
+
+    if args.batch:
+        with store_file:
+            if args.batch == '-':
+                failed = run_batch(store_file, sys.stdin)
+            else:
+                try:
+                    with open(args.batch) as fp:
+                        failed = run_batch(store_file, fp, args.batch)
+                except OSError as exc:
+                    parser.exit(1, "ERROR: %s\n" % exc)
+        if failed:
+            parser.exit(1, "%d command(s) failed\n" % failed)
+        return
+
+    if args.import_ or args.export:
+        with store_file:
+            try:
+                for filename in args.import_:
+                    bulk.import_file(store_file, filename,
+                                     may_overwrite=args.overwrite)
+                if args.export:
+                    bulk.export_file(store_file, args.export)
+            except (OSError, ValueError) as exc:
+                # files imported before the failed one are kept
+                parser.exit(1, "ERROR: %s\n" % exc)
+        return
 
-    with store.Store(args.filename) as store_file:
-        if not store_file.original_plugin.present:
-            LOG.warn("No plugin for language: %s", store_file.languages[0])
-        if not store_file.meaning_plugin.present:
-            LOG.warn("No plugin for language: %s", store_file.languages[1])
+    with store_file:
+        for language in store_file.languages:
+            if not plugins.registry.has(language):
+                LOG.warn("No plugin for language: %s", language)
 
-        run(store_file, DEFAULT_COMMANDS)
+        run(store_file, store_commands(store_file))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,121 @@
+"""Training loop core keeping store I/O away from the prompt.
+
+The interaction layer (the shell or any other front end) only calls
+next() and check(). During a session the changes and the history of the
+store are buffered: they are handed to the OS, autosaved and the next
+challenge is prepared on a background writer thread. The store and the
+trainer are only touched with the lock held, so the writer never sees
+them changing under it.
+
+Saving only holds the lock while the changes are taken from the store
+(see Store.snapshot()), the files are written without it, except for
+SQLite stores which commit right away.
+"""
+
+import logging
+import queue
+import threading
+
+
+LOG = logging.getLogger(__name__)
+
+
+class Writer:
+    """Background thread running submitted functions one at a time."""
+
+    def __init__(self, name='pylancard-writer'):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name,
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, function):
+        self._queue.put(function)
+
+    def wait(self):
+        """Wait until everything submitted so far has run."""
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            function = self._queue.get()
+            try:
+                if function is None:
+                    return
+                function()
+            except Exception:
+                LOG.exception("Background write failed")
+            finally:
+                self._queue.task_done()
+
+
+class Engine:
+    """Runs a trainer.Trainer, its store is saved on a Writer thread.
+
+    Until close(), the store is buffered and autosave hands saving over
+    to the writer.
+    """
+
+    def __init__(self, trainer_, writer=None):
+        self.trainer = trainer_
+        self.store = trainer_.store
+        self.lock = threading.Lock()
+        self._own_writer = writer is None
+        self._writer = Writer() if writer is None else writer
+        self._save_pending = False
+        self._buffered = self.store.buffered
+        self.store.set_buffered(True)
+        self.store.saver = self._schedule_save
+
+    def next(self):
+        with self.lock:
+            challenge = self.trainer.next()
+        self._writer.submit(self._prefetch)
+        self._writer.submit(self._flush)
+        return challenge
+
+    def check(self, answer):
+        with self.lock:
+            correct = self.trainer.check(answer)
+        self._writer.submit(self._flush)
+        return correct
+
+    def close(self):
+        """Wait for the background writes, restore the store."""
+        self._writer.wait()
+        if self._own_writer:
+            self._writer.close()
+        with self.lock:
+            self.store.saver = None
+            self.store.set_buffered(self._buffered)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _prefetch(self):
+        with self.lock:
+            self.trainer.prefetch()
+
+    def _flush(self):
+        with self.lock:
+            self.store.flush()
+
+    def _schedule_save(self):
+        # called by autosave with the lock held
+        if not self._save_pending:
+            self._save_pending = True
+            self._writer.submit(self._save)
+
+    def _save(self):
+        with self.lock:
+            self._save_pending = False
+            write = self.store.snapshot()
+        if write is not None:
+            write()
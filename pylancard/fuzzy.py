@@ -0,0 +1,63 @@
+import unicodedata
+
+
+# Characters of an accepted answer per allowed typo, so that short words
+# ("to", "do") are not accepted for each other
+CHARS_PER_EDIT = 4
+
+
+def fold(word):
+    """Strip diacritics and case: 'Příliš' -> 'prilis'."""
+    decomposed = unicodedata.normalize('NFKD', word)
+    return ''.join(char for char in decomposed
+                   if not unicodedata.combining(char)).casefold()
+
+
+def distance(first, second, limit):
+    """Levenshtein distance, or limit + 1 if it exceeds limit."""
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    previous = list(range(len(second) + 1))
+    for i, char1 in enumerate(first, 1):
+        current = [i]
+        for j, char2 in enumerate(second, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (char1 != char2)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+class Matcher:
+    """Tolerant matching of an answer against the accepted answers.
+
+    Folded forms are computed once when the matcher is created, so each
+    check is a dict lookup plus bounded edit distance on a few short words.
+    Up to max_distance typos are allowed, one per CHARS_PER_EDIT
+    characters of the accepted answer: answers shorter than that only
+    match up to diacritics and case.
+    """
+
+    def __init__(self, answers, max_distance=1):
+        self.max_distance = max_distance
+        self._folded = {}
+        for answer in answers:
+            self._folded.setdefault(fold(answer), answer)
+
+    def match(self, answer):
+        """Return the accepted answer close to answer or None."""
+        folded = fold(answer)
+        try:
+            return self._folded[folded]
+        except KeyError:
+            pass
+        best = None
+        best_distance = self.max_distance + 1
+        for candidate, original in self._folded.items():
+            limit = min(self.max_distance, len(candidate) // CHARS_PER_EDIT)
+            current = distance(folded, candidate, limit)
+            if current <= limit and current < best_distance:
+                best, best_distance = original, current
+        return best
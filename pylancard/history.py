@@ -0,0 +1,122 @@
+"""Append-only log of training answers.
+
+The file starts with MAGIC followed by records of a RECORD header (time
+of the answer in seconds since the epoch, latency in milliseconds, flags
+and the byte lengths of the learner, the challenge and the answer) and
+the UTF-8 encoded learner, challenge and answer. Skipped challenges are
+recorded with the SKIPPED flag and an empty answer.
+
+Records are only appended, reading them back is a sequential scan in
+fixed-size blocks, so the log can grow to millions of records.
+"""
+
+import collections
+import logging
+import struct
+
+
+LOG = logging.getLogger(__name__)
+
+MAGIC = b'PYLANCARD-HISTORY\x00'
+RECORD = struct.Struct('<dIBBHH')
+REVERSE = 1
+CORRECT = 2
+NEAR_MISS = 4
+SKIPPED = 8
+# Buffered records are written when they take more bytes
+FLUSH_SIZE = 1 << 16
+# Bytes read at once
+READ_SIZE = 1 << 20
+# Longest latency (in milliseconds) a record can hold
+MAX_LATENCY = (1 << 32) - 1
+
+Record = collections.namedtuple(
+    'Record', 'time latency flags learner challenge answer')
+
+
+class History:
+    """Writer of a history file, it is opened on the first record.
+
+    With buffered, records are only guaranteed to reach the file on
+    flush().
+    """
+
+    def __init__(self, filename, buffered=False):
+        self.filename = filename
+        self.buffered = buffered
+        self._fp = None
+        self._buffer = bytearray()
+
+    def append(self, time, latency, flags, challenge, answer='',
+               learner=None):
+        """Record an answer, latency is in seconds."""
+        learner = (learner or '').encode('utf-8')[:0xFF]
+        challenge = challenge.encode('utf-8')[:0xFFFF]
+        answer = answer.encode('utf-8')[:0xFFFF]
+        latency = min(max(int(latency * 1e3), 0), MAX_LATENCY)
+        self._buffer += RECORD.pack(time, latency, flags, len(learner),
+                                    len(challenge), len(answer))
+        self._buffer += learner + challenge + answer
+        if not self.buffered or len(self._buffer) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        if self._fp is None:
+            # whole records are written at once, so a crash of the
+            # process never leaves a torn one behind
+            self._fp = open(self.filename, 'ab', buffering=0)
+            if not self._fp.tell():
+                self._fp.write(MAGIC)
+        self._fp.write(self._buffer)
+        self._buffer.clear()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
+
+
+def read(filename):
+    """Iterate over the Records of a history file (none if missing)."""
+    try:
+        fp = open(filename, 'rb')
+    except FileNotFoundError:
+        return
+    with fp:
+        if fp.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a history file: %s" % filename)
+        unpack = RECORD.unpack_from
+        header_size = RECORD.size
+        data = b''
+        offset = 0
+        while True:
+            block = fp.read(READ_SIZE)
+            if not block:
+                break
+            data = data[offset:] + block
+            offset = 0
+            end = len(data)
+            while offset + header_size <= end:
+                (time, latency, flags, learner_size, challenge_size,
+                 answer_size) = unpack(data, offset)
+                start = offset + header_size
+                learner_end = start + learner_size
+                challenge_end = learner_end + challenge_size
+                record_end = challenge_end + answer_size
+                if record_end > end:
+                    break
+                yield Record(
+                    time, latency / 1e3, flags,
+                    str(data[start:learner_end], 'utf-8', 'replace')
+                    if learner_size else None,
+                    str(data[learner_end:challenge_end], 'utf-8', 'replace'),
+                    str(data[challenge_end:record_end], 'utf-8', 'replace'))
+                offset = record_end
+        if offset != len(data):
+            LOG.warning("Ignoring incomplete record at the end of history "
+                        "%s", filename)
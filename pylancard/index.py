@@ -0,0 +1,628 @@
+import collections.abc
+import itertools
+import json
+import logging
+
+from . import search
+
+
+LOG = logging.getLogger(__name__)
+
+# Separates several meanings of a word in its value
+SEPARATOR = ';'
+
+
+def split_meanings(value):
+    """Return the distinct meanings stored in a value."""
+    if SEPARATOR not in value:
+        return (value,)
+    meanings = tuple(dict.fromkeys(
+        meaning for meaning in map(str.strip, value.split(SEPARATOR))
+        if meaning))
+    return meanings or (value,)
+
+
+def join_meanings(meanings):
+    return ('%s ' % SEPARATOR).join(meanings)
+
+
+def meaning_pairs(items):
+    """(meaning, word) for every meaning of (word, value) items."""
+    for word, value in items:
+        for meaning in split_meanings(value):
+            yield meaning, word
+
+
+class Table(collections.abc.MutableMapping):
+    """Mapping notifying listeners about every modification.
+
+    Listeners are called as ``listener(key, value)`` after the change,
+    ``value`` being None for deletions.
+    """
+
+    def __init__(self, data=None):
+        self._data = {} if data is None else data
+        self.listeners = []
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._notify(key, value)
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self._notify(key, None)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self._data)
+
+    def copy(self):
+        return dict(self._data)
+
+    def _notify(self, key, value):
+        for listener in self.listeners:
+            listener(key, value)
+
+
+class _Slots:
+    """Dict-like storage keeping entries at dense positions.
+
+    Keys and values are kept in parallel lists, deletion moves the last
+    entry into the freed position.
+    """
+
+    __slots__ = ('keys', 'values', 'pos')
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.keys = list(data)
+        self.values = list(data.values())
+        self.pos = dict(zip(self.keys, range(len(self.keys))))
+
+    def get(self, key, default=None):
+        position = self.pos.get(key)
+        if position is None:
+            return default
+        return self.values[position]
+
+    def put(self, key, value):
+        position = self.pos.get(key)
+        if position is None:
+            self.pos[key] = len(self.keys)
+            self.keys.append(key)
+            self.values.append(value)
+        else:
+            self.values[position] = value
+
+    def remove(self, key):
+        position = self.pos.pop(key)
+        value = self.values[position]
+        last_key = self.keys.pop()
+        last_value = self.values.pop()
+        if position < len(self.keys):
+            self.keys[position] = last_key
+            self.values[position] = last_value
+            self.pos[last_key] = position
+        return value
+
+
+class _SlotsItemsView(collections.abc.ItemsView):
+
+    def __iter__(self):
+        slots = self._mapping._slots
+        return zip(slots.keys, slots.values)
+
+
+class _Searchable:
+    """Search methods of in-memory indexes, see search.KeySearch.
+
+    The sorted view of keys is built on first use and kept up to date
+    incrementally afterwards.
+    """
+
+    _search = None
+
+    def sorted_items(self, offset=0):
+        """Iterate over (key, value) pairs sorted by key."""
+        keys = self._searcher().sorted_keys()
+        return ((key, self[key])
+                for key in itertools.islice(keys, offset, None))
+
+    def find_prefix(self, prefix, offset=0, limit=None):
+        """Return sorted (key, value) pairs for keys starting with prefix."""
+        return [(key, self[key])
+                for key in self._searcher().prefix(prefix, offset, limit)]
+
+    def find_substring(self, substring, offset=0, limit=None):
+        """Return sorted (key, value) pairs for keys containing substring."""
+        return [(key, self[key]) for key
+                in self._searcher().substring(substring, offset, limit)]
+
+    def _searcher(self):
+        if self._search is None:
+            self._search = search.KeySearch(self)
+        return self._search
+
+
+class Index(_Searchable, Table):
+    """Word index, the inverse mapping is maintained in ``reverse``.
+
+    Entries have dense positions, see ``item_at``.
+    """
+
+    def __init__(self, data=None):
+        self.listeners = []
+        self._slots = _Slots(data)
+        self.reverse = ReverseIndex(zip(self._slots.keys,
+                                        self._slots.values))
+
+    def __getitem__(self, key):
+        return self._slots.values[self._slots.pos[key]]
+
+    def __contains__(self, key):
+        return key in self._slots.pos
+
+    def __iter__(self):
+        return iter(self._slots.keys)
+
+    def __len__(self):
+        return len(self._slots.keys)
+
+    def __setitem__(self, key, value):
+        old = self._slots.get(key)
+        if old is not None:
+            self.reverse._unlink(old, key)
+        elif self._search is not None:
+            self._search.touch(key)
+        self._slots.put(key, value)
+        self.reverse._link(value, key)
+        self._notify(key, value)
+
+    def __delitem__(self, key):
+        self.reverse._unlink(self._slots.remove(key), key)
+        if self._search is not None:
+            self._search.touch(key)
+        self._notify(key, None)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.copy())
+
+    def items(self):
+        return _SlotsItemsView(self)
+
+    def copy(self):
+        return dict(zip(self._slots.keys, self._slots.values))
+
+    @property
+    def positions(self):
+        """Number of positions addressable by item_at."""
+        return len(self._slots.keys)
+
+    def item_at(self, position):
+        """Return (key, value) at position, positions change on deletion."""
+        return self._slots.keys[position], self._slots.values[position]
+
+
+class ReverseIndex(_Searchable, collections.abc.Mapping):
+    """Read-only inverse of an Index: meaning -> words having it.
+
+    Every meaning of a value is a key of its own (see split_meanings).
+    Several words may share a meaning: item access returns the first of
+    them, ``originals`` returns all.
+    """
+
+    def __init__(self, items=()):
+        # Postings are the word itself for the common case of a meaning
+        # of one word, a tuple of the words otherwise. The words are the
+        # objects held by the direct index, so a posting costs no more
+        # than an integer id would.
+        data = {}
+        shared = []
+        for key, value in items:
+            if SEPARATOR in value:
+                meanings = split_meanings(value)
+            else:
+                meanings = (value,)
+            for meaning in meanings:
+                existing = data.setdefault(meaning, key)
+                if existing is key:
+                    continue
+                if isinstance(existing, list):
+                    existing.append(key)
+                else:
+                    data[meaning] = [existing, key]
+                    shared.append(meaning)
+        for meaning in shared:
+            data[meaning] = tuple(data[meaning])
+        self._slots = _Slots(data)
+
+    def __getitem__(self, key):
+        return self._first(self._slots.values[self._slots.pos[key]])
+
+    def __contains__(self, key):
+        return key in self._slots.pos
+
+    def __iter__(self):
+        return iter(self._slots.keys)
+
+    def __len__(self):
+        return len(self._slots.keys)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.copy())
+
+    def items(self):
+        return _ReverseItemsView(self)
+
+    def copy(self):
+        return dict(self.items())
+
+    def originals(self, key):
+        originals = self._slots.values[self._slots.pos[key]]
+        if isinstance(originals, tuple):
+            return originals
+        return (originals,)
+
+    @property
+    def positions(self):
+        return len(self._slots.keys)
+
+    def item_at(self, position):
+        return (self._slots.keys[position],
+                self._first(self._slots.values[position]))
+
+    @staticmethod
+    def _first(originals):
+        if isinstance(originals, tuple):
+            return originals[0]
+        return originals
+
+    def _link(self, value, key):
+        for meaning in split_meanings(value):
+            existing = self._slots.get(meaning)
+            if existing is None:
+                self._slots.put(meaning, key)
+                if self._search is not None:
+                    self._search.touch(meaning)
+            elif isinstance(existing, tuple):
+                if key not in existing:
+                    self._slots.put(meaning, existing + (key,))
+            elif existing != key:
+                self._slots.put(meaning, (existing, key))
+
+    def _unlink(self, value, key):
+        for meaning in split_meanings(value):
+            existing = self._slots.get(meaning)
+            if not isinstance(existing, tuple):
+                self._slots.remove(meaning)
+                if self._search is not None:
+                    self._search.touch(meaning)
+                continue
+            remaining = tuple(x for x in existing if x != key)
+            self._slots.put(meaning, remaining[0] if len(remaining) == 1
+                            else remaining)
+
+
+class _ReverseItemsView(collections.abc.ItemsView):
+
+    def __iter__(self):
+        slots = self._mapping._slots
+        first = self._mapping._first
+        return ((key, first(value))
+                for (key, value) in zip(slots.keys, slots.values))
+
+
+class SqliteTable(collections.abc.MutableMapping):
+    """Named table of JSON values stored in the ``tables`` SQLite table."""
+
+    def __init__(self, connection, name):
+        self._db = connection
+        self._name = name
+        self.listeners = []
+
+    def __getitem__(self, key):
+        row = self._db.execute('SELECT value FROM tables '
+                               'WHERE name = ? AND key = ?',
+                               (self._name, key)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __iter__(self):
+        for (key,) in self._db.execute('SELECT key FROM tables '
+                                       'WHERE name = ?', (self._name,)):
+            yield key
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM tables WHERE name = ?',
+                                (self._name,)).fetchone()[0]
+
+    def __setitem__(self, key, value):
+        self._db.execute('INSERT OR REPLACE INTO tables (name, key, value) '
+                         'VALUES (?, ?, ?)',
+                         (self._name, key, json.dumps(value)))
+        for listener in self.listeners:
+            listener(key, value)
+
+    def __delitem__(self, key):
+        cursor = self._db.execute('DELETE FROM tables '
+                                  'WHERE name = ? AND key = ?',
+                                  (self._name, key))
+        if not cursor.rowcount:
+            raise KeyError(key)
+        for listener in self.listeners:
+            listener(key, None)
+
+    def __repr__(self):
+        return '%s(%r, %d keys)' % (self.__class__.__name__, self._name,
+                                    len(self))
+
+    def items(self):
+        return _SqliteTableItemsView(self)
+
+    def copy(self):
+        return dict(self.items())
+
+
+class _SqliteTableItemsView(collections.abc.ItemsView):
+
+    def __iter__(self):
+        for key, value in self._mapping._db.execute(
+                'SELECT key, value FROM tables WHERE name = ?',
+                (self._mapping._name,)):
+            yield key, json.loads(value)
+
+
+class SqliteIndex(collections.abc.MutableMapping):
+    """Index stored in an SQLite table, nothing is loaded up front.
+
+    Expects table ``words (id INTEGER PRIMARY KEY, word TEXT UNIQUE,
+    meaning TEXT)`` and table ``meanings (id INTEGER PRIMARY KEY,
+    meaning TEXT, word TEXT, UNIQUE (meaning, word))`` with a row for
+    every meaning of a word (see split_meanings) and an index on ``word``.
+    Ids of both are kept dense (1..N) for item_at, deletion moves the last
+    row into the freed id.
+    """
+
+    def __init__(self, connection):
+        self._db = connection
+        self.listeners = []
+        self.reverse = SqliteReverseIndex(connection)
+        self._dense = False
+
+    def __getitem__(self, key):
+        row = self._db.execute('SELECT meaning FROM words WHERE word = ?',
+                               (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return row[0]
+
+    def __contains__(self, key):
+        return self._db.execute('SELECT 1 FROM words WHERE word = ?',
+                                (key,)).fetchone() is not None
+
+    def __iter__(self):
+        for (word,) in self._db.execute('SELECT word FROM words'):
+            yield word
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM words').fetchone()[0]
+
+    def __setitem__(self, key, value):
+        cursor = self._db.execute('UPDATE words SET meaning = ? '
+                                  'WHERE word = ?', (value, key))
+        if cursor.rowcount:
+            self._unlink(key)
+        else:
+            self._db.execute('INSERT INTO words (word, meaning) '
+                             'VALUES (?, ?)', (key, value))
+        self._db.executemany('INSERT INTO meanings (meaning, word) '
+                             'VALUES (?, ?)', meaning_pairs([(key, value)]))
+        for listener in self.listeners:
+            listener(key, value)
+
+    def __delitem__(self, key):
+        row = self._db.execute('SELECT id FROM words WHERE word = ?',
+                               (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        _delete_row(self._db, 'words', row[0])
+        self._unlink(key)
+        for listener in self.listeners:
+            listener(key, None)
+
+    def __repr__(self):
+        return '%s(%d words)' % (self.__class__.__name__, len(self))
+
+    @property
+    def positions(self):
+        """Number of positions addressable by item_at."""
+        if not self._dense:
+            _make_dense(self._db)
+            self._dense = True
+        return self._db.execute('SELECT IFNULL(MAX(id), 0) '
+                                'FROM words').fetchone()[0]
+
+    def item_at(self, position):
+        """Return (key, value) at position, positions change on deletion."""
+        row = self._db.execute('SELECT word, meaning FROM words '
+                               'WHERE id = ?', (position + 1,)).fetchone()
+        if row is None:
+            raise IndexError(position)
+        return row
+
+    def items(self):
+        return _SqliteItemsView(self)
+
+    def sorted_items(self, offset=0):
+        return iter(self._db.execute('SELECT word, meaning FROM words '
+                                     'ORDER BY word LIMIT -1 OFFSET ?',
+                                     (offset,)))
+
+    def find_prefix(self, prefix, offset=0, limit=None):
+        return self._db.execute(
+            'SELECT word, meaning FROM words WHERE word >= ? AND word < ? '
+            'ORDER BY word LIMIT ? OFFSET ?',
+            (prefix, prefix + search.MAX_CHAR, _limit(limit),
+             offset)).fetchall()
+
+    def find_substring(self, substring, offset=0, limit=None):
+        # a scan of the index on word, stopping as soon as the page is full
+        return self._db.execute(
+            'SELECT word, meaning FROM words WHERE instr(word, ?) > 0 '
+            'ORDER BY word LIMIT ? OFFSET ?',
+            (substring, _limit(limit), offset)).fetchall()
+
+    def copy(self):
+        return dict(self.items())
+
+    def _unlink(self, key):
+        # from the end, so that the rows moved into the freed ids are
+        # not the ones deleted next
+        for (row_id,) in self._db.execute('SELECT id FROM meanings '
+                                          'WHERE word = ? ORDER BY id DESC',
+                                          (key,)).fetchall():
+            _delete_row(self._db, 'meanings', row_id)
+
+
+class _SqliteItemsView(collections.abc.ItemsView):
+
+    def __iter__(self):
+        return iter(self._mapping._db.execute('SELECT word, meaning '
+                                              'FROM words'))
+
+
+class _SqliteReverseItemsView(collections.abc.ItemsView):
+
+    def __iter__(self):
+        # SQLite takes bare columns from the row holding the minimum
+        for meaning, word, _ in self._mapping._db.execute(
+                'SELECT meaning, word, MIN(id) FROM meanings '
+                'GROUP BY meaning'):
+            yield meaning, word
+
+
+class SqliteReverseIndex(collections.abc.Mapping):
+    """Inverse of an SqliteIndex read from its ``meanings`` table."""
+
+    def __init__(self, connection):
+        self._db = connection
+        self._dense = False
+
+    def __getitem__(self, key):
+        row = self._db.execute('SELECT word FROM meanings WHERE meaning = ? '
+                               'ORDER BY id LIMIT 1', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return row[0]
+
+    def __contains__(self, key):
+        return self._db.execute('SELECT 1 FROM meanings WHERE meaning = ?',
+                                (key,)).fetchone() is not None
+
+    def __iter__(self):
+        for (meaning,) in self._db.execute('SELECT DISTINCT meaning '
+                                           'FROM meanings'):
+            yield meaning
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(DISTINCT meaning) '
+                                'FROM meanings').fetchone()[0]
+
+    def __repr__(self):
+        return '%s(%d meanings)' % (self.__class__.__name__, len(self))
+
+    def items(self):
+        return _SqliteReverseItemsView(self)
+
+    def copy(self):
+        return dict(self.items())
+
+    @property
+    def positions(self):
+        """Number of positions, some of them are empty (see item_at)."""
+        if not self._dense:
+            _make_dense(self._db, 'meanings')
+            self._dense = True
+        return self._db.execute('SELECT IFNULL(MAX(id), 0) '
+                                'FROM meanings').fetchone()[0]
+
+    def item_at(self, position):
+        """Return (key, value) at position or None.
+
+        Positions are those of (meaning, word) rows, a meaning is only
+        found at the position of its first original.
+        """
+        row = self._db.execute('SELECT meaning, word FROM meanings '
+                               'WHERE id = ?', (position + 1,)).fetchone()
+        if row is None:
+            raise IndexError(position)
+        meaning, word = row
+        if self[meaning] != word:
+            return None
+        return meaning, word
+
+    def sorted_items(self, offset=0):
+        for meaning, word, _ in self._db.execute(
+                'SELECT meaning, word, MIN(id) FROM meanings '
+                'GROUP BY meaning ORDER BY meaning LIMIT -1 OFFSET ?',
+                (offset,)):
+            yield meaning, word
+
+    def find_prefix(self, prefix, offset=0, limit=None):
+        return [(meaning, word) for (meaning, word, _) in self._db.execute(
+            'SELECT meaning, word, MIN(id) FROM meanings '
+            'WHERE meaning >= ? AND meaning < ? '
+            'GROUP BY meaning ORDER BY meaning LIMIT ? OFFSET ?',
+            (prefix, prefix + search.MAX_CHAR, _limit(limit), offset))]
+
+    def find_substring(self, substring, offset=0, limit=None):
+        return [(meaning, word) for (meaning, word, _) in self._db.execute(
+            'SELECT meaning, word, MIN(id) FROM meanings '
+            'WHERE instr(meaning, ?) > 0 '
+            'GROUP BY meaning ORDER BY meaning LIMIT ? OFFSET ?',
+            (substring, _limit(limit), offset))]
+
+    def originals(self, key):
+        originals = tuple(word for (word,) in self._db.execute(
+            'SELECT word FROM meanings WHERE meaning = ? ORDER BY id', (key,)))
+        if not originals:
+            raise KeyError(key)
+        return originals
+
+
+def _limit(limit):
+    # negative LIMIT means no limit in SQLite
+    return -1 if limit is None else limit
+
+
+def _delete_row(db, table, row_id):
+    db.execute('DELETE FROM %s WHERE id = ?' % table, (row_id,))
+    db.execute('UPDATE %s SET id = ?1 WHERE id > ?1 AND '
+               'id = (SELECT MAX(id) FROM %s)' % (table, table), (row_id,))
+
+
+def _make_dense(db, table='words'):
+    # Stores written before ids were kept dense may have holes
+    count, top = db.execute('SELECT COUNT(*), IFNULL(MAX(id), 0) '
+                            'FROM %s' % table).fetchone()
+    if count == top:
+        return
+    LOG.info("Renumbering %d rows of %s", count, table)
+    ids = [row[0] for row in db.execute('SELECT id FROM %s ORDER BY id' %
+                                        table)]
+    # ascending order guarantees the new id is always free
+    db.executemany('UPDATE %s SET id = ? WHERE id = ?' % table,
+                   [(new, old) for (new, old) in enumerate(ids, 1)
+                    if new != old])
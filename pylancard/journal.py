@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import shutil
+
+
+LOG = logging.getLogger(__name__)
+
+
+class Journal:
+    """Append-only log of store modifications, one JSON record per line.
+
+    With buffered, records are only guaranteed to reach the file on sync().
+    A journal starts with a ``{"revision": N}`` header naming the revision
+    of the snapshot it applies to. Set revision to the one of the loaded
+    snapshot before replay(), an older journal is skipped.
+    """
+
+    def __init__(self, filename, buffered=False, read_only=False):
+        self.filename = filename
+        self.buffered = buffered
+        self.read_only = read_only
+        # revision of the snapshot new records apply to
+        self.revision = 0
+        # whether replay() skipped the journal as older than revision
+        self.stale = False
+        self._fp = None
+        try:
+            self.size = os.path.getsize(filename)
+        except OSError:
+            self.size = 0
+
+    def replay(self):
+        try:
+            fp = open(self.filename, 'rb')
+        except FileNotFoundError:
+            return
+
+        valid = 0
+        with fp:
+            for line in fp:
+                if not line.endswith(b'\n'):
+                    LOG.warning("Ignoring incomplete record at the end of "
+                                "journal %s", self.filename)
+                    break
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    LOG.warning("Ignoring corrupted record at the end of "
+                                "journal %s", self.filename)
+                    break
+                valid += len(line)
+                if not isinstance(record, dict):
+                    yield record
+                elif record['revision'] < self.revision:
+                    self.stale = True
+                    break
+                else:
+                    self.revision = record['revision']
+
+        if self.stale:
+            # Left behind by a crash after the snapshot was replaced, the
+            # snapshot already has its changes.
+            LOG.warning("Ignoring stale journal %s", self.filename)
+            if not self.read_only:
+                self.truncate()
+        elif valid != self.size and not self.read_only:
+            # Drop the torn tail, otherwise the next append would be glued
+            # to it and lost as well.
+            os.truncate(self.filename, valid)
+            self.size = valid
+
+    def append(self, record):
+        if self._fp is None:
+            self._fp = open(self.filename, 'ab')
+            if not self.size:
+                self._write({'revision': self.revision})
+        self._write(record)
+
+    def flush(self):
+        """Hand buffered records to the OS without waiting for the disk."""
+        if self._fp is not None:
+            self._fp.flush()
+
+    def sync(self):
+        self.flush()
+        self.fsync()
+
+    def fsync(self):
+        """Wait for the records handed to the OS to reach the disk."""
+        if self._fp is not None:
+            os.fsync(self._fp.fileno())
+
+    def rotate(self, filename, revision):
+        """Move the records to filename, new ones apply to revision.
+
+        Until the snapshot of revision is written, filename and the new
+        journal are replayed one after the other. Records already in
+        filename (a previous snapshot failed) are kept before the moved ones.
+        """
+        self.close()
+        if os.path.exists(filename):
+            if self.size:
+                with open(self.filename, 'rb') as fp, \
+                        open(filename, 'ab') as rotated:
+                    fp.readline()  # the header
+                    shutil.copyfileobj(fp, rotated)
+                os.remove(self.filename)
+        elif self.size:
+            os.replace(self.filename, filename)
+        else:
+            # an empty one, its presence tells the new journal is valid
+            with open(filename, 'wb') as fp:
+                fp.write(json.dumps({'revision': self.revision})
+                         .encode('utf-8') + b'\n')
+        self.size = 0
+        self.revision = revision
+
+    def truncate(self):
+        self.close()
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+        self.size = 0
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+        self._fp.write(line)
+        if not self.buffered:
+            self._fp.flush()
+        self.size += len(line)
@@ -0,0 +1,100 @@
+import logging
+import os
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+
+LOG = logging.getLogger(__name__)
+
+LOCK_SUFFIX = '.lock'
+
+
+class LockedError(OSError):
+    pass
+
+
+class ConflictError(OSError):
+    pass
+
+
+class FileLock:
+    """Advisory exclusive lock, held from acquire() until release().
+
+    The lock file itself is never removed: removing it would let another
+    process lock a new file while the old one is still locked.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._fd = None
+
+    def acquire(self):
+        if fcntl is None:
+            LOG.debug("File locking is not supported, %s is not locked",
+                      self.filename)
+            return
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise LockedError("%s is locked by another writer" %
+                              self.filename)
+        self._fd = fd
+
+    def release(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+
+
+def replace(filename, write):
+    """Atomically replace filename with the file written by write(fp).
+
+    The data is written to a temporary file next to filename and renamed
+    over it, so readers see either the old or the new file, never a part.
+    """
+    temporary = '%s.%d.tmp' % (filename, os.getpid())
+    try:
+        with open(temporary, 'wb') as fp:
+            write(fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(temporary, filename)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except FileNotFoundError:
+            pass
+        raise
+    _sync_directory(os.path.dirname(os.path.abspath(filename)))
+
+
+def identity(filename):
+    """What changes when filename is replaced or rewritten."""
+    stat = os.stat(filename)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _sync_directory(path):
+    # makes the rename itself durable; directories can't be opened on Windows
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,240 @@
+"""Re-normalization and validation of stores.
+
+Run with::
+
+    python -m pylancard.maintenance --jobs 4 FILE [FILE ...]
+
+Words and meanings are converted again with the current plugins (e.g.
+after fixing their patterns), meanings are deduplicated and entries
+are validated. Words collapsing onto the same converted word are merged,
+their meanings joined, and reported as conflicts. Conversion runs in a
+process pool, a chunk of words at a time; changed stores are rewritten
+atomically.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import functools
+import itertools
+import logging
+import os
+import sys
+
+from . import index
+from . import plugins
+from . import store
+
+
+LOG = logging.getLogger(__name__)
+
+# Words converted by a worker at once
+CHUNK_SIZE = 10000
+# Chunks submitted to the pool at once per worker
+CHUNKS_PER_JOB = 2
+# Characters breaking the text formats of the bulk module
+FORBIDDEN = '\t\n\r'
+
+
+class Report:
+    """What normalization found (and did) in one store."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.words = 0
+        # words or meanings changed by the conversion
+        self.changed = 0
+        # words merged into another one with the same meanings
+        self.duplicates = 0
+        # (word, originals, merged meaning) of words merged into another
+        # one with other meanings
+        self.conflicts = []
+        # (word, problem) of entries failing validation
+        self.invalid = []
+        self.written = False
+        self.error = None
+
+    @property
+    def failed(self):
+        return self.error is not None or bool(self.invalid)
+
+
+def normalize_value(value):
+    if index.SEPARATOR in value:
+        return index.join_meanings(index.split_meanings(value))
+    return value
+
+
+def normalize_chunk(languages, pairs):
+    """Convert (word, meaning) pairs, runs in worker processes.
+
+    Returns (changes, invalid): (word, new word, new meaning) of changed
+    entries and (word, problem) of invalid ones.
+    """
+    original = plugins.registry.get(languages[0])
+    meaning_plugin = plugins.registry.get(languages[1])
+    words = original.convert_words([word for (word, _) in pairs])
+    meanings = meaning_plugin.convert_words(
+        [normalize_value(meaning) for (_, meaning) in pairs])
+    changes = []
+    invalid = []
+    for (word, meaning), new_word, new_meaning in zip(pairs, words,
+                                                      meanings):
+        new_meaning = normalize_value(new_meaning)
+        if new_word != word or new_meaning != meaning:
+            changes.append((word, new_word, new_meaning))
+        if not new_word.strip():
+            invalid.append((word, "empty word"))
+        elif not new_meaning.strip():
+            invalid.append((word, "empty meaning"))
+        elif any(char in FORBIDDEN for char in new_word + new_meaning):
+            invalid.append((word, "tab or line break"))
+    return changes, invalid
+
+
+def normalize(filenames, jobs=None, chunk_size=CHUNK_SIZE, dry_run=False):
+    """Normalize stores, return a Report for each of them.
+
+    With jobs=1 everything runs in this process.
+    """
+    if jobs == 1:
+        return [_normalize(filename, map, chunk_size, dry_run)
+                for filename in filenames]
+    jobs = jobs or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        # executor.map() would submit (and copy) all chunks up front
+        map_ = functools.partial(_map_bounded, executor,
+                                 CHUNKS_PER_JOB * jobs)
+        return [_normalize(filename, map_, chunk_size, dry_run)
+                for filename in filenames]
+
+
+def _map_bounded(executor, limit, function, iterable):
+    """The same as executor.map, with at most limit calls pending."""
+    pending = collections.deque()
+    for item in iterable:
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+        pending.append(executor.submit(function, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+def _normalize(filename, map_, chunk_size, dry_run):
+    report = Report(filename)
+    try:
+        opened = store.Store(filename, read_only=dry_run)
+    except (OSError, ValueError) as exc:
+        report.error = str(exc)
+        return report
+    with opened:
+        words = opened.direct_index
+        report.words = len(words)
+        items = iter(words.items())
+        chunks = iter(lambda: list(itertools.islice(items, chunk_size)), [])
+        changes = []
+        for chunk_changes, invalid in map_(
+                functools.partial(normalize_chunk, opened.languages),
+                chunks):
+            changes.extend(chunk_changes)
+            report.invalid.extend(invalid)
+        report.changed = len(changes)
+        if not changes:
+            return report
+
+        result = _merge(words, changes, report)
+        tables = _rekey(opened)
+        LOG.info("%s: %d changed, %d duplicates, %d conflicts", filename,
+                 report.changed, report.duplicates, len(report.conflicts))
+        if not dry_run:
+            store.rewrite(opened, result, tables)
+            report.written = True
+    return report
+
+
+def _merge(words, changes, report):
+    result = dict(words.items())
+    moved = []
+    for word, new_word, new_meaning in changes:
+        if new_word == word:
+            result[word] = new_meaning
+        else:
+            del result[word]
+            moved.append((word, new_word, new_meaning))
+
+    originals = {}
+    for word, new_word, new_meaning in moved:
+        existing = result.get(new_word)
+        if existing is None:
+            result[new_word] = new_meaning
+            originals[new_word] = [word]
+            continue
+        sources = originals.setdefault(new_word, [new_word])
+        sources.append(word)
+        old = index.split_meanings(existing)
+        new = index.split_meanings(new_meaning)
+        if set(new) <= set(old):
+            report.duplicates += 1
+            continue
+        merged = index.join_meanings(dict.fromkeys(old + new))
+        result[new_word] = merged
+        report.conflicts.append((new_word, list(sources), merged))
+    return result
+
+
+def _rekey(opened):
+    """Tables with review states keyed by converted words or meanings."""
+    tables = {}
+    for name, table in opened.tables().items():
+        if name.startswith('reviews.direct'):
+            convert = opened.original_plugin.convert_word
+        elif name.startswith('reviews.reverse'):
+            convert = opened.meaning_plugin.convert_word
+        else:
+            tables[name] = table
+            continue
+        rekeyed = {}
+        for key, value in table.items():
+            # of several states of merged words the first one is kept
+            rekeyed.setdefault(convert(key), value)
+        tables[name] = rekeyed
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-normalize and validate PyLanCard data files")
+    parser.add_argument("filenames", nargs='+', metavar='FILE',
+                        help="data file to normalize")
+    parser.add_argument("--jobs", type=int,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="words converted by a worker at once")
+    parser.add_argument("--dry-run", action='store_true',
+                        help="only report, do not change the files")
+    parser.add_argument("--debug", action='store_true', help="debug mode")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARN)
+    reports = normalize(args.filenames, args.jobs, args.chunk_size,
+                        args.dry_run)
+    for report in reports:
+        if report.error is not None:
+            print("%s: ERROR: %s" % (report.filename, report.error))
+            continue
+        print("%s: %d words, %d changed, %d duplicates, %d conflicts, "
+              "%d invalid%s" %
+              (report.filename, report.words, report.changed,
+               report.duplicates, len(report.conflicts),
+               len(report.invalid), ', written' if report.written else ''))
+        for word, originals, merged in report.conflicts:
+            print("  conflict: %s <- %s: %s" %
+                  (word, ', '.join(originals), merged))
+        for word, problem in report.invalid:
+            print("  invalid: %r: %s" % (word, problem))
+    if any(report.failed for report in reports):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""Many stores in one process.
+
+Stores are opened on first use and closed again when the estimated
+memory used by the open ones exceeds the budget, the least recently used
+first. Plugins (and so their conversion caches) are shared by all stores
+with the same language through plugins.registry.
+"""
+
+import collections
+import itertools
+import logging
+import os
+import sys
+
+from . import index
+from . import store
+
+
+LOG = logging.getLogger(__name__)
+
+# Words measured to estimate the memory used by a store
+SAMPLE_SIZE = 100
+# Bytes used by a word in the direct and the reverse index besides the
+# strings themselves
+ENTRY_OVERHEAD = 200
+
+
+class StoreManager:
+    """Opens stores by name (the base name of their file) when needed.
+
+    Stores are only closed when nobody uses them: acquire() a store to
+    keep it open, release() it when done.
+    """
+
+    def __init__(self, filenames, memory_budget=None, buffered=False,
+                 on_close=None):
+        self.filenames = {}
+        for filename in filenames:
+            name = os.path.basename(filename)
+            if name in self.filenames:
+                raise ValueError("Duplicate store name: %s" % name)
+            self.filenames[name] = filename
+        self.memory_budget = memory_budget
+        self.buffered = buffered
+        # called with (name, store) before a store is closed
+        self.on_close = on_close
+        self._stores = collections.OrderedDict()
+        self._users = collections.Counter()
+        self._languages = {}
+
+    def __contains__(self, name):
+        return name in self.filenames
+
+    def __iter__(self):
+        return iter(self.filenames)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def languages(self, name):
+        """Languages of a store, read without loading its words."""
+        languages = self._languages.get(name)
+        if languages is None:
+            meta = store.peek(self.filenames[name])
+            languages = self._languages[name] = tuple(meta['languages'])
+        return languages
+
+    def is_open(self, name):
+        return name in self._stores
+
+    def get(self, name):
+        """Return the store, open it if needed (KeyError if unknown)."""
+        try:
+            self._stores.move_to_end(name)
+            return self._stores[name]
+        except KeyError:
+            pass
+        return self.put(name, self.open(name))
+
+    def open(self, name):
+        """Open the store without keeping it (KeyError if unknown).
+
+        Only reads the file, so it may run on another thread. The store
+        is given to put() or closed.
+        """
+        filename = self.filenames[name]
+        LOG.debug("Opening store %s", name)
+        return store.Store(filename, buffered=self.buffered)
+
+    def put(self, name, opened):
+        """Keep a store returned by open(), return it."""
+        self._stores[name] = opened
+        self._languages[name] = opened.languages
+        self.evict(keep=name)
+        return opened
+
+    def acquire(self, name):
+        opened = self.get(name)
+        self._users[name] += 1
+        return opened
+
+    def release(self, name):
+        self._users[name] -= 1
+        if self._users[name] <= 0:
+            del self._users[name]
+
+    def memory_usage(self):
+        """Estimated bytes used by the open stores by name."""
+        return {name: _estimate(opened)
+                for (name, opened) in self._stores.items()}
+
+    def evict(self, keep=None):
+        """Close idle stores until the open ones fit into the budget."""
+        if self.memory_budget is None:
+            return
+        usage = self.memory_usage()
+        total = sum(usage.values())
+        for name in list(self._stores):
+            if total <= self.memory_budget:
+                break
+            if name == keep or self._users[name]:
+                continue
+            LOG.info("Closing idle store %s to free memory", name)
+            self.close(name)
+            total -= usage[name]
+
+    def lookup(self, language, word):
+        """Meanings of word of language in all stores as {name: meaning}.
+
+        Only the stores having the language are opened.
+        """
+        found = {}
+        for name in self.filenames:
+            languages = self.languages(name)
+            if language not in languages:
+                continue
+            opened = self.acquire(name)
+            try:
+                meaning = find_meaning(opened, language, word)
+            finally:
+                self.release(name)
+            if meaning is not None:
+                found[name] = meaning
+        self.evict()
+        return found
+
+    def save(self):
+        for opened in self._stores.values():
+            opened.save()
+
+    def close(self, name=None):
+        """Close a store (all stores by default)."""
+        names = list(self._stores) if name is None else [name]
+        for name in names:
+            opened = self._stores.pop(name)
+            self._users.pop(name, None)
+            try:
+                if self.on_close is not None:
+                    self.on_close(name, opened)
+            finally:
+                opened.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def find_meaning(opened, language, word):
+    """Meaning of word of language in a store, None if not found."""
+    meaning = None
+    if opened.languages[0] == language:
+        key = opened.original_plugin.convert_word(word)
+        meaning = opened.direct_index.get(key)
+    if meaning is None and opened.languages[1] == language:
+        key = opened.meaning_plugin.convert_word(word)
+        meaning = opened.reverse_index.get(key)
+    return meaning
+
+
+def _estimate(opened):
+    words = opened.direct_index
+    # SQLite stores only keep the words looked up recently
+    if not isinstance(words, index.Index) or not words:
+        return 0
+    sample = list(itertools.islice(words.items(), SAMPLE_SIZE))
+    strings = sum(sys.getsizeof(word) + sys.getsizeof(meaning)
+                  for (word, meaning) in sample)
+    return len(words) * (strings // len(sample) + ENTRY_OVERHEAD)
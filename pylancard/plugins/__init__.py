@@ -0,0 +1,93 @@
+"""Language plugins.
+
+A plugin for a language is a module of this package named after the
+language (e.g. ``cz``) or an entry point named after the language in the
+``pylancard.plugins`` group, both providing ``create_plugin``: a callable
+returning a ``base.BaseLanguage`` instance. Plugin instances are shared by
+all stores, so they get None instead of a store.
+"""
+
+import importlib
+import importlib.metadata
+import logging
+import pkgutil
+
+from . import base
+
+
+LOG = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = 'pylancard.plugins'
+
+
+class Registry:
+    """Discovers plugins once, imports and creates them on first use."""
+
+    def __init__(self, package=__name__, group=ENTRY_POINT_GROUP):
+        self._package = package
+        self._group = group
+        self._loaders = None
+        self._plugins = {}
+        # shared by all languages without a plugin
+        self._identity = base.BaseLanguage(None)
+
+    def available(self):
+        """Return the sorted list of languages having a plugin."""
+        return sorted(self._discover())
+
+    def has(self, language):
+        return language in self._discover()
+
+    def get(self, language):
+        plugin = self._plugins.get(language)
+        if plugin is None:
+            load = self._discover().get(language)
+            if load is None:
+                LOG.info("No plugin for language %s", language)
+                plugin = self._identity
+            else:
+                plugin = load()(None)
+                LOG.info("Class of %s language plugin: %s",
+                         language, plugin.__class__)
+            self._plugins[language] = plugin
+        return plugin
+
+    def loaded(self):
+        """Plugins created so far by language."""
+        return dict(self._plugins)
+
+    def invalidate(self):
+        """Forget discovered plugins, e.g. after installing new ones."""
+        self._loaders = None
+        self._plugins.clear()
+
+    def _discover(self):
+        if self._loaders is None:
+            loaders = {}
+            package = importlib.import_module(self._package)
+            for module in pkgutil.iter_modules(package.__path__):
+                if module.name != 'base':
+                    loaders[module.name] = self._module_loader(module.name)
+            # installed plugins take precedence over the bundled ones
+            for entry_point in _entry_points(self._group):
+                loaders[entry_point.name] = entry_point.load
+            LOG.debug("Discovered plugins: %s", ', '.join(sorted(loaders)))
+            self._loaders = loaders
+        return self._loaders
+
+    def _module_loader(self, name):
+        def load():
+            module = importlib.import_module('%s.%s' % (self._package, name))
+            return module.create_plugin
+        return load
+
+
+def _entry_points(group):
+    points = importlib.metadata.entry_points()
+    if hasattr(points, 'select'):
+        return points.select(group=group)
+    # Python < 3.10
+    return points.get(group, ())
+
+
+registry = Registry()
@@ -1,17 +1,148 @@
+import collections
+import functools
+import itertools
+import re
+
+
+def compile_patterns(patterns):
+    """Compile replacement patterns into a single-pass converter.
+
+    At every position the longest matching pattern wins, replacements are
+    never rescanned. Returns None for empty patterns.
+    """
+    if not patterns:
+        return None
+    patterns = dict(patterns)
+    regex = re.compile('|'.join(re.escape(pattern) for pattern
+                                in sorted(patterns, key=len, reverse=True)))
+
+    def replace(match):
+        return patterns[match.group()]
+
+    # partial, unlike a function, does not become a method on classes
+    return functools.partial(regex.sub, replace)
+
+
+class Patterns(dict):
+    """Replacement patterns counting their modifications in ``version``."""
+
+    version = 0
+
+    def _modified(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            self.version += 1
+            return method(self, *args, **kwargs)
+        return wrapper
+
+    __setitem__ = _modified(dict.__setitem__)
+    __delitem__ = _modified(dict.__delitem__)
+    clear = _modified(dict.clear)
+    pop = _modified(dict.pop)
+    popitem = _modified(dict.popitem)
+    setdefault = _modified(dict.setdefault)
+    update = _modified(dict.update)
+    del _modified
+
+
+class ConvertCache:
+    """Bounded LRU mapping of words to converted words."""
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = self.misses = self.evictions = 0
+        # converter generation the cached words were converted with
+        self.generation = None
+        self._data = collections.OrderedDict()
+
+    def get(self, word):
+        try:
+            converted = self._data[word]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data.move_to_end(word)
+        self.hits += 1
+        return converted
+
+    def put(self, word, converted):
+        self._data[word] = converted
+        if len(self._data) > self.size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {'size': len(self._data), 'capacity': self.size,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+
+_generations = itertools.count()
+
+
 class BaseLanguage:
 
     help_text = ""
 
     patterns = {}
 
-    def __init__(self, store):
+    # Number of converted words to remember, 0 disables the cache
+    cache_size = 0
+
+    _converter = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._compile()
+
+    def __init__(self, store=None):
         self.store = store
+        self.cache = ConvertCache(self.cache_size) if self.cache_size else None
 
     def convert_word(self, word):
-        for pattern, replace in self.patterns.items():
-            word = word.replace(pattern, replace)
-        return word
+        cls = self.__class__
+        patterns = cls.patterns
+        if (patterns is not cls._compiled_patterns or
+                patterns.version != cls._compiled_version):
+            cls._compile()
+
+        cache = self.cache
+        if cache is None:
+            if cls._converter is None:
+                return word
+            return cls._converter(word)
+
+        if cache.generation != cls._generation:
+            cache.clear()
+            cache.generation = cls._generation
+        converted = cache.get(word)
+        if converted is None:
+            converted = word
+            if cls._converter is not None:
+                converted = cls._converter(word)
+            cache.put(word, converted)
+        return converted
+
+    def convert_words(self, words):
+        convert = self.convert_word
+        return [convert(word) for word in words]
 
     @property
     def present(self):
         return self.__class__ is not BaseLanguage
+
+    @classmethod
+    def _compile(cls):
+        # patterns may be replaced or modified in place at any time
+        if not isinstance(cls.patterns, Patterns):
+            cls.patterns = Patterns(cls.patterns)
+        cls._converter = compile_patterns(cls.patterns)
+        cls._compiled_patterns = cls.patterns
+        cls._compiled_version = cls.patterns.version
+        cls._generation = next(_generations)
+
+
+BaseLanguage._compile()
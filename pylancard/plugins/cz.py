@@ -25,6 +25,8 @@ class Czech(base.BaseLanguage):
         "~z": "ž",
     }
 
+    cache_size = 1024
+
     help_text = HELP % '\n'.join('- %s = %s' % item
                                  for item in patterns.items())
 
@@ -0,0 +1,87 @@
+import heapq
+import logging
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+# Failed words are asked again after this number of seconds
+RETRY_DELAY = 10 * 60
+# New words introduced per session
+NEW_WORDS = 20
+
+MIN_EASINESS = 1.3
+DEFAULT_EASINESS = 2.5
+
+
+class Scheduler:
+    """SM-2 spaced repetition schedule for one direction of a store.
+
+    Review states are kept in ``reviews`` as ``[due, interval, repetitions,
+    easiness]`` lists keyed by challenge, interval being in days.
+    Reviewed words are kept in a heap by due time, words never reviewed
+    are taken from the index only when nothing is due.
+    """
+
+    def __init__(self, index, reviews, new_words=NEW_WORDS, clock=time.time):
+        self._index = index
+        self._reviews = reviews
+        self._clock = clock
+        self._new_words = new_words
+        self._heap = [(state[0], key) for (key, state) in reviews.items()]
+        heapq.heapify(self._heap)
+        self._unseen = (key for key in index if key not in reviews)
+        LOG.debug("%d reviewed words in the schedule", len(self._heap))
+
+    def next(self):
+        """Return the next challenge: due, new or the earliest upcoming."""
+        self._drop_stale()
+        if self._heap and self._heap[0][0] <= self._clock():
+            return self._heap[0][1]
+
+        if self._new_words > 0:
+            for key in self._unseen:
+                if key not in self._reviews:
+                    self._new_words -= 1
+                    return key
+
+        if self._heap:
+            # nothing is due, learn ahead
+            return self._heap[0][1]
+        raise IndexError("No words to train")
+
+    def record(self, key, quality):
+        """Record an answer of quality from 0 (blackout) to 5 (perfect)."""
+        due, interval, repetitions, easiness = self._reviews.get(
+            key, (None, 0, 0, DEFAULT_EASINESS))
+        now = self._clock()
+        if quality < 3:
+            repetitions = interval = 0
+            due = now + RETRY_DELAY
+        else:
+            if repetitions == 0:
+                interval = 1
+            elif repetitions == 1:
+                interval = 6
+            else:
+                interval = round(interval * easiness)
+            repetitions += 1
+            due = now + interval * DAY
+        easiness = max(MIN_EASINESS,
+                       easiness + 0.1 - (5 - quality) *
+                       (0.08 + (5 - quality) * 0.02))
+        self._reviews[key] = [due, interval, repetitions, easiness]
+        heapq.heappush(self._heap, (due, key))
+        LOG.debug("'%s' is scheduled in %d days", key, interval)
+
+    def _drop_stale(self):
+        # Heap entries are never updated in place: rescheduled words get a
+        # new entry and the old ones are skipped here.
+        heap = self._heap
+        while heap:
+            due, key = heap[0]
+            state = self._reviews.get(key)
+            if state is not None and state[0] == due and key in self._index:
+                return
+            heapq.heappop(heap)
@@ -0,0 +1,116 @@
+import bisect
+import itertools
+import logging
+
+
+LOG = logging.getLogger(__name__)
+
+# Length of n-grams in the substring index
+NGRAM = 3
+# Changed keys applied one by one to the sorted list, rebuild past that
+REBUILD_THRESHOLD = 1000
+
+# Sorts after any character, prefix + MAX_CHAR bounds keys with prefix
+MAX_CHAR = '\U0010ffff'
+
+
+def ngrams(word):
+    return {word[i:i + NGRAM] for i in range(len(word) - NGRAM + 1)}
+
+
+class KeySearch:
+    """Prefix and substring search over keys of a mapping.
+
+    Keeps a sorted list of keys (for prefixes) and, once the first
+    substring search happens, an n-gram index. Both are built from the
+    mapping on first use; afterwards the owner calls ``touch`` for every
+    key added or removed and only those keys are updated, lazily, on the
+    next search.
+    """
+
+    def __init__(self, mapping):
+        self._mapping = mapping
+        self._sorted = sorted(mapping)
+        self._dirty = set()
+        self._ngrams = None
+        self._ngrams_dirty = set()
+
+    def touch(self, key):
+        self._dirty.add(key)
+        if self._ngrams is not None:
+            self._ngrams_dirty.add(key)
+
+    def sorted_keys(self):
+        if self._dirty:
+            self._update_sorted()
+        return self._sorted
+
+    def prefix(self, prefix, offset=0, limit=None):
+        keys = self.sorted_keys()
+        low = bisect.bisect_left(keys, prefix)
+        high = bisect.bisect_left(keys, prefix + MAX_CHAR, low)
+        start = min(low + offset, high)
+        stop = high if limit is None else min(high, start + limit)
+        return keys[start:stop]
+
+    def substring(self, substring, offset=0, limit=None):
+        stop = None if limit is None else offset + limit
+        if len(substring) < NGRAM:
+            found = (key for key in self.sorted_keys() if substring in key)
+            return list(itertools.islice(found, offset, stop))
+
+        postings = self._ngram_index()
+        candidates = None
+        for gram in sorted(ngrams(substring),
+                           key=lambda x: len(postings.get(x, ()))):
+            keys = postings.get(gram)
+            if not keys:
+                return []
+            candidates = (set(keys) if candidates is None
+                          else candidates.intersection(keys))
+        found = sorted(key for key in candidates if substring in key)
+        return found[offset:stop]
+
+    def _update_sorted(self):
+        dirty, self._dirty = self._dirty, set()
+        if len(dirty) > REBUILD_THRESHOLD:
+            LOG.debug("Rebuilding sorted keys after %d changes", len(dirty))
+            self._sorted = sorted(self._mapping)
+            return
+
+        keys = self._sorted
+        for key in dirty:
+            position = bisect.bisect_left(keys, key)
+            present = position < len(keys) and keys[position] == key
+            if key in self._mapping:
+                if not present:
+                    keys.insert(position, key)
+            elif present:
+                del keys[position]
+
+    def _ngram_index(self):
+        if self._ngrams is None:
+            LOG.debug("Building n-gram index")
+            self._ngrams = {}
+            for key in self._mapping:
+                self._add_ngrams(key)
+        elif self._ngrams_dirty:
+            dirty, self._ngrams_dirty = self._ngrams_dirty, set()
+            for key in dirty:
+                if key in self._mapping:
+                    self._add_ngrams(key)
+                else:
+                    self._remove_ngrams(key)
+        return self._ngrams
+
+    def _add_ngrams(self, key):
+        for gram in ngrams(key):
+            self._ngrams.setdefault(gram, set()).add(key)
+
+    def _remove_ngrams(self, key):
+        for gram in ngrams(key):
+            keys = self._ngrams.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._ngrams[gram]
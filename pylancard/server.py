@@ -0,0 +1,481 @@
+"""HTTP/JSON service for many learners over a few stores.
+
+Run with::
+
+    python -m pylancard.server --port 8080 FILE [FILE ...]
+
+Stores are addressed by the base name of their file, they are opened on
+first use and closed when idle if --memory-budget is exceeded. Endpoints:
+
+GET    /stores
+GET    /languages/LANGUAGE/words/WORD  (meanings in all stores)
+GET    /stores/NAME/words?filter=&reverse=&offset=&limit=
+POST   /stores/NAME/words    {"words": {"word": "meaning"}, "overwrite": false}
+DELETE /stores/NAME/words    {"words": ["word"], "silent": false}
+POST   /stores/NAME/sessions {"kind": "direct", "srs": false, "fuzzy": false,
+                              "learner": "name"}
+POST   /sessions/ID          {"answer": "meaning"} or {"skip": true}
+DELETE /sessions/ID
+"""
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import http
+import json
+import logging
+import os
+import secrets
+import time
+import urllib.parse
+
+from . import manager
+from . import trainer
+from . import utils
+
+
+LOG = logging.getLogger(__name__)
+
+# Seconds between saves of modified stores
+SAVE_INTERVAL = 1.0
+# Training sessions idle for longer (in seconds) are dropped
+SESSION_TIMEOUT = 30 * 60
+MAX_BODY_SIZE = 1 << 20
+PAGE_SIZE = 100
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, message, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+class SharedStore:
+    """A store loaded once and shared by all connections.
+
+    Every access goes through the lock: saving runs in a worker thread
+    and must not see the store changing under it.
+    """
+
+    def __init__(self, name, store_):
+        self.name = name
+        self.store = store_
+        self.lock = asyncio.Lock()
+
+
+class Session:
+
+    def __init__(self, shared, trainer_, clock):
+        # the store is kept open as long as the session exists
+        self.shared = shared
+        self.trainer = trainer_
+        self.last_used = clock()
+
+
+class Server:
+
+    ROUTES = {
+        ('stores',): {'GET': '_list_stores'},
+        ('stores', None, 'words'): {'GET': '_list_words',
+                                    'POST': '_add_words',
+                                    'DELETE': '_delete_words'},
+        ('stores', None, 'sessions'): {'POST': '_start_session'},
+        ('sessions', None): {'POST': '_answer',
+                             'DELETE': '_end_session'},
+        ('languages', None, 'words', None): {'GET': '_lookup'},
+    }
+
+    def __init__(self, filenames, save_interval=SAVE_INTERVAL,
+                 session_timeout=SESSION_TIMEOUT, clock=time.monotonic,
+                 memory_budget=None):
+        self.manager = manager.StoreManager(
+            filenames, memory_budget=memory_budget, buffered=True,
+            on_close=self._forget)
+        # open stores by name
+        self.stores = {}
+        # futures of the stores being opened by name
+        self._opening = {}
+        self.sessions = {}
+        self.save_interval = save_interval
+        self.session_timeout = session_timeout
+        self._clock = clock
+        self._server = self._saver = None
+
+    async def start(self, host='127.0.0.1', port=8080):
+        """Start listening, return the address."""
+        self._server = await asyncio.start_server(self.handle, host, port)
+        self._saver = asyncio.ensure_future(self._save_periodically())
+        address = self._server.sockets[0].getsockname()[:2]
+        LOG.info("Serving %d stores on %s:%d", len(self.manager), *address)
+        return address
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._saver.cancel()
+        for shared in list(self.stores.values()):
+            async with shared.lock:
+                self.manager.close(shared.name)
+        self.sessions.clear()
+
+    async def save(self):
+        """Save all stores modified since the last save.
+
+        The history of training answers is written for all stores.
+        """
+        loop = asyncio.get_event_loop()
+        for name, shared in list(self.stores.items()):
+            if not shared.store.dirty:
+                # answers without spaced repetition change nothing, but
+                # their history is read by other processes
+                async with shared.lock:
+                    shared.store.history.flush()
+                continue
+            async with self._using(name), shared.lock:
+                LOG.debug("Saving store %s", name)
+                await loop.run_in_executor(None, shared.store.save)
+        self.manager.evict()
+
+    def expire_sessions(self):
+        deadline = self._clock() - self.session_timeout
+        expired = [key for (key, session) in self.sessions.items()
+                   if session.last_used < deadline]
+        for key in expired:
+            self._end(key)
+        if expired:
+            LOG.info("%d idle sessions expired", len(expired))
+
+    async def _save_periodically(self):
+        # Changes from all clients are written in one go instead of
+        # flushing the journal after each of them.
+        while True:
+            await asyncio.sleep(self.save_interval)
+            try:
+                await self.save()
+            except Exception:
+                LOG.exception("Saving stores failed")
+            self.expire_sessions()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HTTPError as exc:
+                    self._respond(writer, exc.status,
+                                  dict(exc.details, error=str(exc)), False)
+                    break
+                if request is None:
+                    break
+                method, target, keep_alive, body = request
+                status, result = await self.dispatch(method, target, body)
+                self._respond(writer, status, result, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target, body):
+        """Handle one request, return (status, JSON-compatible result)."""
+        url = urllib.parse.urlsplit(target)
+        path = [urllib.parse.unquote(part)
+                for part in url.path.strip('/').split('/')]
+        query = urllib.parse.parse_qsl(url.query, keep_blank_values=True)
+        try:
+            handler, arguments = self._route(method, path)
+            try:
+                data = json.loads(body.decode('utf-8')) if body else {}
+            except ValueError:
+                raise HTTPError(400, "Malformed JSON body")
+            if not isinstance(data, dict):
+                raise HTTPError(400, "JSON object expected")
+            return 200, await handler(*arguments, query=query, data=data)
+        except HTTPError as exc:
+            return exc.status, dict(exc.details, error=str(exc))
+        except Exception:
+            LOG.exception("Request %s %s failed", method, target)
+            return 500, {'error': "Internal server error"}
+
+    def _route(self, method, path):
+        for pattern, methods in self.ROUTES.items():
+            if len(pattern) != len(path):
+                continue
+            if any(fixed is not None and fixed != part
+                   for (fixed, part) in zip(pattern, path)):
+                continue
+            if method not in methods:
+                raise HTTPError(405, "Method %s not allowed" % method)
+            arguments = [part for (fixed, part) in zip(pattern, path)
+                         if fixed is None]
+            return getattr(self, methods[method]), arguments
+        raise HTTPError(404, "Not found: /%s" % '/'.join(path))
+
+    @staticmethod
+    async def _read_request(reader):
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        try:
+            method, target, version = line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            name, sep, value = line.decode('latin-1').partition(':')
+            if not sep:
+                raise HTTPError(400, "Malformed header")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError(400, "Malformed Content-Length")
+        if length > MAX_BODY_SIZE:
+            raise HTTPError(413, "Request body is too large")
+        body = await reader.readexactly(length) if length else b''
+
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            keep_alive = connection != 'close'
+        else:
+            keep_alive = connection == 'keep-alive'
+        return method, target, keep_alive, body
+
+    @staticmethod
+    def _respond(writer, status, result, keep_alive):
+        body = json.dumps(result, ensure_ascii=False).encode('utf-8')
+        head = ("HTTP/1.1 %d %s\r\n"
+                "Content-Type: application/json; charset=utf-8\r\n"
+                "Content-Length: %d\r\n"
+                "Connection: %s\r\n\r\n" %
+                (status, http.HTTPStatus(status).phrase, len(body),
+                 'keep-alive' if keep_alive else 'close'))
+        writer.write(head.encode('latin-1') + body)
+
+    async def _acquire(self, name):
+        if name not in self.manager:
+            raise HTTPError(404, "No such store: %s" % name)
+        if not self.manager.is_open(name):
+            # loading may take a while, other requests go on meanwhile;
+            # a cancelled request must not lose the opened store
+            await asyncio.shield(self._open(name))
+        store_ = self.manager.acquire(name)
+        shared = self.stores.get(name)
+        if shared is None:
+            shared = self.stores[name] = SharedStore(name, store_)
+        return shared
+
+    def _open(self, name):
+        opening = self._opening.get(name)
+        if opening is None:
+            loop = asyncio.get_event_loop()
+            opening = self._opening[name] = loop.run_in_executor(
+                None, self.manager.open, name)
+            opening.add_done_callback(functools.partial(self._opened, name))
+        return opening
+
+    def _opened(self, name, opening):
+        del self._opening[name]
+        if opening.exception() is None:
+            self.manager.put(name, opening.result())
+
+    @contextlib.asynccontextmanager
+    async def _using(self, name):
+        shared = await self._acquire(name)
+        try:
+            yield shared
+        finally:
+            self.manager.release(name)
+
+    def _forget(self, name, store_):
+        # called by the manager before closing the store
+        self.stores.pop(name, None)
+
+    def _end(self, key):
+        session = self.sessions.pop(key)
+        self.manager.release(session.shared.name)
+
+    def _session(self, key):
+        try:
+            session = self.sessions[key]
+        except KeyError:
+            raise HTTPError(404, "No such session: %s" % key)
+        session.last_used = self._clock()
+        return session
+
+    async def _list_stores(self, query, data):
+        return {'stores': {name: list(self.manager.languages(name))
+                           for name in self.manager}}
+
+    async def _lookup(self, language, word, query, data):
+        found = {}
+        for name in self.manager:
+            if language not in self.manager.languages(name):
+                continue
+            # the stores being saved must wait
+            async with self._using(name) as shared, shared.lock:
+                meaning = manager.find_meaning(shared.store, language, word)
+            if meaning is not None:
+                found[name] = meaning
+        self.manager.evict()
+        return {'meanings': found}
+
+    async def _list_words(self, name, query, data):
+        try:
+            unknown, options = utils.parse_options(
+                ['%s=%s' % item for item in query],
+                filter='', reverse=False, offset=0, limit=PAGE_SIZE)
+        except ValueError as exc:
+            raise HTTPError(400, str(exc))
+        if unknown:
+            raise HTTPError(400, "Unknown parameters: %s" %
+                            ', '.join(unknown))
+
+        offset, limit = options['offset'], options['limit']
+        async with self._using(name) as shared, shared.lock:
+            # one more to know whether there is another page
+            if options['filter']:
+                words = shared.store.grep(options['filter'],
+                                          reverse=options['reverse'],
+                                          offset=offset, limit=limit + 1)
+            else:
+                items = shared.store.sorted_items(
+                    reverse=options['reverse'], offset=offset)
+                words = [item for (item, _) in zip(items, range(limit + 1))]
+        more = len(words) > limit
+        return {'words': [list(item) for item in words[:limit]],
+                'next_offset': offset + limit if more else None}
+
+    async def _add_words(self, name, query, data):
+        words = data.get('words')
+        if isinstance(words, dict):
+            words = list(words.items())
+        if (not isinstance(words, list) or
+                not all(isinstance(pair, (list, tuple)) and len(pair) == 2 and
+                        all(isinstance(x, str) for x in pair)
+                        for pair in words)):
+            raise HTTPError(400, "Words expected as an object or a list "
+                            "of [word, meaning] pairs")
+        async with self._using(name) as shared, shared.lock:
+            skipped = shared.store.add_many(
+                words, may_overwrite=bool(data.get('overwrite')))
+        return {'added': len(words) - len(skipped), 'skipped': skipped}
+
+    async def _delete_words(self, name, query, data):
+        words = data.get('words')
+        if (not isinstance(words, list) or
+                not all(isinstance(x, str) for x in words)):
+            raise HTTPError(400, "Words expected as a list")
+        async with self._using(name) as shared, shared.lock:
+            try:
+                deleted = shared.store.delete_many(
+                    words, silent=bool(data.get('silent')))
+            except KeyError as exc:
+                raise HTTPError(404, "Words not found", missing=exc.args)
+        return {'deleted': deleted}
+
+    async def _start_session(self, name, query, data):
+        kind = data.get('kind', trainer.DIRECT)
+        if kind not in (trainer.DIRECT, trainer.REVERSE):
+            raise HTTPError(400, "Unknown kind: %s" % kind)
+        learner = data.get('learner')
+        if learner is not None and not isinstance(learner, str):
+            raise HTTPError(400, "Learner name expected as a string")
+        spaced = bool(data.get('srs'))
+
+        shared = await self._acquire(name)
+        try:
+            async with shared.lock:
+                if not shared.store.direct_index:
+                    raise HTTPError(409, "No words to train")
+                trainer_ = trainer.Trainer(shared.store, kind, spaced=spaced,
+                                           tolerant=bool(data.get('fuzzy')),
+                                           learner=learner)
+                challenge = trainer_.next()
+        except BaseException:
+            self.manager.release(name)
+            raise
+        key = secrets.token_urlsafe(16)
+        self.sessions[key] = Session(shared, trainer_, self._clock)
+        return {'session': key, 'challenge': challenge}
+
+    async def _answer(self, key, query, data):
+        session = self._session(key)
+        trainer_ = session.trainer
+        answer = data.get('answer')
+        if not data.get('skip') and not isinstance(answer, str):
+            raise HTTPError(400, "Answer or skip expected")
+
+        async with session.shared.lock:
+            if data.get('skip'):
+                result = {}
+            else:
+                result = {'correct': trainer_.check(answer)}
+                if trainer_.near_miss is not None:
+                    result['near_miss'] = trainer_.near_miss
+            if result.get('correct', True):
+                try:
+                    if not session.shared.store.direct_index:
+                        raise IndexError()
+                    trainer_.next()
+                except IndexError:
+                    self._end(key)
+                    raise HTTPError(409, "No words to train")
+        result['challenge'] = trainer_.challenge
+        return result
+
+    async def _end_session(self, key, query, data):
+        self._session(key)
+        self._end(key)
+        return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PyLanCard HTTP service")
+    parser.add_argument("filenames", nargs='+', metavar='FILE',
+                        help="existing data file to serve")
+    parser.add_argument("--host", default='127.0.0.1',
+                        help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080,
+                        help="port to listen on")
+    parser.add_argument("--save-interval", type=float, default=SAVE_INTERVAL,
+                        help="seconds between saves of modified stores")
+    parser.add_argument("--memory-budget", type=float, metavar='MB',
+                        help="close idle stores when the open ones use "
+                        "more memory (estimated)")
+    parser.add_argument("--debug", action='store_true', help="debug mode")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    missing = [x for x in args.filenames if not os.path.exists(x)]
+    if missing:
+        parser.error("data files not found: %s" % ', '.join(missing))
+
+    budget = args.memory_budget
+    server = Server(args.filenames, save_interval=args.save_interval,
+                    memory_budget=None if budget is None else budget * 2 ** 20)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(server.start(args.host, args.port))
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.close())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
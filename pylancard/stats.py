@@ -0,0 +1,122 @@
+"""Call counters and latency histograms.
+
+Nothing is measured until enable() is called: it replaces the measured
+methods with timing wrappers, disable() puts the originals back, so
+disabled instrumentation costs nothing.
+"""
+
+import functools
+import time
+
+from . import plugins
+from . import store
+from . import trainer
+from .plugins import base
+
+
+# Buckets are powers of two of microseconds, the last one is open-ended
+BUCKETS = 32
+
+# (owner, attribute, metric name) of the measured methods
+INSTRUMENTED = [
+    (store.Store, '__init__', 'store.open'),
+    (store.Store, 'save', 'store.save'),
+    (store.Store, 'compact', 'store.compact'),
+    (base.BaseLanguage, 'convert_word', 'plugin.convert_word'),
+    (trainer.Trainer, 'next', 'trainer.next'),
+    (trainer.Trainer, 'check', 'trainer.check'),
+]
+
+metrics = {}
+enabled = False
+_originals = {}
+
+
+class Metric:
+    """Number, total and distribution of durations of an operation."""
+
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = int(seconds * 1e6).bit_length()
+        self.buckets[min(bucket, BUCKETS - 1)] += 1
+
+    def percentile(self, fraction):
+        """Upper bound (in seconds) of the fraction of fastest durations."""
+        rank = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min(2 ** bucket / 1e6, self.max)
+        return self.max
+
+
+def record(name, seconds):
+    metric = metrics.get(name)
+    if metric is None:
+        metric = metrics[name] = Metric()
+    metric.add(seconds)
+
+
+def timed(name, function):
+    """Wrap function to record its durations as name."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record(name, time.perf_counter() - started)
+    return wrapper
+
+
+def enable():
+    global enabled
+    if enabled:
+        return
+    for owner, attribute, name in INSTRUMENTED:
+        original = owner.__dict__[attribute]
+        _originals[owner, attribute] = original
+        setattr(owner, attribute, timed(name, original))
+    enabled = True
+
+
+def disable():
+    global enabled
+    for (owner, attribute), original in _originals.items():
+        setattr(owner, attribute, original)
+    _originals.clear()
+    enabled = False
+
+
+def reset():
+    metrics.clear()
+
+
+def report():
+    lines = ['%-24s %8s %10s %10s %10s %10s %10s' %
+             ('operation', 'count', 'total, ms', 'mean, us', 'p50, us',
+              'p99, us', 'max, us')]
+    for name, metric in sorted(metrics.items()):
+        lines.append('%-24s %8d %10.1f %10.1f %10.1f %10.1f %10.1f' % (
+            name, metric.count, metric.total * 1e3,
+            metric.total / metric.count * 1e6,
+            metric.percentile(0.5) * 1e6, metric.percentile(0.99) * 1e6,
+            metric.max * 1e6))
+    for language, plugin in sorted(plugins.registry.loaded().items()):
+        if getattr(plugin, 'cache', None) is not None:
+            lines.append('cache of %(language)s plugin: %(size)d of '
+                         '%(capacity)d words, %(hits)d hits, %(misses)d '
+                         'misses, %(evictions)d evictions' %
+                         dict(plugin.cache.stats(), language=language))
+    return '\n'.join(lines) + '\n'
@@ -1,84 +1,382 @@
-import gzip
-import json
+import functools
 import logging
+import os
+import time
 
-from .plugins import base
+from . import backends
+from . import history
+from . import index
+from . import locking
+from . import plugins
 
 
 LOG = logging.getLogger(__name__)
 
+JOURNAL_SUFFIX = backends.JOURNAL_SUFFIX
+HISTORY_SUFFIX = '.history'
+LOCK_SUFFIX = locking.LOCK_SUFFIX
+FORMATS = tuple(backends.BACKENDS)
 
-def create(filename, languages):
-    LOG.info("Creating store %(filename)s for languages %(languages)s",
-             locals())
-    with gzip.open(filename, 'wb') as fp:
-        fp.write(json.dumps({'languages': languages,
-                             'index': {},
-                             'version': 1},
-                            fp, indent=2).encode('utf-8'))
+LockedError = locking.LockedError
+ConflictError = locking.ConflictError
+
+
+class ReadOnlyError(Exception):
+    pass
+
+
+def create(filename, languages, format='json'):
+    LOG.info("Creating %(format)s store %(filename)s for languages "
+             "%(languages)s", locals())
+    with locking.FileLock(filename + LOCK_SUFFIX):
+        backends.BACKENDS[format].create(filename, languages)
+
+
+def convert(filename, format):
+    """Rewrite a store in another format keeping words and tables.
+
+    This is also the way to migrate stores written in older formats.
+    """
+    old = Store(filename)
+    try:
+        if old._backend.name == format:
+            return
+        LOG.info("Converting %(filename)s from %(old)s to %(format)s",
+                 dict(filename=filename, old=old._backend.name,
+                      format=format))
+        rewrite(old, old.direct_index, old.tables(), format)
+    finally:
+        old._backend.close()
+        old._unlock()
+
+
+def rewrite(old, words, tables, format=None):
+    """Atomically replace the file of an open store with new contents.
+
+    The store is closed without saving and must not be used afterwards,
+    except for calling close() which only releases the lock then.
+    """
+    filename = old._filename
+    temporary = filename + '.rewrite'
+    # the journal is obsolete after the rewrite, if removing it fails
+    # its older revision makes the next open skip it
+    meta = dict(old, revision=old.get('revision', 0) + 1)
+    backends.BACKENDS[format or old._backend.name].dump(temporary, meta,
+                                                        words, tables)
+    old._backend.close()
+    old.history.close()
+    old.read_only = True
+    os.replace(temporary, filename)
+    try:
+        os.remove(filename + JOURNAL_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+
+def peek(filename):
+    """Metadata of a store (e.g. languages) without opening it."""
+    return backends.detect(filename).peek(filename)
 
 
 class Store(dict):
 
-    _PREFIX = 'pylancard.plugins'
+    # Journal size (in bytes) after which save() rewrites the snapshot
+    compact_threshold = 1 << 20
+    # Save after this many changes or seconds since the last save (0 is
+    # never), checked whenever something changes
+    autosave_changes = 0
+    autosave_interval = 0
+    read_only = False
+    # whether there are changes save() has not written yet, meta_dirty
+    # for changes of the metadata (the store itself)
+    dirty = meta_dirty = False
+    # history.History recording training answers, None when read-only
+    history = None
+    # called instead of save() when autosave is due, e.g. to save on
+    # another thread
+    saver = None
+
+    def __init__(self, filename, buffered=False, read_only=False):
+        """Open the store.
 
-    def __init__(self, filename):
+        Only one process may open a store for writing at a time, otherwise
+        LockedError is raised. Any number of processes may open it with
+        read_only without taking locks, they see the store as it was
+        at the last save() of the writer.
+        """
         super().__init__()
         self._filename = filename
-        with gzip.open(filename, 'rb') as fp:
-            self.update(json.loads(fp.read().decode('utf-8')))
-            LOG.info("Opened store %(filename)s of version %(version)s",
-                     dict(filename=filename, version=self.get('version')))
+        self.buffered = buffered
+        self.read_only = read_only
+        if read_only:
+            self._lock = None
+        else:
+            self._lock = locking.FileLock(filename + LOCK_SUFFIX)
+            self._lock.acquire()
+        # buffered changes may be lost on a crash until save() is called
+        self._backend = backends.detect(filename)(filename, buffered,
+                                                  read_only)
+        try:
+            meta, self.direct_index = self._backend.open()
+        except BaseException:
+            self._unlock()
+            raise
+        self.update(meta)
+        LOG.info("Opened %(format)s store %(filename)s of version "
+                 "%(version)s",
+                 dict(filename=filename, version=self.get('version'),
+                      format=self._backend.name))
 
         self.languages = tuple(self['languages'])
         LOG.info("Languages: %s", self.languages)
-        self.direct_index = self['index']
-        self.reverse_index = {v: k for (k, v) in self.direct_index.items()}
-        self.original_plugin = (self._import_plugin(self.languages[0])
-                                or base.BaseLanguage(self))
-        LOG.info("Class of original language plugin: %s",
-                 self.original_plugin.__class__)
-        self.meaning_plugin = (self._import_plugin(self.languages[1])
-                               or base.BaseLanguage(self))
-        LOG.info("Class of meaning language plugin: %s",
-                 self.meaning_plugin.__class__)
+        self.reverse_index = self.direct_index.reverse
+
+        self._watched = set()
+        self.history_filename = filename + HISTORY_SUFFIX
+        if not read_only:
+            self.direct_index.listeners.append(self._changed)
+            self.history = history.History(self.history_filename, buffered)
+        self._mark_clean()
+
+    # Plugins are only imported when words are converted for the first time
+    @functools.cached_property
+    def original_plugin(self):
+        return plugins.registry.get(self.languages[0])
+
+    @functools.cached_property
+    def meaning_plugin(self):
+        return plugins.registry.get(self.languages[1])
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.dirty = self.meta_dirty = True
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.dirty = self.meta_dirty = True
+
+    def table(self, name):
+        """Persistent auxiliary mapping (e.g. review states) by name."""
+        table = self._backend.table(name)
+        if not self.read_only and name not in self._watched:
+            table.listeners.append(self._changed)
+            self._watched.add(name)
+        return table
+
+    def tables(self):
+        """All auxiliary tables by name."""
+        return self._backend.tables()
 
     def save(self):
-        self['index'] = self.direct_index
-        with gzip.open(self._filename, 'wb') as fp:
-            fp.write(json.dumps(self, indent=2).encode('utf-8'))
+        """Write the changes, does nothing if there are none."""
+        write = self.snapshot()
+        if write is not None:
+            write()
+
+    def snapshot(self):
+        """Take the changes save() writes, return a function writing them.
+
+        The function does not use the store, so it may run on another
+        thread while the store is changed further. None if there is
+        nothing to write.
+        """
+        self._check_writable()
+        self.history.flush()
+        if not self.dirty:
+            return None
+        write = self._backend.snapshot(self)
+        self._mark_clean()
+        if write is None:
+            return None
+
+        def write_or_retry():
+            try:
+                write()
+            except BaseException:
+                # the next save() writes a complete snapshot
+                self.dirty = self.meta_dirty = True
+                raise
+        return write_or_retry
 
-    close = save
+    def set_buffered(self, buffered):
+        """Switch buffering of changes and history, e.g. for a session."""
+        self.buffered = buffered
+        self._backend.set_buffered(buffered)
+        if self.history is not None:
+            self.history.buffered = buffered
+            if not buffered:
+                self.history.flush()
 
-    __enter__ = lambda self: self
+    def flush(self):
+        """Hand buffered changes and history to the OS, without syncing."""
+        self._check_writable()
+        self._backend.flush()
+        self.history.flush()
+
+    def autosave(self):
+        """Save if there are changes and autosave is due."""
+        if not self.dirty:
+            return
+        if ((self.autosave_changes and
+             self._changes >= self.autosave_changes) or
+                (self.autosave_interval and
+                 time.monotonic() - self._saved_at >=
+                 self.autosave_interval)):
+            LOG.debug("Autosaving %d changes", self._changes)
+            if self.saver is not None:
+                self.saver()
+            else:
+                self.save()
+
+    def compact(self):
+        self._check_writable()
+        self._backend.compact(self)
+        self._mark_clean()
+
+    def close(self):
+        try:
+            if not self.read_only:
+                self.save()
+                self.history.close()
+            self._backend.close()
+        finally:
+            self._unlock()
+
+    def __enter__(self):
+        return self
 
     def __exit__(self, *_):
-        self.save()
+        self.close()
 
     def add(self, word1, word2, may_overwrite=False):
+        """Add a word, word2 is its meaning or a list of meanings."""
+        self._check_writable()
         word1 = self.original_plugin.convert_word(word1)
-        word2 = self.meaning_plugin.convert_word(word2)
+        word2 = self.meaning_plugin.convert_word(_value(word2))
         if word1 in self.direct_index and not may_overwrite:
             raise KeyError("This word already in dictionary: %s" % word1)
         self.direct_index[word1] = word2
-        self.reverse_index[word2] = word1
+
+    def add_many(self, pairs, may_overwrite=False):
+        """Add several (word, meaning) pairs at once.
+
+        Returns the list of words skipped because they are already in the
+        dictionary (always empty with may_overwrite).
+        """
+        self._check_writable()
+        pairs = list(pairs)
+        words = self.original_plugin.convert_words([x[0] for x in pairs])
+        meanings = self.meaning_plugin.convert_words([_value(x[1])
+                                                      for x in pairs])
+        skipped = []
+        for word, meaning, pair in zip(words, meanings, pairs):
+            if word in self.direct_index and not may_overwrite:
+                skipped.append(pair[0])
+            else:
+                self.direct_index[word] = meaning
+        return skipped
+
+    def add_meanings(self, word, meanings):
+        """Add meanings to the ones of word, add the word if missing."""
+        self._check_writable()
+        word = self.original_plugin.convert_word(word)
+        new = index.split_meanings(
+            self.meaning_plugin.convert_word(_value(meanings)))
+        old = self.direct_index.get(word)
+        old = () if old is None else index.split_meanings(old)
+        self.direct_index[word] = index.join_meanings(
+            dict.fromkeys(old + new))
+
+    def meanings(self, word):
+        """Return the meanings of word (KeyError if missing)."""
+        word = self.original_plugin.convert_word(word)
+        return index.split_meanings(self.direct_index[word])
 
     def delete(self, word, silent=False):
+        self._check_writable()
         word = self.original_plugin.convert_word(word)
         try:
             del self.direct_index[word]
         except KeyError:
             if not silent:
                 raise
-        self.reverse_index = {key: value
-                              for key, value in self.reverse_index.items()
-                              if value != word}
 
-    def _import_plugin(self, lang):
-        try:
-            module = __import__("%s.%s" % (self._PREFIX, lang),
-                                fromlist=['create_plugin'])
-        except ImportError:
-            pass
-        else:
-            return module.create_plugin(self)
+    def delete_many(self, words, silent=False):
+        """Delete several words at once.
+
+        Unless silent, nothing is deleted if some of the words are missing;
+        KeyError is raised with all missing words as arguments. Returns
+        the number of words deleted.
+        """
+        self._check_writable()
+        words = list(words)
+        converted = {}
+        for key, word in zip(self.original_plugin.convert_words(words),
+                             words):
+            converted.setdefault(key, word)
+        missing = [word for (key, word) in converted.items()
+                   if key not in self.direct_index]
+        if missing and not silent:
+            raise KeyError(*missing)
+        deleted = 0
+        for key in converted:
+            if self.direct_index.pop(key, None) is not None:
+                deleted += 1
+        return deleted
+
+    def sorted_items(self, reverse=False, offset=0):
+        """Iterate over (word, meaning) pairs sorted by word.
+
+        With reverse, iterates over (meaning, word) pairs. The sorted view
+        is cached by the index and updated incrementally.
+        """
+        return self._side(reverse)[0].sorted_items(offset)
+
+    def find(self, prefix, reverse=False, offset=0, limit=None):
+        """Return sorted (word, meaning) pairs for words starting with prefix.
+
+        With reverse, searches meanings and returns (meaning, word) pairs.
+        """
+        mapping, plugin = self._side(reverse)
+        return mapping.find_prefix(plugin.convert_word(prefix),
+                                   offset, limit)
+
+    def grep(self, substring, reverse=False, offset=0, limit=None):
+        """The same as find, but for words containing substring."""
+        mapping, plugin = self._side(reverse)
+        return mapping.find_substring(plugin.convert_word(substring),
+                                      offset, limit)
+
+    def _changed(self, key, value):
+        self.dirty = True
+        self._changes += 1
+        self.autosave()
+
+    def _mark_clean(self):
+        self.dirty = self.meta_dirty = False
+        self._changes = 0
+        self._saved_at = time.monotonic()
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ReadOnlyError("Store %s is opened read-only" %
+                                self._filename)
+
+    def _unlock(self):
+        if self._lock is not None:
+            self._lock.release()
+            self._lock = None
+
+    def _side(self, reverse):
+        if reverse:
+            return self.reverse_index, self.meaning_plugin
+        return self.direct_index, self.original_plugin
+
+
+def _value(meanings):
+    if not isinstance(meanings, str):
+        return index.join_meanings(meanings)
+    if index.SEPARATOR in meanings:
+        # the same spacing for all values
+        return index.join_meanings(index.split_meanings(meanings))
+    return meanings
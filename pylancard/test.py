@@ -1,13 +1,35 @@
+import asyncio
 import builtins
+import concurrent.futures
+import contextlib
+import io
+import json
 import os
 import tempfile
+import threading
 import unittest
 
 from mock import patch, sentinel  # noqa
 
+from pylancard import analytics
+from pylancard import benchmark
+from pylancard import binary
+from pylancard import bulk
 from pylancard import cli
+from pylancard import engine
+from pylancard import fuzzy
+from pylancard import history
+from pylancard import index
+from pylancard import maintenance
+from pylancard import manager
+from pylancard import plugins
+from pylancard import scheduler
+from pylancard import search
+from pylancard import server
+from pylancard import stats
 from pylancard import store
 from pylancard import trainer
+from pylancard import utils
 from pylancard.plugins import base as plugins_base
 from pylancard.plugins import cz as lang_cz
 
@@ -16,16 +38,17 @@ class FakeStore(store.Store):
 
     def __init__(self):
         self.languages = ('1', '2')
-        self.direct_index = {
+        self.direct_index = index.Index({
             'word1': 'meaning1',
             'word2': 'meaning2',
-        }
-        self.reverse_index = {
-            'meaning1': 'word1',
-            'meaning2': 'word2',
-        }
+        })
+        self.reverse_index = self.direct_index.reverse
         self.original_plugin = plugins_base.BaseLanguage(self)
         self.meaning_plugin = plugins_base.BaseLanguage(self)
+        self._tables = {}
+
+    def table(self, name):
+        return self._tables.setdefault(name, index.Table())
 
 
 class StoreMixin:
@@ -46,6 +69,16 @@ class TestStore(StoreMixin, unittest.TestCase):
         convert_mock.assert_any_call('word3')
         convert_mock.assert_any_call('meaning3')
 
+    def test_add_meanings(self, convert_mock):
+        self.store.add_meanings('word1', 'meaning3;meaning1')
+        self.store.add_meanings('word3', ['meaning3'])
+        self.assertEqual('meaning1; meaning3',
+                         self.store.direct_index['word1'])
+        self.assertEqual(('word1', 'word3'),
+                         self.store.reverse_index.originals('meaning3'))
+        self.store.add('word4', 'a ;b', may_overwrite=True)
+        self.assertEqual('a; b', self.store.direct_index['word4'])
+
     def test_add_no_overwrite(self, convert_mock):
         self.assertRaises(KeyError, self.store.add, 'word1', 'meaning3')
         self.assertEqual('meaning1', self.store.direct_index['word1'])
@@ -57,9 +90,19 @@ class TestStore(StoreMixin, unittest.TestCase):
         self.store.add('word1', 'meaning3', may_overwrite=True)
         self.assertEqual('meaning3', self.store.direct_index['word1'])
         self.assertEqual('word1', self.store.reverse_index['meaning3'])
+        self.assertNotIn('meaning1', self.store.reverse_index)
         convert_mock.assert_any_call('word1')
         convert_mock.assert_any_call('meaning3')
 
+    def test_add_shared_meaning(self, convert_mock):
+        self.store.add('word3', 'meaning1')
+        self.assertEqual(('word1', 'word3'),
+                         self.store.reverse_index.originals('meaning1'))
+        self.store.delete('word1')
+        self.assertEqual('word3', self.store.reverse_index['meaning1'])
+        self.assertEqual(('word3',),
+                         self.store.reverse_index.originals('meaning1'))
+
     def test_delete(self, convert_mock):
         self.store.delete('word1')
         self.assertNotIn('word1', self.store.direct_index)
@@ -78,6 +121,151 @@ class TestStore(StoreMixin, unittest.TestCase):
         self.assertEqual(orig_reverse, self.store.reverse_index)
         convert_mock.assert_called_once_with('word??')
 
+    def test_delete_many(self, convert_mock):
+        self.assertEqual(
+            2, self.store.delete_many(['word1', 'word2', 'word1']))
+        self.assertEqual({}, self.store.direct_index)
+        self.assertEqual({}, self.store.reverse_index)
+
+    def test_delete_many_not_found(self, convert_mock):
+        with self.assertRaises(KeyError) as ctx:
+            self.store.delete_many(['word1', 'word??', 'word!!'])
+        self.assertEqual(('word??', 'word!!'), ctx.exception.args)
+        self.assertIn('word1', self.store.direct_index)
+
+    def test_delete_many_silent(self, convert_mock):
+        self.assertEqual(
+            1, self.store.delete_many(['word1', 'word??'], silent=True))
+        self.assertEqual({'word2': 'meaning2'}, self.store.direct_index)
+
+    def test_add_many(self, convert_mock):
+        skipped = self.store.add_many([('word3', 'meaning3'),
+                                       ('word1', 'meaning4'),
+                                       ('word3', 'meaning5')])
+        self.assertEqual(['word1', 'word3'], skipped)
+        self.assertEqual('meaning3', self.store.direct_index['word3'])
+        self.assertEqual('meaning1', self.store.direct_index['word1'])
+
+    def test_add_many_overwrite(self, convert_mock):
+        skipped = self.store.add_many([('word1', 'meaning4')],
+                                      may_overwrite=True)
+        self.assertEqual([], skipped)
+        self.assertEqual('meaning4', self.store.direct_index['word1'])
+
+
+class TestIndex(unittest.TestCase):
+
+    def test_reverse(self):
+        idx = index.Index({'a': 'x', 'b': 'y', 'c': 'x'})
+        self.assertEqual({'x': 'a', 'y': 'b'}, idx.reverse)
+        self.assertEqual(('a', 'c'), idx.reverse.originals('x'))
+        idx['a'] = 'z'
+        self.assertEqual({'x': 'c', 'y': 'b', 'z': 'a'}, idx.reverse)
+        del idx['c']
+        self.assertEqual({'y': 'b', 'z': 'a'}, idx.reverse)
+        self.assertRaises(KeyError, idx.reverse.originals, 'x')
+
+    def test_meanings(self):
+        self.assertEqual(('x',), index.split_meanings('x'))
+        self.assertEqual(('x', 'y z'), index.split_meanings(' x;y z; x;'))
+        self.assertEqual((';',), index.split_meanings(';'))
+        self.assertEqual('x; y', index.join_meanings(['x', 'y']))
+
+    def test_reverse_meanings(self):
+        idx = index.Index({'a': 'x; y', 'b': 'y', 'c': 'z'})
+        self.assertEqual({'x': 'a', 'y': 'a', 'z': 'c'}, idx.reverse)
+        self.assertEqual(('a', 'b'), idx.reverse.originals('y'))
+        idx['c'] = 'y; z'
+        self.assertEqual(('a', 'b', 'c'), idx.reverse.originals('y'))
+        del idx['a']
+        self.assertEqual({'y': 'b', 'z': 'c'}, idx.reverse)
+        self.assertEqual(('b', 'c'), idx.reverse.originals('y'))
+        idx['b'] = 'w'
+        self.assertEqual(('c',), idx.reverse.originals('y'))
+        self.assertEqual({'w': 'b', 'y': 'c', 'z': 'c'}, idx.reverse)
+
+    def test_item_at(self):
+        idx = index.Index({'a': 'x', 'b': 'y', 'c': 'x'})
+        self.assertEqual(3, idx.positions)
+        self.assertEqual(2, idx.reverse.positions)
+        del idx['a']
+        self.assertEqual({('c', 'x'), ('b', 'y')},
+                         {idx.item_at(i) for i in range(idx.positions)})
+        self.assertEqual({('x', 'c'), ('y', 'b')},
+                         {idx.reverse.item_at(i)
+                          for i in range(idx.reverse.positions)})
+        self.assertRaises(IndexError, idx.item_at, 2)
+
+    def test_listeners(self):
+        idx = index.Index()
+        calls = []
+        idx.listeners.append(lambda *args: calls.append(args))
+        idx['a'] = 'x'
+        del idx['a']
+        self.assertEqual([('a', 'x'), ('a', None)], calls)
+
+
+class TestSearch(unittest.TestCase):
+
+    WORDS = ['apple', 'application', 'apply', 'banana', 'bandana', 'can']
+
+    def setUp(self):
+        super().setUp()
+        self.idx = index.Index({word: word.upper() for word in self.WORDS})
+
+    def test_prefix(self):
+        self.assertEqual([('apple', 'APPLE'), ('application', 'APPLICATION'),
+                          ('apply', 'APPLY')],
+                         self.idx.find_prefix('app'))
+        self.assertEqual([('application', 'APPLICATION')],
+                         self.idx.find_prefix('app', offset=1, limit=1))
+        self.assertEqual([], self.idx.find_prefix('app', offset=5))
+        self.assertEqual([], self.idx.find_prefix('x'))
+
+    def test_substring(self):
+        self.assertEqual(['banana', 'bandana'],
+                         [x[0] for x in self.idx.find_substring('ana')])
+        self.assertEqual(['bandana'],
+                         [x[0] for x in self.idx.find_substring('ana',
+                                                                offset=1)])
+        self.assertEqual(['banana', 'bandana', 'can'],
+                         [x[0] for x in self.idx.find_substring('an')])
+        self.assertEqual([], self.idx.find_substring('xyz'))
+
+    def test_incremental(self):
+        self.idx.find_prefix('')
+        self.idx.find_substring('ana')
+        self.idx['appetite'] = 'APPETITE'
+        del self.idx['apple']
+        self.idx['cabana'] = 'CABANA'
+        self.idx['x'] = 'y'
+        del self.idx['x']
+        self.assertEqual(['appetite', 'application', 'apply'],
+                         [x[0] for x in self.idx.find_prefix('app')])
+        self.assertEqual(['banana', 'bandana', 'cabana'],
+                         [x[0] for x in self.idx.find_substring('ana')])
+
+    @patch.object(search, 'REBUILD_THRESHOLD', 1)
+    def test_rebuild(self):
+        self.idx.find_prefix('')
+        self.idx['apex'] = 'APEX'
+        del self.idx['apply']
+        self.assertEqual(['apex', 'apple', 'application'],
+                         [x[0] for x in self.idx.find_prefix('ap')])
+
+    def test_reverse(self):
+        self.idx['apricot'] = 'APPLE'
+        self.assertEqual([('APPLE', 'apple'), ('APPLICATION', 'application'),
+                          ('APPLY', 'apply')],
+                         self.idx.reverse.find_prefix('APP'))
+        del self.idx['apple']
+        del self.idx['apply']
+        self.assertEqual([('APPLE', 'apricot'),
+                          ('APPLICATION', 'application')],
+                         self.idx.reverse.find_prefix('APP'))
+        self.assertEqual([('BANANA', 'banana'), ('BANDANA', 'bandana')],
+                         self.idx.reverse.find_substring('ANA'))
+
 
 class TestStoreIO(unittest.TestCase):
 
@@ -105,12 +293,592 @@ class TestStoreIO(unittest.TestCase):
         self.assertEqual({'word': 'meaning'}, new_store.direct_index)
         self.assertEqual({'meaning': 'word'}, new_store.reverse_index)
 
+    def test_journal_replay(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        new_store = store.Store(filename)
+        # a crash: the journal is closed without saving
+        self.addCleanup(new_store._backend.close)
+        new_store.add('word1', 'meaning1')
+        new_store.add('word2', 'meaning2')
+        new_store.delete('word1')
+        # not saved, but the journal is already on disk
+        new_store = store.Store(filename, read_only=True)
+        self.assertEqual({'word2': 'meaning2'}, new_store.direct_index)
+        self.assertEqual({'meaning2': 'word2'}, new_store.reverse_index)
+
+    def test_clean_save(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'), format='sqlite')
+        mtime = os.stat(filename).st_mtime_ns
+        with patch.object(store.backends.SqliteBackend, 'save') as save_mock:
+            with store.Store(filename) as new_store:
+                new_store.find('word')
+                new_store.table('reviews.direct')
+                self.assertFalse(new_store.dirty)
+            self.assertFalse(save_mock.called)
+        self.assertEqual(mtime, os.stat(filename).st_mtime_ns)
+
+    def test_dirty(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        with store.Store(filename) as new_store:
+            new_store.add('word1', 'meaning1')
+            self.assertTrue(new_store.dirty)
+            new_store.save()
+            self.assertFalse(new_store.dirty)
+            new_store.table('reviews.direct')['word1'] = {}
+            self.assertTrue(new_store.dirty)
+            new_store.compact()
+            self.assertFalse(new_store.dirty)
+            new_store['note'] = 'value'
+            self.assertTrue(new_store.dirty)
+        with store.Store(filename, read_only=True) as new_store:
+            self.assertEqual('value', new_store['note'])
+
+    def test_autosave(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        with store.Store(filename, buffered=True) as new_store:
+            new_store.autosave_changes = 3
+            with patch.object(new_store._backend, 'snapshot',
+                              return_value=None) as save_mock:
+                new_store.add_many([('word1', 'meaning1'),
+                                    ('word2', 'meaning2')])
+                self.assertFalse(save_mock.called)
+                new_store.delete('word1')
+                save_mock.assert_called_once_with(new_store)
+                self.assertFalse(new_store.dirty)
+                new_store.autosave_changes = 0
+                new_store.autosave_interval = 1
+                new_store._saved_at -= 2
+                new_store.add('word3', 'meaning3')
+                self.assertEqual(2, save_mock.call_count)
+
+    def test_save_does_not_compact_small_journal(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        mtime = os.path.getmtime(filename)
+        with store.Store(filename) as new_store:
+            new_store.add('word', 'meaning')
+        self.assertEqual(mtime, os.path.getmtime(filename))
+        self.assertTrue(os.path.exists(filename + store.JOURNAL_SUFFIX))
+
+    def test_compact(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        with store.Store(filename) as new_store:
+            new_store.compact_threshold = 0
+            new_store.add('word', 'meaning')
+        self.assertFalse(os.path.exists(filename + store.JOURNAL_SUFFIX))
+        new_store = store.Store(filename)
+        self.assertEqual({'word': 'meaning'}, new_store.direct_index)
+
+    def test_snapshot(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        with store.Store(filename) as new_store:
+            new_store.compact_threshold = 0
+            new_store.add('word1', 'meaning1')
+            write = new_store.snapshot()
+            self.assertFalse(new_store.dirty)
+            new_store.add('word2', 'meaning2')
+            # the old snapshot plus both journals until it is written
+            with store.Store(filename, read_only=True) as reader:
+                self.assertEqual(2, len(reader.direct_index))
+            write()
+            with store.Store(filename, read_only=True) as reader:
+                self.assertEqual(2, len(reader.direct_index))
+                self.assertEqual(1, reader['revision'])
+            self.assertFalse(os.path.exists(filename +
+                                            store.backends.ROTATED_SUFFIX))
+
+    def test_snapshot_failed(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        with store.Store(filename) as new_store:
+            new_store.compact_threshold = 0
+            new_store.add('word1', 'meaning1')
+            write = new_store.snapshot()
+            new_store.add('word2', 'meaning2')
+            with patch.object(store.backends.JsonBackend, 'dump',
+                              side_effect=OSError):
+                self.assertRaises(OSError, write)
+            self.assertTrue(new_store.meta_dirty)
+            new_store.add('word3', 'meaning3')
+            with store.Store(filename, read_only=True) as reader:
+                self.assertEqual(3, len(reader.direct_index))
+            new_store.save()
+        with store.Store(filename, read_only=True) as reader:
+            self.assertEqual(3, len(reader.direct_index))
+            self.assertEqual(2, reader['revision'])
+
+    def test_crash_before_snapshot_is_written(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        new_store = store.Store(filename)
+        new_store.compact_threshold = 0
+        new_store.add('word1', 'meaning1')
+        new_store.snapshot()
+        new_store.add('word2', 'meaning2')
+        new_store._backend.close()
+        new_store._unlock()
+        with store.Store(filename) as new_store:
+            self.assertEqual(2, len(new_store.direct_index))
+            self.assertEqual(1, new_store['revision'])
+        self.assertFalse(os.path.exists(filename +
+                                        store.backends.ROTATED_SUFFIX))
+        with store.Store(filename, read_only=True) as new_store:
+            self.assertEqual(2, len(new_store.direct_index))
+
+    def test_journal_torn_tail(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        with store.Store(filename) as new_store:
+            new_store.add('word1', 'meaning1')
+        with open(filename + store.JOURNAL_SUFFIX, 'ab') as fp:
+            fp.write(b'["index", "wor')
+        with store.Store(filename) as new_store:
+            self.assertEqual({'word1': 'meaning1'}, new_store.direct_index)
+            new_store.add('word2', 'meaning2')
+        new_store = store.Store(filename)
+        self.assertEqual({'word1': 'meaning1', 'word2': 'meaning2'},
+                         new_store.direct_index)
+
+    def test_sorted_items(self):
+        for format in store.FORMATS:
+            filename = os.path.join(self.dir, format)
+            store.create(filename, ('Oo', 'Oo'), format=format)
+            with store.Store(filename) as new_store:
+                new_store.add_many([('b', 'y'), ('c', 'x'), ('a', 'x')])
+                self.assertEqual([('b', 'y'), ('c', 'x')],
+                                 list(new_store.sorted_items(offset=1)),
+                                 format)
+                self.assertEqual([('x', 'c'), ('y', 'b')],
+                                 list(new_store.sorted_items(reverse=True)),
+                                 format)
+
+    def test_find_grep(self):
+        for format in store.FORMATS:
+            filename = os.path.join(self.dir, format)
+            store.create(filename, ('cz', 'Oo'), format=format)
+            with store.Store(filename) as new_store:
+                new_store.add_many([('~cesky', 'czech'), ('~cau', 'hi'),
+                                    ('ahoj', 'hi'), ('d`iky', 'thanks')])
+                self.assertEqual([('čau', 'hi'), ('česky', 'czech')],
+                                 new_store.find('~c'), format)
+                self.assertEqual([('česky', 'czech')],
+                                 new_store.find('~c', offset=1), format)
+                self.assertEqual([('čau', 'hi')],
+                                 new_store.find('~c', limit=1), format)
+                self.assertEqual([('hi', 'čau')],
+                                 new_store.find('h', reverse=True), format)
+                self.assertEqual([('díky', 'thanks')],
+                                 new_store.grep('`ik'), format)
+                self.assertEqual([('czech', 'česky'), ('thanks', 'díky')],
+                                 new_store.grep('ch', reverse=True) +
+                                 new_store.grep('an', reverse=True), format)
+
+    def test_tables(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        with store.Store(filename) as new_store:
+            new_store.table('test')['a'] = [1, 2.5]
+            new_store.table('test')['b'] = 'x'
+        with store.Store(filename) as new_store:
+            self.assertEqual({'a': [1, 2.5], 'b': 'x'},
+                             new_store.table('test'))
+            new_store.compact_threshold = 0
+            del new_store.table('test')['b']
+            new_store.table('other')['c'] = 1
+        self.assertFalse(os.path.exists(filename + store.JOURNAL_SUFFIX))
+        new_store = store.Store(filename)
+        self.assertEqual({'a': [1, 2.5]}, new_store.table('test'))
+        self.assertEqual({'c': 1}, new_store.table('other'))
+
+    def test_journal_replay_tables(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        with store.Store(filename) as new_store:
+            new_store.table('test')['a'] = 1
+        with store.Store(filename) as new_store:
+            # replayed table must still be journaled
+            new_store.table('test')['b'] = 2
+        self.assertEqual({'a': 1, 'b': 2},
+                         store.Store(filename).table('test'))
+
+    def test_locked(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        with store.Store(filename):
+            self.assertRaises(store.LockedError, store.Store, filename)
+            self.assertRaises(store.LockedError, store.create, filename,
+                              ('Oo', 'Oo'))
+        store.Store(filename).close()
+
+    def test_read_only(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        writer = store.Store(filename)
+        self.addCleanup(writer.close)
+        writer.add('word1', 'meaning1')
+        with open(filename + store.JOURNAL_SUFFIX, 'ab') as fp:
+            fp.write(b'["index", "wo')
+        reader = store.Store(filename, read_only=True)
+        self.assertEqual({'word1': 'meaning1'}, reader.direct_index)
+        self.assertRaises(store.ReadOnlyError, reader.add, 'a', 'b')
+        self.assertRaises(store.ReadOnlyError, reader.delete, 'word1')
+        self.assertRaises(store.ReadOnlyError, reader.save)
+        reader.table('test')['key'] = 'value'
+        reader.close()
+        # the torn tail is only dropped by the writer
+        with open(filename + store.JOURNAL_SUFFIX, 'rb') as fp:
+            self.assertTrue(fp.read().endswith(b'"wo'))
+
+    def test_compact_revision(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        with store.Store(filename) as new_store:
+            new_store.add('word1', 'meaning1')
+            new_store.compact()
+            new_store.add('word2', 'meaning2')
+        self.assertEqual(['file', 'file.journal', 'file.lock'],
+                         sorted(os.listdir(self.dir)))
+        new_store = store.Store(filename, read_only=True)
+        self.assertEqual(1, new_store['revision'])
+        self.assertEqual(2, len(new_store.direct_index))
+
+    def test_stale_journal(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        with store.Store(filename) as new_store:
+            new_store.add('word1', 'meaning1')
+            new_store.save()
+            with open(filename + store.JOURNAL_SUFFIX, 'rb') as fp:
+                data = fp.read()
+            new_store.delete('word1')
+            new_store.compact()
+        # a crash before the journal of revision 0 was removed
+        with open(filename + store.JOURNAL_SUFFIX, 'wb') as fp:
+            fp.write(data)
+        with store.Store(filename) as new_store:
+            self.assertEqual({}, new_store.direct_index)
+        self.assertFalse(os.path.exists(filename + store.JOURNAL_SUFFIX))
+
+    def test_replaced_while_loading(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        with open(filename + store.JOURNAL_SUFFIX, 'wb') as fp:
+            # a journal of a snapshot newer than the one on disk
+            fp.write(b'{"revision": 1}\n["index", "word", "meaning"]\n')
+        self.assertRaises(store.ConflictError, store.Store, filename,
+                          read_only=True)
+        self.assertRaises(store.ConflictError, store.Store, filename)
+        # the lock is released on failure
+        with store.locking.FileLock(filename + store.LOCK_SUFFIX):
+            pass
+
+    def test_replaced_by_other_process(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        new_store = store.Store(filename)
+        self.addCleanup(new_store._backend.close)
+        new_store.add('word', 'meaning')
+        os.remove(filename)
+        store.backends.JsonBackend.create(filename, ('Oo', 'Oo'))
+        self.assertRaises(store.ConflictError, new_store.compact)
+
+    def test_create_removes_journal(self):
+        filename = os.path.join(self.dir, 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        with store.Store(filename) as new_store:
+            new_store.add('word', 'meaning')
+        store.create(filename, ('Oo', 'Oo'))
+        self.assertEqual({}, store.Store(filename).direct_index)
+
+
+class TestBinaryStore(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'file')
+
+    def test_codec(self):
+        meta = {'languages': ['cz', 'ru'], 'tables': {'t': {'a': [1]}}}
+        items = [('word%d' % i, 'meaning') for i in range(10)]
+        items.append(('with\0nul', ''))
+        fp = io.BytesIO()
+        with patch.object(binary, 'CHUNK_SIZE', 4):
+            binary.dump(fp, meta, items)
+        fp.seek(0)
+        self.assertEqual((meta, dict(items)), binary.load(fp))
+
+    def test_codec_errors(self):
+        self.assertRaises(ValueError, binary.load, io.BytesIO(b'xxx'))
+        fp = io.BytesIO()
+        binary.dump(fp, {}, [('word', 'meaning')])
+        self.assertRaises(ValueError, binary.load,
+                          io.BytesIO(fp.getvalue()[:-1]))
+
+    def test_create_open(self):
+        store.create(self.filename, ('Oo', 'Oo'), format='binary')
+        with store.Store(self.filename) as new_store:
+            self.assertEqual('binary', new_store._backend.name)
+            new_store.add('word1', 'meaning1')
+            new_store.table('test')['key'] = 'value'
+            new_store.compact()
+            new_store.add('word2', 'meaning2')
+        new_store = store.Store(self.filename, read_only=True)
+        self.assertEqual({'word1': 'meaning1', 'word2': 'meaning2'},
+                         new_store.direct_index)
+        self.assertEqual({'key': 'value'}, new_store.table('test'))
+        self.assertEqual(2, new_store['version'])
+
+    def test_convert(self):
+        store.create(self.filename, ('Oo', 'Oo'))
+        with store.Store(self.filename) as new_store:
+            new_store.add('word1', 'meaning1')
+            new_store.table('test')['key'] = 'value'
+        for format in ('binary', 'sqlite', 'json', 'json'):
+            store.convert(self.filename, format)
+            new_store = store.Store(self.filename, read_only=True)
+            self.assertEqual(format, new_store._backend.name)
+            self.assertEqual({'word1': 'meaning1'}, new_store.direct_index)
+            self.assertEqual({'key': 'value'}, new_store.table('test'))
+            new_store.close()
+        self.assertEqual(['file', 'file.lock'], sorted(os.listdir(self.dir)))
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_run(self):
+        results = benchmark.run(['matching_command', 'store.delete',
+                                 'store.open.binary'], sizes=(10, 20),
+                                repeat=1)
+        self.assertEqual([('matching_command', None), ('store.delete', 10),
+                          ('store.open.binary', 10), ('store.delete', 20),
+                          ('store.open.binary', 20)],
+                         [(x['name'], x['size']) for x in results])
+        self.assertEqual(10, results[1]['ops'])
+        self.assertGreater(results[1]['seconds'], 0)
+
+    def test_compare(self):
+        baseline = [{'name': 'a', 'size': 10, 'seconds': 1.0},
+                    {'name': 'b', 'size': None, 'seconds': 1.0}]
+        results = [{'name': 'a', 'size': 10, 'seconds': 1.1},
+                   {'name': 'a', 'size': 20, 'seconds': 5.0},
+                   {'name': 'b', 'size': None, 'seconds': 1.5}]
+        self.assertEqual([(results[2], 1.0)],
+                         benchmark.compare(results, baseline))
+        self.assertEqual(2, len(benchmark.compare(results, baseline, 0.05)))
+
+
+class TestSqliteStore(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.filename = os.path.join(tempfile.mkdtemp(), 'file')
+        store.create(self.filename, ('cz', 'Oo'), format='sqlite')
+
+    def test_create_open(self):
+        new_store = store.Store(self.filename)
+        self.assertEqual(('cz', 'Oo'), new_store.languages)
+        self.assertEqual(1, new_store['version'])
+        self.assertEqual({}, new_store.direct_index)
+        self.assertEqual({}, new_store.reverse_index)
+        self.assertIsInstance(new_store.original_plugin, lang_cz.Czech)
+
+    def test_add_delete_save(self):
+        with store.Store(self.filename) as new_store:
+            new_store.add('word1', 'meaning1')
+            new_store.add('word2', 'meaning2')
+            new_store.add('word3', 'meaning1')
+            new_store.add('word2', 'meaning3', may_overwrite=True)
+            self.assertRaises(KeyError, new_store.add, 'word1', 'x')
+            new_store.delete('word1')
+            self.assertRaises(KeyError, new_store.delete, 'word1')
+        new_store = store.Store(self.filename)
+        self.assertEqual({'word2': 'meaning3', 'word3': 'meaning1'},
+                         new_store.direct_index)
+        self.assertEqual({'meaning3': 'word2', 'meaning1': 'word3'},
+                         new_store.reverse_index)
+        self.assertEqual(2, len(new_store.direct_index))
+        self.assertIn('word2', new_store.direct_index)
+        self.assertNotIn('word1', new_store.direct_index)
+
+    def test_shared_meaning(self):
+        with store.Store(self.filename) as new_store:
+            new_store.add('word1', 'meaning')
+            new_store.add('word2', 'meaning')
+            self.assertEqual('word1', new_store.reverse_index['meaning'])
+            self.assertEqual(('word1', 'word2'),
+                             new_store.reverse_index.originals('meaning'))
+            self.assertEqual(1, len(new_store.reverse_index))
+
+    def test_item_at(self):
+        with store.Store(self.filename) as new_store:
+            for word in 'abcd':
+                new_store.add(word, 'meaning')
+            new_store.add('e', 'other')
+            new_store.delete('b')
+            idx = new_store.direct_index
+            self.assertEqual(4, idx.positions)
+            self.assertEqual({('a', 'meaning'), ('c', 'meaning'),
+                              ('d', 'meaning'), ('e', 'other')},
+                             {idx.item_at(i) for i in range(4)})
+            self.assertRaises(IndexError, idx.item_at, 4)
+            items = [new_store.reverse_index.item_at(i) for i in range(4)]
+            self.assertEqual(2, items.count(None))
+            self.assertIn(('meaning', 'a'), items)
+            self.assertIn(('other', 'e'), items)
+
+    def test_several_meanings(self):
+        with store.Store(self.filename) as new_store:
+            new_store.add('word1', 'p; r')
+            new_store.add('word2', 'r')
+            new_store.add_meanings('word3', 's')
+            reverse = new_store.reverse_index
+            self.assertEqual({'p': 'word1', 'r': 'word1', 's': 'word3'},
+                             reverse)
+            self.assertEqual(('word1', 'word2'), reverse.originals('r'))
+            self.assertEqual([('r', 'word1'), ('s', 'word3')],
+                             new_store.find('', reverse=True, offset=1))
+            items = {reverse.item_at(i) for i in range(reverse.positions)}
+            self.assertEqual({('p', 'word1'), ('r', 'word1'),
+                              ('s', 'word3'), None}, items)
+            new_store.add('word1', 'q', may_overwrite=True)
+            new_store.delete('word3')
+            self.assertEqual({'q': 'word1', 'r': 'word2'}, reverse)
+            self.assertEqual(2, reverse.positions)
+            # the same as the in-memory reverse index
+            self.assertEqual(
+                index.Index(dict(new_store.direct_index.items())).reverse,
+                reverse)
+
+    def test_store_without_meanings(self):
+        with store.Store(self.filename) as new_store:
+            new_store.add('word1', 'p; r')
+            new_store.add('word2', 'r')
+            new_store._backend._db.execute('DROP TABLE meanings')
+        with store.Store(self.filename, read_only=True) as reader:
+            self.assertEqual(('word1', 'word2'),
+                             reader.reverse_index.originals('r'))
+        with store.Store(self.filename) as new_store:
+            self.assertEqual('word1', new_store.reverse_index['p'])
+        with store.Store(self.filename, read_only=True) as reader:
+            self.assertEqual(2, len(reader.reverse_index))
+
+    def test_item_at_renumber(self):
+        with store.Store(self.filename) as new_store:
+            for word in 'abcd':
+                new_store.add(word, word)
+            # ids with holes, as written before they were kept dense
+            new_store._backend._db.execute(
+                'UPDATE words SET id = id * 10')
+            self.assertEqual(4, new_store.direct_index.positions)
+            self.assertEqual(('c', 'c'), new_store.direct_index.item_at(2))
+
+    def test_tables(self):
+        with store.Store(self.filename) as new_store:
+            table = new_store.table('test')
+            table['a'] = [1, 2.5]
+            table['b'] = 'x'
+            del table['b']
+            self.assertRaises(KeyError, table.__delitem__, 'b')
+        new_store = store.Store(self.filename)
+        self.assertEqual({'a': [1, 2.5]}, new_store.table('test'))
+        self.assertEqual({}, new_store.table('other'))
+
+    def test_not_saved(self):
+        new_store = store.Store(self.filename)
+        new_store.add('word', 'meaning')
+        self.assertEqual({}, store.Store(self.filename,
+                                         read_only=True).direct_index)
+
+    def test_read_only(self):
+        new_store = store.Store(self.filename)
+        new_store.add('word', 'meaning')
+        new_store.save()
+        reader = store.Store(self.filename, read_only=True)
+        self.assertEqual({'word': 'meaning'}, reader.direct_index)
+        self.assertEqual({}, reader.table('reviews'))
+        self.assertRaises(store.ReadOnlyError, reader.add, 'a', 'b')
+        reader.close()
+
+
+class TestBulk(unittest.TestCase):
+
+    PAIRS = [('word1', 'meaning1'), ('word, 2', 'meaning "2"')]
+
+    def test_formats_round_trip(self):
+        for format in bulk.FORMATS:
+            fp = io.StringIO()
+            bulk.write_pairs(fp, self.PAIRS, format)
+            fp.seek(0)
+            self.assertEqual(self.PAIRS, list(bulk.read_pairs(fp, format)),
+                             format)
+
+    def test_read_tsv_skips_comments(self):
+        fp = io.StringIO('# comment\n\nword\t meaning \n')
+        self.assertEqual([('word', 'meaning')], list(bulk.read_pairs(fp)))
+
+    def test_read_bad_line(self):
+        fp = io.StringIO('word\tmeaning\nword\n')
+        with self.assertRaisesRegex(ValueError, 'Line 2'):
+            list(bulk.read_pairs(fp))
+
+    def test_read_jsonl(self):
+        fp = io.StringIO('{"word": "w1", "meaning": "m1"}\n["w2", "m2"]\n')
+        self.assertEqual([('w1', 'm1'), ('w2', 'm2')],
+                         list(bulk.read_pairs(fp, 'jsonl')))
+
+    def test_detect_format(self):
+        self.assertEqual('csv', bulk.detect_format('a/b.CSV'))
+        self.assertEqual('tsv', bulk.detect_format('-'))
+        self.assertRaises(ValueError, bulk.detect_format, 'file.xls')
+
+    def test_import_export(self):
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'store')
+        source = os.path.join(directory, 'words.csv')
+        target = os.path.join(directory, 'words.jsonl')
+        with open(source, 'w') as fp:
+            fp.write('b,1\na,2\nc,3\nb,4\n')
+        for format in store.FORMATS:
+            store.create(filename, ('Oo', 'Oo'), format=format)
+            with store.Store(filename) as new_store:
+                self.assertEqual((3, 1), bulk.import_file(new_store, source,
+                                                          batch_size=2))
+                self.assertEqual(3, bulk.export_file(new_store, target))
+            with open(target) as fp:
+                self.assertEqual([('a', '2'), ('b', '1'), ('c', '3')],
+                                 list(bulk.read_pairs(fp, 'jsonl')))
+
+    def test_import_malformed(self):
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'store')
+        source = os.path.join(directory, 'words.tsv')
+        with open(source, 'w') as fp:
+            fp.write('a\t1\nb\t2\nc\n')
+        store.create(filename, ('Oo', 'Oo'))
+        with store.Store(filename) as new_store:
+            self.assertRaises(ValueError, bulk.import_file, new_store,
+                              source, batch_size=1)
+            self.assertEqual({}, new_store.direct_index)
+
 
 class TestTrainer(StoreMixin, unittest.TestCase):
 
     def test_unexpected_kind(self):
         self.assertRaises(ValueError, trainer.Trainer, self.store, "42")
 
+    def test_no_words(self):
+        self.store.delete_many(list(self.store.direct_index))
+        for spaced in (False, True):
+            tr = trainer.Trainer(self.store, trainer.DIRECT, spaced=spaced)
+            self.assertRaises(IndexError, tr.next)
+
     def test_direct_next(self):
         tr = trainer.Trainer(self.store, trainer.DIRECT)
         for _ in range(10):
@@ -127,6 +895,19 @@ class TestTrainer(StoreMixin, unittest.TestCase):
             self.assertEqual(challenge, tr.challenge)
             self.assertEqual(self.store.reverse_index[challenge], tr.answer)
 
+    def test_cycle(self):
+        self.store.add('word3', 'meaning3')
+        tr = trainer.Trainer(self.store, trainer.DIRECT)
+        for _ in range(3):
+            self.assertEqual(set(self.store.direct_index),
+                             {tr.next() for _ in range(3)})
+
+    def test_deleted_during_cycle(self):
+        tr = trainer.Trainer(self.store, trainer.DIRECT)
+        self.store.delete('word1')
+        for _ in range(5):
+            self.assertEqual('word2', tr.next())
+
     @patch.object(plugins_base.BaseLanguage, 'convert_word')
     def test_check(self, convert_mock):
         convert_mock.side_effect = lambda word: word
@@ -137,6 +918,258 @@ class TestTrainer(StoreMixin, unittest.TestCase):
         convert_mock.assert_any_call(tr.answer)
         convert_mock.assert_any_call(tr.answer + 'x')
 
+    def test_any_meaning(self):
+        self.store.add('word3', ['meaning3', 'other'])
+        self.store.add('word4', 'other')
+        self.assertEqual(('meaning3', 'other'), self.store.meanings('word3'))
+        tr = trainer.Trainer(self.store, trainer.DIRECT)
+        while tr.next() != 'word3':
+            pass
+        self.assertTrue(tr.check('other'))
+        self.assertTrue(tr.check(' meaning3'))
+        self.assertFalse(tr.check('meaning3; other'))
+        tr = trainer.Trainer(self.store, trainer.REVERSE)
+        while tr.next() != 'other':
+            pass
+        self.assertTrue(tr.check('word3'))
+        self.assertTrue(tr.check('word4'))
+
+    def test_tolerant(self):
+        self.store.add('word3', 'příliš')
+        tr = trainer.Trainer(self.store, trainer.DIRECT, tolerant=True)
+        while tr.next() != 'word3':
+            pass
+        self.assertTrue(tr.check('prilis'))
+        self.assertEqual('příliš', tr.near_miss)
+        self.assertTrue(tr.check('přílš'))
+        self.assertEqual('příliš', tr.near_miss)
+        self.assertTrue(tr.check('příliš'))
+        self.assertIsNone(tr.near_miss)
+        self.assertFalse(tr.check('prlš'))
+        self.assertIsNone(tr.near_miss)
+
+    def test_not_tolerant(self):
+        tr = trainer.Trainer(self.store, trainer.DIRECT)
+        tr.next()
+        self.assertFalse(tr.check(tr.answer.upper()))
+        self.assertIsNone(tr.near_miss)
+
+    def test_spaced(self):
+        tr = trainer.Trainer(self.store, trainer.DIRECT, spaced=True)
+        first = tr.next()
+        self.assertTrue(tr.check(tr.answer))
+        second = tr.next()
+        self.assertNotEqual(first, second)
+        self.assertFalse(tr.check(tr.answer + 'x'))
+        self.assertTrue(tr.check(tr.answer))
+        reviews = self.store.table('reviews.direct')
+        self.assertEqual(1, reviews[first][1])
+        self.assertEqual(0, reviews[second][1])
+
+    def test_spaced_skip(self):
+        tr = trainer.Trainer(self.store, trainer.REVERSE, spaced=True)
+        first = tr.next()
+        tr.next()
+        self.assertEqual(0, self.store.table('reviews.reverse')[first][2])
+
+    def test_prefetch(self):
+        tr = trainer.Trainer(self.store, trainer.DIRECT)
+        first = tr.next()
+        tr.prefetch()
+        prefetched = tr._prefetched
+        tr.prefetch()
+        self.assertIs(prefetched, tr._prefetched)
+        self.assertNotEqual(first, prefetched[0])
+        self.assertEqual(prefetched[0], tr.next())
+        self.assertEqual(prefetched[1], tr.answer)
+        self.store.add('word3', 'meaning3')
+        tr.prefetch()
+        prefetched = tr._prefetched[0]
+        self.store.delete(prefetched)
+        self.assertNotEqual(prefetched, tr.next())
+
+    def test_prefetch_spaced(self):
+        tr = trainer.Trainer(self.store, trainer.DIRECT, spaced=True)
+        tr.next()
+        tr.prefetch()
+        self.assertIsNone(tr._prefetched)
+
+    @patch.object(trainer.time, 'monotonic')
+    def test_history(self, monotonic_mock):
+        monotonic_mock.side_effect = [10, 12, 15.5, 20, 21, 22]
+        filename = os.path.join(tempfile.mkdtemp(), 'history')
+        self.store.history = history.History(filename)
+        self.addCleanup(self.store.history.close)
+        tr = trainer.Trainer(self.store, trainer.REVERSE, learner='bob')
+        first = tr.next()
+        self.assertFalse(tr.check('x'))
+        self.assertTrue(tr.check(tr.answer))
+        second = tr.next()
+        tr.next()
+        records = list(history.read(filename))
+        self.assertEqual(
+            [(first, 'x', 2.0, history.REVERSE),
+             (first, self.store.reverse_index[first], 3.5,
+              history.REVERSE | history.CORRECT),
+             (second, '', 1.0, history.REVERSE | history.SKIPPED)],
+            [(x.challenge, x.answer, x.latency, x.flags) for x in records])
+        self.assertEqual({'bob'}, {x.learner for x in records})
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.now = 1000000
+        self.index = {'a': '1', 'b': '2', 'c': '3'}
+        self.reviews = {}
+
+    def scheduler(self, **kwargs):
+        return scheduler.Scheduler(self.index, self.reviews,
+                                   clock=lambda: self.now, **kwargs)
+
+    def test_new_words(self):
+        sch = self.scheduler(new_words=2)
+        seen = []
+        for _ in range(2):
+            seen.append(sch.next())
+            sch.record(seen[-1], 5)
+        self.assertEqual(2, len(set(seen)))
+        # no more new words: learn ahead the earliest one
+        self.assertEqual(seen[0], sch.next())
+
+    def test_due_first(self):
+        self.reviews['c'] = [self.now - 1, 1, 1, 2.5]
+        self.reviews['b'] = [self.now + 100, 1, 1, 2.5]
+        sch = self.scheduler()
+        self.assertEqual('c', sch.next())
+        sch.record('c', 5)
+        self.assertEqual('a', sch.next())
+
+    def test_intervals(self):
+        sch = self.scheduler()
+        for expected in (1, 6, 16):
+            sch.record('a', 5)
+            self.assertEqual(expected, self.reviews['a'][1])
+        self.assertEqual(self.now + 16 * scheduler.DAY, self.reviews['a'][0])
+        sch.record('a', 1)
+        self.assertEqual([self.now + scheduler.RETRY_DELAY, 0, 0],
+                         self.reviews['a'][:3])
+        self.assertGreaterEqual(self.reviews['a'][3], scheduler.MIN_EASINESS)
+
+    def test_deleted_word(self):
+        self.reviews['x'] = [self.now - 1, 1, 1, 2.5]
+        sch = self.scheduler(new_words=0)
+        self.assertRaises(IndexError, sch.next)
+
+
+class TestFuzzy(unittest.TestCase):
+
+    def test_fold(self):
+        self.assertEqual('prilis zlutoucky', fuzzy.fold('Příliš žluťoučký'))
+
+    def test_distance(self):
+        self.assertEqual(0, fuzzy.distance('abc', 'abc', 2))
+        self.assertEqual(1, fuzzy.distance('abc', 'abd', 2))
+        self.assertEqual(3, fuzzy.distance('kitten', 'sitting', 5))
+        self.assertEqual(3, fuzzy.distance('kitten', 'sitting', 2))
+        self.assertEqual(3, fuzzy.distance('a', 'abcdef', 2))
+
+    def test_matcher(self):
+        matcher = fuzzy.Matcher(['kůň', 'dům', 'město'])
+        self.assertEqual('kůň', matcher.match('KUN'))
+        self.assertEqual('dům', matcher.match('dum'))
+        self.assertEqual('město', matcher.match('msto'))
+        self.assertIsNone(matcher.match('xyz'))
+
+    def test_matcher_short(self):
+        matcher = fuzzy.Matcher(['a', 'to', 'dům'])
+        self.assertIsNone(matcher.match('i'))
+        self.assertIsNone(matcher.match('do'))
+        self.assertIsNone(matcher.match('dm'))
+        self.assertEqual('to', matcher.match('TO'))
+        matcher = fuzzy.Matcher(['příliš', 'žluťoučký'], max_distance=2)
+        self.assertIsNone(matcher.match('prls'))
+        self.assertEqual('žluťoučký', matcher.match('zlutuky'))
+
+
+class TestParseOptions(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(
+            (['a=b', 'c'], {'offset': 5, 'reverse': True, 'name': 'x'}),
+            utils.parse_options(['a=b', 'offset=5', 'c', 'reverse=yes',
+                                 'name=x'],
+                                offset=0, reverse=False, name=''))
+
+    def test_defaults(self):
+        self.assertEqual(([], {'limit': 20}),
+                         utils.parse_options([], limit=20))
+
+    def test_bad_int(self):
+        self.assertRaises(ValueError, utils.parse_options, ['limit=x'],
+                          limit=20)
+        self.assertRaises(ValueError, utils.parse_options, ['limit=-1'],
+                          limit=20)
+
+
+class TestCommandTable(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.aliases = index.Table()
+        self.table = utils.CommandTable(
+            {'add': 1, 'add!': 2, 'delete': 3, 'direct': 4},
+            aliases=self.aliases)
+
+    def test_match(self):
+        self.assertEqual(('add', 1), self.table.match('add'))
+        self.assertEqual(('add!', 2), self.table.match('add!'))
+        self.assertEqual(('delete', 3), self.table.match('del '))
+        self.assertEqual(('direct', 4), utils.matching_command(
+            'dir', {'delete': 3, 'direct': 4}))
+
+    def test_errors(self):
+        self.assertRaisesRegex(KeyError, 'No such command: x',
+                               self.table.match, 'x')
+        self.assertRaisesRegex(KeyError, 'candidates are delete, direct',
+                               self.table.match, 'd')
+
+    def test_default(self):
+        table = utils.CommandTable({'/quit': 1, None: 2})
+        self.assertEqual(('/quit', 1), table.match('/q'))
+        self.assertEqual(('word', 2), table.match('word'))
+
+    def test_aliases(self):
+        self.aliases['rm'] = 'delete'
+        self.aliases['remove'] = 'delete'
+        self.aliases['add'] = 'delete'
+        self.assertEqual(('delete', 3), self.table.match('rm'))
+        self.assertEqual(('delete', 3), self.table.match('r'))
+        self.assertEqual(('add', 1), self.table.match('add'))
+        del self.aliases['rm']
+        self.assertEqual(('delete', 3), self.table.match('r'))
+        self.assertNotIn('rm', self.table.complete(''))
+
+    def test_complete(self):
+        self.aliases['da'] = 'add'
+        self.assertEqual(['da', 'delete', 'direct'], self.table.complete('d'))
+        self.assertEqual(['add', 'add!'], self.table.complete('add'))
+        self.assertEqual([], self.table.complete('x'))
+
+
+class TestLazyPermutation(unittest.TestCase):
+
+    def test_permutation(self):
+        self.assertEqual(list(range(100)),
+                         sorted(utils.lazy_permutation(100)))
+        self.assertEqual([], list(utils.lazy_permutation(0)))
+
+    def test_lazy(self):
+        permutation = utils.lazy_permutation(10 ** 12)
+        values = [next(permutation) for _ in range(10)]
+        self.assertEqual(10, len(set(values)))
+
 
 class TestBaseLanguage(unittest.TestCase):
 
@@ -146,12 +1179,114 @@ class TestBaseLanguage(unittest.TestCase):
 
         self.assertEqual('aBBccBB', Test(None).convert_word('abbccbb'))
 
+    def test_convert_word_longest_match(self):
+        class Test(plugins_base.BaseLanguage):
+            patterns = {'a': 'x', 'ab': 'y', 'b': 'a'}
+
+        self.assertEqual('xy', Test(None).convert_word('aab'))
+        # replacements are not rescanned
+        self.assertEqual('ax', Test(None).convert_word('ba'))
+
+    def test_convert_word_no_patterns(self):
+        self.assertEqual('abc',
+                         plugins_base.BaseLanguage(None).convert_word('abc'))
+
+    def test_convert_words(self):
+        class Test(plugins_base.BaseLanguage):
+            patterns = {'bb': 'BB'}
+
+        self.assertEqual(['aBB', 'c'], Test(None).convert_words(['abb', 'c']))
+
+    def test_czech(self):
+        self.assertEqual('příliš',
+                         lang_cz.Czech(None).convert_word('p~r`ili~s'))
+
+    def test_cache(self):
+        class Test(plugins_base.BaseLanguage):
+            patterns = {'bb': 'BB'}
+            cache_size = 2
+
+        plugin = Test()
+        self.assertIsNone(plugins_base.BaseLanguage().cache)
+        for word in ('abb', 'abb', 'c', 'd', 'abb'):
+            self.assertEqual(word.replace('bb', 'BB'),
+                             plugin.convert_word(word))
+        self.assertEqual({'size': 2, 'capacity': 2, 'hits': 1, 'misses': 4,
+                          'evictions': 2}, plugin.cache.stats())
+
+    def test_patterns_changed(self):
+        class Test(plugins_base.BaseLanguage):
+            patterns = {'bb': 'BB'}
+            cache_size = 10
+
+        cached, uncached = Test(), Test()
+        uncached.cache = None
+        for plugin in (cached, uncached):
+            self.assertEqual('aBB', plugin.convert_word('abb'))
+        Test.patterns['a'] = 'A'
+        for plugin in (cached, uncached):
+            self.assertEqual('ABB', plugin.convert_word('abb'))
+        Test.patterns = {'b': 'x'}
+        for plugin in (cached, uncached):
+            self.assertEqual('axx', plugin.convert_word('abb'))
+        self.assertEqual(0, cached.cache.hits)
+
     def test_present(self):
         self.assertFalse(plugins_base.BaseLanguage(None).present)
         desc = type('Test', (plugins_base.BaseLanguage,), {})
         self.assertTrue(desc.present)
 
 
+class TestPluginRegistry(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.registry = plugins.Registry()
+
+    @patch.object(plugins, '_entry_points', return_value=[])
+    def test_discovery(self, entry_points_mock):
+        self.assertEqual(['cz'], self.registry.available())
+        self.assertTrue(self.registry.has('cz'))
+        self.assertFalse(self.registry.has('base'))
+        self.assertFalse(self.registry.has('xx'))
+        # discovery is cached
+        entry_points_mock.assert_called_once_with(plugins.ENTRY_POINT_GROUP)
+
+    @patch.object(plugins, '_entry_points', return_value=[])
+    def test_shared_instances(self, entry_points_mock):
+        plugin = self.registry.get('cz')
+        self.assertIsInstance(plugin, lang_cz.Czech)
+        self.assertIs(plugin, self.registry.get('cz'))
+        identity = self.registry.get('xx')
+        self.assertIs(plugins_base.BaseLanguage, identity.__class__)
+        self.assertIs(identity, self.registry.get('yy'))
+
+    @patch.object(plugins, '_entry_points')
+    def test_entry_points(self, entry_points_mock):
+        class Test(plugins_base.BaseLanguage):
+            patterns = {'a': 'b'}
+
+        entry_point = type('EntryPoint', (), {'name': 'xx',
+                                              'load': lambda: Test})
+        entry_points_mock.return_value = [entry_point]
+        self.assertEqual(['cz', 'xx'], self.registry.available())
+        self.assertEqual('b', self.registry.get('xx').convert_word('a'))
+        self.registry.invalidate()
+        entry_points_mock.return_value = []
+        self.assertFalse(self.registry.has('xx'))
+
+    def test_lazy_store(self):
+        filename = os.path.join(tempfile.mkdtemp(), 'file')
+        store.create(filename, ('cz', 'Oo'))
+        with patch.object(plugins.registry, 'get',
+                          return_value=plugins_base.BaseLanguage()) as get:
+            with store.Store(filename) as new_store:
+                self.assertFalse(get.called)
+                new_store.add('word', 'meaning')
+                get.assert_any_call('cz')
+                get.assert_any_call('Oo')
+
+
 @patch.object(store.Store, 'add')
 class TestCliAdd(StoreMixin, unittest.TestCase):
 
@@ -166,25 +1301,92 @@ class TestCliAdd(StoreMixin, unittest.TestCase):
                                          may_overwrite=True)
 
 
-@patch.object(store.Store, 'delete')
+@patch.object(builtins, 'print')
+class TestCliFind(StoreMixin, unittest.TestCase):
+
+    def test_find(self, print_mock):
+        cli.find('find', self.store, ['word'])
+        print_mock.assert_called_once_with(
+            "word1\tmeaning1\nword2\tmeaning2\n", end='')
+
+    def test_find_more(self, print_mock):
+        cli.find('find', self.store, ['word', 'limit=1'])
+        print_mock.assert_any_call("word1\tmeaning1\n", end='')
+        print_mock.assert_any_call("... more results, use offset=1")
+        self.assertEqual(2, print_mock.call_count)
+
+    def test_grep_reverse(self, print_mock):
+        cli.find('grep', self.store, ['ing2', 'reverse=yes'])
+        print_mock.assert_called_once_with("meaning2\tword2\n", end='')
+
+    def test_nothing(self, print_mock):
+        cli.find('find', self.store, ['x'])
+        print_mock.assert_called_once_with("Nothing found")
+
+    def test_bad_arguments(self, print_mock):
+        cli.find('find', self.store, [])
+        print_mock.assert_called_once_with(
+            "ERROR: `find`: exactly one search string expected")
+
+
+@patch.object(builtins, 'print')
+class TestCliImportExport(StoreMixin, unittest.TestCase):
+
+    @patch.object(bulk, 'import_file', return_value=(2, 1))
+    def test_import(self, import_mock, print_mock):
+        cli.import_('import!', self.store, ['file.tsv'])
+        import_mock.assert_called_once_with(self.store, 'file.tsv',
+                                            may_overwrite=True)
+        print_mock.assert_called_once_with(
+            "Imported 2 words, skipped 1 existing")
+
+    def test_import_error(self, print_mock):
+        cli.import_('import', self.store, ['/nonexistent/file.tsv'])
+        self.assertTrue(print_mock.call_args[0][0].startswith(
+            "ERROR: `import`: "))
+
+    def test_main_import_error(self, print_mock):
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'store')
+        source = os.path.join(directory, 'words.tsv')
+        with open(source, 'w') as fp:
+            fp.write('a\t1\nb\n')
+        argv = ['cli', '--languages', 'Oo,Oo', '--import', source, filename]
+        with patch.object(cli.sys, 'argv', argv), \
+                patch.object(cli.sys, 'stderr', io.StringIO()) as stderr:
+            with self.assertRaises(SystemExit) as context:
+                cli.main()
+        self.assertEqual(1, context.exception.code)
+        self.assertEqual("ERROR: Line 2: expected word and meaning, got "
+                         "['b']\n", stderr.getvalue())
+        with store.Store(filename, read_only=True) as new_store:
+            self.assertEqual({}, new_store.direct_index)
+
+    @patch.object(bulk, 'export_file', return_value=2)
+    def test_export(self, export_mock, print_mock):
+        cli.export('export', self.store, ['file.csv', 'tsv'])
+        export_mock.assert_called_once_with(self.store, 'file.csv', 'tsv')
+        print_mock.assert_called_once_with("Exported 2 words")
+
+
+@patch.object(store.Store, 'delete_many')
 class TestCliDelete(StoreMixin, unittest.TestCase):
 
     def test_delete(self, delete_mock):
         cli.delete('delete', self.store, ['word1'])
-        delete_mock.assert_called_once_with('word1')
+        delete_mock.assert_called_once_with(['word1'])
 
     def test_delete_multi(self, delete_mock):
         cli.delete('delete', self.store, ['word1', 'word2'])
-        delete_mock.assert_any_call('word1')
-        delete_mock.assert_any_call('word2')
+        delete_mock.assert_called_once_with(['word1', 'word2'])
 
     @patch.object(builtins, 'print')
     def test_delete_not_found(self, print_mock, delete_mock):
-        delete_mock.side_effect = KeyError
+        delete_mock.side_effect = KeyError('word??')
         cli.delete('delete', self.store, ['word??', 'word'])
         print_mock.assert_called_once_with(
             "ERROR: `delete`: word 'word??' was not found")
-        delete_mock.assert_called_once_with('word??')
+        delete_mock.assert_called_once_with(['word??', 'word'])
 
 
 @patch.object(builtins, 'print')
@@ -192,9 +1394,214 @@ class TestCliList(StoreMixin, unittest.TestCase):
 
     def test_list(self, print_mock):
         cli.list_('list', self.store, [])
-        print_mock.assert_any_call("word1\tmeaning1")
-        print_mock.assert_any_call("word2\tmeaning2")
-        self.assertEqual(2, print_mock.call_count)
+        print_mock.assert_called_once_with(
+            "word1\tmeaning1\nword2\tmeaning2\n", end='')
+
+    def test_list_page(self, print_mock):
+        self.store.add('word0', 'meaning0')
+        cli.list_('list', self.store, ['offset=1', 'limit=1'])
+        print_mock.assert_called_once_with("word1\tmeaning1\n", end='')
+
+    def test_list_filter_reverse(self, print_mock):
+        cli.list_('list', self.store, ['filter=2', 'reverse=yes'])
+        print_mock.assert_called_once_with("meaning2\tword2\n", end='')
+
+    def test_list_updated(self, print_mock):
+        cli.list_('list', self.store, [])
+        self.store.add('word0', 'meaning0')
+        self.store.delete('word2')
+        cli.list_('list', self.store, [])
+        print_mock.assert_called_with(
+            "word0\tmeaning0\nword1\tmeaning1\n", end='')
+
+    def test_list_chunks(self, print_mock):
+        cli.write_items([('a', 'b')] * 5, chunk_size=2)
+        self.assertEqual(3, print_mock.call_count)
+        print_mock.assert_called_with("a\tb\n", end='')
+
+    def test_list_bad_arguments(self, print_mock):
+        cli.list_('list', self.store, ['xxx'])
+        print_mock.assert_called_once_with(
+            "ERROR: `list`: unknown arguments: xxx")
+
+
+@patch.object(builtins, 'print')
+class TestCliBatch(StoreMixin, unittest.TestCase):
+
+    def test_add_delete(self, print_mock):
+        with patch.object(store.Store, 'add_many',
+                          return_value=[]) as add_mock:
+            failed = cli.run_batch(self.store, [
+                'add word3=meaning3\n',
+                '# comment\n',
+                '\n',
+                'add word4="meaning 4"',
+                'add! word1=meaning5',
+            ], 'script')
+        self.assertEqual(0, failed)
+        self.assertEqual([
+            (([('word3', 'meaning3'), ('word4', 'meaning 4')],),
+             {'may_overwrite': False}),
+            (([('word1', 'meaning5')],), {'may_overwrite': True}),
+        ], add_mock.call_args_list)
+        self.assertFalse(print_mock.called)
+
+    def test_add_existing(self, print_mock):
+        failed = cli.run_batch(self.store, [
+            'add word3=meaning3 word1=meaning4',
+            'add word5=meaning5',
+            'add word3=meaning6',
+        ], 'script')
+        self.assertEqual(2, failed)
+        self.assertEqual('meaning3', self.store.direct_index['word3'])
+        self.assertEqual('meaning5', self.store.direct_index['word5'])
+        self.assertEqual([
+            (("script:1: ERROR: `add`: This word already in dictionary: "
+              "word1",),),
+            (("script:3: ERROR: `add`: This word already in dictionary: "
+              "word3",),),
+        ], print_mock.call_args_list)
+
+    def test_delete_missing(self, print_mock):
+        self.store.add('word3', 'meaning3')
+        failed = cli.run_batch(self.store, [
+            'delete word1 word4',
+            'delete word2',
+            'delete word2 word3',
+        ], 'script')
+        self.assertEqual(2, failed)
+        self.assertEqual({'word1', 'word3'}, set(self.store.direct_index))
+        print_mock.assert_any_call(
+            "script:1: ERROR: `delete`: word 'word4' was not found")
+        print_mock.assert_any_call(
+            "script:3: ERROR: `delete`: word 'word2' was not found")
+
+    def test_add_then_delete(self, print_mock):
+        failed = cli.run_batch(self.store, [
+            'add word3=meaning3',
+            'add word3=meaning4',
+            'delete word3',
+            'delete word3',
+            'add word5=meaning5',
+        ], 'script')
+        self.assertEqual(2, failed)
+        self.assertEqual({'word1', 'word2', 'word5'},
+                         set(self.store.direct_index))
+        print_mock.assert_any_call(
+            "script:4: ERROR: `delete`: word 'word3' was not found")
+
+    def test_add_overwrite_then_delete(self, print_mock):
+        self.assertEqual(1, cli.run_batch(self.store, [
+            'add a=1', 'add a=2', 'delete a'], 'script'))
+
+    def test_other_commands(self, print_mock):
+        failed = cli.run_batch(self.store, [
+            'add word3=meaning3',
+            'find word3',
+            'frobnicate',
+            'find',
+            'direct',
+            'quit',
+            'add word4=meaning4',
+        ], 'script')
+        self.assertEqual(3, failed)
+        self.assertNotIn('word4', self.store.direct_index)
+        self.assertEqual([
+            (("word3\tmeaning3\n",), {'end': ''}),
+            (("script:3: ERROR: `frobnicate`: No such command: "
+              "frobnicate",),),
+            (("script:4: ERROR: `find`: exactly one search string "
+              "expected",),),
+            (("script:5: ERROR: `direct`: not available in batch mode",),),
+        ], print_mock.call_args_list)
+
+    def test_reporter(self, print_mock):
+        report = cli._Reporter('script:7: ')
+        cli.find('find', self.store, [], report=report)
+        cli.delete('delete', self.store, ['word8', 'word9'], report=report)
+        self.assertEqual(3, report.count)
+        print_mock.assert_any_call(
+            "script:7: ERROR: `delete`: word 'word9' was not found")
+        # errors outside of a batch are not counted anywhere
+        cli.find('find', self.store, [])
+        self.assertEqual(3, report.count)
+        print_mock.assert_called_with(
+            "ERROR: `find`: exactly one search string expected")
+
+
+@patch.object(builtins, 'print')
+class TestCliAlias(StoreMixin, unittest.TestCase):
+
+    def test_alias(self, print_mock):
+        cli.alias('alias', self.store, ['ls=li', 'rm=delete'])
+        self.assertEqual({'ls': 'list', 'rm': 'delete'},
+                         dict(self.store.table('aliases')))
+        commands = cli.store_commands(self.store)
+        self.assertEqual(('list', cli.list_), commands.match('ls'))
+        cli.alias('alias', self.store, ['rm='])
+        self.assertRaises(KeyError, commands.match, 'rm')
+        cli.alias('alias', self.store, [])
+        print_mock.assert_called_once_with("ls\tlist\n", end='')
+
+    def test_bad_alias(self, print_mock):
+        cli.alias('alias', self.store, ['list=find', 'x=d'])
+        self.assertEqual({}, dict(self.store.table('aliases')))
+        print_mock.assert_any_call("ERROR: `alias`: list is a command")
+        print_mock.assert_any_call(
+            "ERROR: `alias`: Ambiguous command d, candidates are delete, "
+            "direct")
+
+
+class TestStats(StoreMixin, unittest.TestCase):
+
+    def tearDown(self):
+        stats.disable()
+        stats.reset()
+        super().tearDown()
+
+    def test_metric(self):
+        metric = stats.Metric()
+        for seconds in (1e-6, 3e-6, 3e-6, 0.5):
+            metric.add(seconds)
+        self.assertEqual(4, metric.count)
+        self.assertEqual(0.5, metric.max)
+        self.assertEqual(4e-6, metric.percentile(0.5))
+        self.assertEqual(0.5, metric.percentile(0.99))
+
+    def test_enable_disable(self):
+        original = store.Store.save
+        stats.enable()
+        self.assertIsNot(original, store.Store.save)
+        self.store.add('word3', 'meaning3')
+        trainer.Trainer(self.store).next()
+        self.assertEqual(2, stats.metrics['plugin.convert_word'].count)
+        self.assertEqual(1, stats.metrics['trainer.next'].count)
+        self.assertIn('trainer.next', stats.report())
+        stats.disable()
+        self.assertIs(original, store.Store.save)
+        self.store.add('word4', 'meaning4')
+        self.assertEqual(2, stats.metrics['plugin.convert_word'].count)
+
+    @patch.object(builtins, 'print')
+    @patch.object(builtins, 'input', side_effect=['stats on', 'list',
+                                                  'stats', 'stats reset',
+                                                  EOFError()])
+    def test_command(self, input_mock, print_mock):
+        self.assertRaises(SystemExit, cli.run, self.store,
+                          cli.DEFAULT_COMMANDS)
+        self.assertTrue(stats.enabled)
+        # only the reset itself is left
+        self.assertEqual(['command.stats'], list(stats.metrics))
+        report = [x[0][0] for x in print_mock.call_args_list
+                  if 'command.list' in str(x)]
+        self.assertEqual(1, len(report))
+        self.assertNotIn('command.stats', report[0])
+
+    @patch.object(builtins, 'print')
+    def test_command_disabled(self, print_mock):
+        cli.stats_('stats', self.store, [])
+        print_mock.assert_called_once_with(
+            "Nothing measured, use `stats on` to start measuring")
 
 
 @patch.object(builtins, 'input')
@@ -238,9 +1645,614 @@ class TestCliTrainer(unittest.TestCase):
         print_mock.assert_any_call("Next word: word1")
         print_mock.assert_any_call("Next word: word2")
 
+    def test_spaced(self, trainer_mock, print_mock, input_mock):
+        trainer_mock.return_value.next.return_value = 'word'
+        input_mock.side_effect = EOFError()
+        cli.train('direct', sentinel.store, ['srs'])
+        trainer_mock.assert_called_once_with(sentinel.store, 'direct',
+                                             spaced=True, tolerant=False)
+
+    def test_near_miss(self, trainer_mock, print_mock, input_mock):
+        trainer_mock.return_value.next.side_effect = ['word1', 'word2']
+        trainer_mock.return_value.check.return_value = True
+        trainer_mock.return_value.near_miss = 'meaning1'
+        input_mock.side_effect = ['meanign1', EOFError()]
+        cli.train('direct', sentinel.store, ['fuzzy'])
+        trainer_mock.assert_called_once_with(sentinel.store, 'direct',
+                                             spaced=False, tolerant=True)
+        print_mock.assert_any_call(
+            "Almost, the correct answer is: meaning1")
+        print_mock.assert_any_call("Next word: word2")
+
+    def test_no_words(self, trainer_mock, print_mock, input_mock):
+        trainer_mock.return_value.next.side_effect = IndexError(
+            "No words to train")
+        cli.train('direct', sentinel.store, ['srs'])
+        self.assertFalse(input_mock.called)
+        print_mock.assert_called_once_with(
+            "ERROR: `direct`: No words to train")
+
+    def test_unknown_option(self, trainer_mock, print_mock, input_mock):
+        cli.train('direct', sentinel.store, ['xxx'])
+        self.assertFalse(trainer_mock.called)
+        print_mock.assert_called_once_with(
+            "ERROR: `direct`: unknown options: xxx")
+
     def test_quit(self, trainer_mock, print_mock, input_mock):
         trainer_mock.return_value.next.return_value = 'word'
         input_mock.return_value = '/quit'
         cli.train('cmd', sentinel.store, [])
         trainer_mock.return_value.next.assert_called_once_with()
         self.assertFalse(trainer_mock.return_value.check.called)
+
+
+class TestStoreManager(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.mkdtemp()
+        self.filenames = []
+        for name, languages, format in [('cz-ru', ('cz', 'ru'), 'json'),
+                                        ('en-cz', ('en', 'cz'), 'binary'),
+                                        ('en-ru', ('en', 'ru'), 'sqlite')]:
+            filename = os.path.join(self.dir, name)
+            store.create(filename, languages, format=format)
+            with store.Store(filename) as new_store:
+                new_store.add('%s1' % languages[0], '%s1' % languages[1])
+            self.filenames.append(filename)
+        self.manager = manager.StoreManager(self.filenames)
+        self.addCleanup(self.manager.close)
+
+    def test_peek(self):
+        self.assertEqual(('cz', 'ru'), self.manager.languages('cz-ru'))
+        self.assertEqual(('en', 'cz'), self.manager.languages('en-cz'))
+        self.assertEqual(('en', 'ru'), self.manager.languages('en-ru'))
+        self.assertFalse(any(self.manager.is_open(name)
+                             for name in self.manager))
+        self.assertEqual(0, store.peek(self.filenames[0])['revision'])
+
+    def test_lazy_open(self):
+        opened = self.manager.get('cz-ru')
+        self.assertIs(opened, self.manager.get('cz-ru'))
+        self.assertEqual('ru1', opened.direct_index['cz1'])
+        self.assertFalse(self.manager.is_open('en-cz'))
+        self.assertRaises(KeyError, self.manager.get, 'xx')
+
+    def test_lookup(self):
+        self.assertEqual({'cz-ru': 'ru1', 'en-cz': 'en1'},
+                         self.manager.lookup('cz', 'cz1'))
+        self.assertFalse(self.manager.is_open('en-ru'))
+        self.assertEqual({}, self.manager.lookup('xx', 'cz1'))
+
+    def test_evict(self):
+        self.manager.memory_budget = 0
+        self.manager.acquire('cz-ru')
+        self.manager.get('en-cz')
+        self.manager.get('en-ru')
+        self.assertTrue(self.manager.is_open('cz-ru'))
+        self.assertFalse(self.manager.is_open('en-cz'))
+        self.manager.release('cz-ru')
+        self.manager.evict()
+        self.assertFalse(self.manager.is_open('cz-ru'))
+        # the store was saved and unlocked
+        with store.Store(self.filenames[0]) as reopened:
+            self.assertEqual('ru1', reopened.direct_index['cz1'])
+
+    def test_budget(self):
+        self.manager.memory_budget = 10 ** 6
+        self.manager.get('cz-ru')
+        self.manager.get('en-cz')
+        self.assertTrue(self.manager.is_open('cz-ru'))
+        self.assertGreater(self.manager.memory_usage()['cz-ru'], 0)
+
+
+class TestMaintenance(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'words')
+        # written without conversion, as with older patterns
+        store.backends.BACKENDS['binary'].dump(
+            self.filename, {'languages': ['cz', 'Oo'], 'revision': 3},
+            {'p~r`ili~s': 'too', 'příliš': 'also', 'd0um': 'house',
+             'dům': 'house', 'word': 'a ;b', 'bad': ' '},
+            {'reviews.direct': {'d0um': [1, 2, 3]}, 'aliases': {'x': 'y'}})
+
+    def check(self, report):
+        self.assertIsNone(report.error)
+        self.assertEqual(6, report.words)
+        self.assertEqual(3, report.changed)
+        self.assertEqual(1, report.duplicates)
+        self.assertEqual([('příliš', ['příliš', 'p~r`ili~s'], 'also; too')],
+                         report.conflicts)
+        self.assertEqual([('bad', "empty meaning")], report.invalid)
+        self.assertTrue(report.failed)
+        self.assertTrue(report.written)
+        with store.Store(self.filename, read_only=True) as new_store:
+            self.assertEqual({'příliš': 'also; too', 'dům': 'house',
+                              'word': 'a; b', 'bad': ' '},
+                             new_store.direct_index)
+            self.assertEqual(4, new_store['revision'])
+            self.assertEqual({'dům': [1, 2, 3]},
+                             dict(new_store.table('reviews.direct')))
+            self.assertEqual({'x': 'y'}, dict(new_store.table('aliases')))
+
+    def test_normalize(self):
+        report, = maintenance.normalize([self.filename], jobs=1)
+        self.check(report)
+        report, = maintenance.normalize([self.filename], jobs=1)
+        self.assertEqual(0, report.changed)
+        self.assertFalse(report.written)
+
+    def test_crash_before_removing_journal(self):
+        journal = self.filename + store.JOURNAL_SUFFIX
+        data = b'{"revision": 3}\n["index", "d0um", "house"]\n'
+        with open(journal, 'wb') as fp:
+            fp.write(data)
+        report, = maintenance.normalize([self.filename], jobs=1)
+        self.assertFalse(os.path.exists(journal))
+        # a crash between replacing the snapshot and removing the journal
+        with open(journal, 'wb') as fp:
+            fp.write(data)
+        self.check(report)
+        # only the writer removes it
+        self.assertTrue(os.path.exists(journal))
+        with store.Store(self.filename) as new_store:
+            self.assertNotIn('d0um', new_store.direct_index)
+        self.assertFalse(os.path.exists(journal))
+
+    def test_process_pool(self):
+        report, = maintenance.normalize([self.filename], jobs=2,
+                                        chunk_size=2)
+        self.check(report)
+
+    def test_map_bounded(self):
+        submitted = []
+
+        class Executor:
+            def submit(self, function, item):
+                submitted.append(item)
+                future = concurrent.futures.Future()
+                future.set_result(function(item))
+                return future
+
+        results = []
+        for result in maintenance._map_bounded(Executor(), 2,
+                                               lambda x: x * 2, range(5)):
+            self.assertLessEqual(len(submitted) - len(results), 2)
+            results.append(result)
+        self.assertEqual([0, 2, 4, 6, 8], results)
+
+    def test_dry_run(self):
+        with open(self.filename, 'rb') as fp:
+            data = fp.read()
+        report, = maintenance.normalize([self.filename], jobs=1,
+                                        dry_run=True)
+        self.assertEqual(3, report.changed)
+        self.assertEqual(1, len(report.conflicts))
+        self.assertFalse(report.written)
+        with open(self.filename, 'rb') as fp:
+            self.assertEqual(data, fp.read())
+
+    def test_locked(self):
+        with store.Store(self.filename):
+            report, = maintenance.normalize([self.filename], jobs=1)
+        self.assertIn('locked', report.error)
+        self.assertTrue(report.failed)
+
+
+class TestEngine(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.filename = os.path.join(tempfile.mkdtemp(), 'file')
+        store.create(self.filename, ('Oo', 'Oo'))
+        self.store = store.Store(self.filename)
+        self.store.add_many([('word1', 'meaning1'), ('word2', 'meaning2')])
+        self.store.save()
+        self.addCleanup(self.store.close)
+
+    def test_background_save(self):
+        self.store.autosave_changes = 1
+        self.store.compact_threshold = 0
+        writes = []
+        snapshot = self.store._backend.snapshot
+
+        def snapshot_mock(store_):
+            write = snapshot(store_)
+
+            def write_mock():
+                writes.append((threading.current_thread(),
+                               session.lock.locked()))
+                write()
+            return write_mock
+
+        tr = trainer.Trainer(self.store, trainer.DIRECT, spaced=True)
+        with patch.object(self.store._backend, 'snapshot',
+                          side_effect=snapshot_mock):
+            with engine.Engine(tr) as session:
+                session.next()
+                self.assertTrue(session.check(tr.answer))
+                self.assertTrue(self.store.history.buffered)
+                self.assertTrue(self.store._backend._journal.buffered)
+        (thread, locked), = writes
+        self.assertIsNot(threading.current_thread(), thread)
+        # written without holding off the session
+        self.assertFalse(locked)
+        self.assertIsNone(self.store.saver)
+        self.assertFalse(self.store.history.buffered)
+        self.assertFalse(self.store._backend._journal.buffered)
+        # the review state is written by the writer
+        with store.Store(self.filename, read_only=True) as reader:
+            self.assertEqual(1, len(reader.table('reviews.direct')))
+        records = list(history.read(self.store.history_filename))
+        self.assertEqual([history.CORRECT], [x.flags for x in records])
+
+    def test_prefetch(self):
+        writer = engine.Writer()
+        self.addCleanup(writer.close)
+        tr = trainer.Trainer(self.store, trainer.REVERSE)
+        session = engine.Engine(tr, writer)
+        session.next()
+        writer.wait()
+        self.assertEqual(('word1', 'word2'),
+                         tuple(sorted((tr.answer, tr._prefetched[1]))))
+        self.assertFalse(session.check('x'))
+        self.assertEqual(tr._prefetched[0], session.next())
+        session.close()
+        # a wrong answer, then skipped
+        self.assertEqual(
+            [history.REVERSE, history.REVERSE | history.SKIPPED],
+            [x.flags for x in history.read(self.store.history_filename)])
+
+    def test_writer_errors(self):
+        writer = engine.Writer()
+        done = []
+        with patch.object(engine.LOG, 'exception') as log_mock:
+            writer.submit(lambda: 1 / 0)
+            writer.submit(lambda: done.append(True))
+            writer.wait()
+        self.assertEqual([True], done)
+        self.assertTrue(log_mock.called)
+        writer.close()
+
+
+class TestHistory(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.filename = os.path.join(tempfile.mkdtemp(), 'history')
+
+    def test_append_read(self):
+        writer = history.History(self.filename)
+        writer.append(1.5, 2.25, history.CORRECT, 'dům', 'house', 'bob')
+        writer.append(2.5, 1e9, history.SKIPPED, 'word')
+        self.assertEqual(
+            [history.Record(1.5, 2.25, history.CORRECT, 'bob', 'dům',
+                            'house'),
+             history.Record(2.5, history.MAX_LATENCY / 1e3,
+                            history.SKIPPED, None, 'word', '')],
+            list(history.read(self.filename)))
+        writer.close()
+        writer = history.History(self.filename)
+        writer.append(3.5, 0, 0, 'word', 'x')
+        writer.close()
+        self.assertEqual(3, len(list(history.read(self.filename))))
+
+    @patch.object(history, 'READ_SIZE', 7)
+    def test_blocks(self):
+        with contextlib.closing(history.History(self.filename)) as writer:
+            for i in range(100):
+                writer.append(i, i, 0, 'word%d' % i, 'answer')
+        self.assertEqual(['word%d' % i for i in range(100)],
+                         [x.challenge for x in history.read(self.filename)])
+
+    def test_buffered(self):
+        writer = history.History(self.filename, buffered=True)
+        writer.append(1, 1, 0, 'word', 'answer')
+        self.assertEqual([], list(history.read(self.filename)))
+        writer.flush()
+        self.assertEqual(1, len(list(history.read(self.filename))))
+        writer.close()
+
+    def test_torn_tail(self):
+        with contextlib.closing(history.History(self.filename)) as writer:
+            writer.append(1, 1, 0, 'word', 'answer')
+            writer.append(2, 1, 0, 'word', 'answer')
+        os.truncate(self.filename, os.path.getsize(self.filename) - 3)
+        self.assertEqual([1], [x.time for x in history.read(self.filename)])
+
+    def test_invalid(self):
+        self.assertEqual([], list(history.read(self.filename)))
+        with open(self.filename, 'wb') as fp:
+            fp.write(b'garbage')
+        self.assertRaises(ValueError, list, history.read(self.filename))
+
+
+class TestAnalytics(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.filename = os.path.join(tempfile.mkdtemp(), 'history')
+        with contextlib.closing(history.History(self.filename)) as writer:
+            for i in range(3):
+                writer.append(i, 1, 0, 'hard', 'x', 'bob')
+                writer.append(i, 2, history.CORRECT, 'hard', 'y', 'bob')
+                writer.append(i, 4, history.NEAR_MISS, 'easy', 'z')
+            writer.append(5, 8, history.SKIPPED, 'rare')
+            writer.append(5, 8, history.SKIPPED | history.REVERSE, 'hard')
+
+    def test_analyze(self):
+        result = analytics.analyze(self.filename)
+        self.assertEqual(9, result.answers)
+        self.assertEqual(6, result.correct)
+        self.assertEqual(2, result.skipped)
+        self.assertEqual(4, result.latency.max)
+        self.assertEqual(0.5, result.error_rate('hard'))
+        self.assertEqual(1, result.error_rate('hard', reverse=True))
+        self.assertIsNone(result.error_rate('missing'))
+        self.assertEqual([('hard', False, 6, 3)], result.hardest(10))
+        self.assertEqual([('rare', False, 1, 1), ('hard', True, 1, 1)],
+                         result.hardest(2, min_attempts=1))
+
+    def test_latency(self):
+        latency = analytics.Latency()
+        for i in range(1010):
+            latency.add(1 + i * 0.002 if i < 950 else 3.0)
+        self.assertEqual(2.9, latency.percentile(0.9))
+        self.assertEqual(3.0, latency.percentile(0.99))
+        self.assertEqual(1.1, latency.percentile(0))
+        latency.add(1000)
+        self.assertEqual(1000, latency.percentile(1))
+
+    def test_filters(self):
+        result = analytics.analyze(self.filename, learner='bob')
+        self.assertEqual(6, result.answers)
+        self.assertEqual(0, result.skipped)
+        result = analytics.analyze(self.filename, reverse=True)
+        self.assertEqual(0, result.answers)
+        self.assertEqual(1, result.skipped)
+
+    def test_report(self):
+        text = analytics.report(analytics.analyze(self.filename))
+        self.assertIn('Answers: 9, correct: 6 (66.7%), skipped: 2', text)
+        self.assertIn('  hard: 3 of 6 (50%)', text)
+        self.assertEqual('Nothing trained yet\n',
+                         analytics.report(analytics.Analytics()))
+
+    @patch.object(builtins, 'print')
+    def test_command(self, print_mock):
+        filename = os.path.join(os.path.dirname(self.filename), 'file')
+        store.create(filename, ('Oo', 'Oo'))
+        with store.Store(filename) as new_store:
+            new_store.add('word', 'meaning')
+            tr = trainer.Trainer(new_store)
+            tr.next()
+            tr.check('meaning')
+            cli.analytics_('analytics', new_store, ['kind=direct'])
+            self.assertIn('Answers: 1, correct: 1 (100.0%)',
+                          print_mock.call_args[0][0])
+            cli.analytics_('analytics', new_store, ['kind=x'])
+            print_mock.assert_called_with(
+                "ERROR: `analytics`: expected kind direct or reverse")
+        with store.Store(filename, read_only=True) as new_store:
+            cli.analytics_('analytics', new_store, [])
+            self.assertIn('Answers: 1', print_mock.call_args[0][0])
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'words')
+        store.create(self.filename, ('Oo', 'Oo'))
+        with store.Store(self.filename) as new_store:
+            new_store.add('word1', 'meaning1')
+            new_store.add('word2', 'meaning2')
+
+    def serve(self, test):
+        async def run():
+            self.server = server.Server([self.filename], save_interval=0.01)
+            self.address = await self.server.start('127.0.0.1', 0)
+            try:
+                await test()
+            finally:
+                await self.server.close()
+        asyncio.run(run())
+
+    async def request(self, method, path, data=None):
+        reader, writer = await asyncio.open_connection(*self.address)
+        body = b'' if data is None else json.dumps(data).encode('utf-8')
+        writer.write(('%s %s HTTP/1.1\r\nConnection: close\r\n'
+                      'Content-Length: %d\r\n\r\n' %
+                      (method, path, len(body))).encode('latin-1') + body)
+        response = await reader.read()
+        writer.close()
+        head, _, body = response.partition(b'\r\n\r\n')
+        return int(head.split()[1]), json.loads(body.decode('utf-8'))
+
+    def test_words(self):
+        async def test():
+            status, result = await self.request('GET', '/stores')
+            self.assertEqual({'stores': {'words': ['Oo', 'Oo']}}, result)
+            status, result = await self.request(
+                'POST', '/stores/words/words',
+                {'words': {'word3': 'meaning3', 'word1': 'other'}})
+            self.assertEqual(200, status)
+            self.assertEqual({'added': 1, 'skipped': ['word1']}, result)
+            status, result = await self.request(
+                'DELETE', '/stores/words/words', {'words': ['word2']})
+            self.assertEqual(200, status)
+            self.assertEqual({'deleted': 1}, result)
+            status, result = await self.request(
+                'DELETE', '/stores/words/words',
+                {'words': ['word2', 'xxx'], 'silent': True})
+            self.assertEqual({'deleted': 0}, result)
+            status, result = await self.request(
+                'GET', '/stores/words/words?limit=1')
+            self.assertEqual({'words': [['word1', 'meaning1']],
+                              'next_offset': 1}, result)
+            status, result = await self.request(
+                'GET', '/stores/words/words?offset=1&reverse=yes')
+            self.assertEqual({'words': [['meaning3', 'word3']],
+                              'next_offset': None}, result)
+        self.serve(test)
+        self.assertEqual({'word1': 'meaning1', 'word3': 'meaning3'},
+                         store.Store(self.filename).direct_index)
+
+    def test_errors(self):
+        async def test():
+            status, result = await self.request('GET', '/stores/xxx/words')
+            self.assertEqual(404, status)
+            status, result = await self.request('PUT', '/stores')
+            self.assertEqual(405, status)
+            status, result = await self.request(
+                'GET', '/stores/words/words?xxx=1')
+            self.assertEqual(400, status)
+            status, result = await self.request(
+                'POST', '/stores/words/words', {'words': 'word'})
+            self.assertEqual(400, status)
+            status, result = await self.request(
+                'DELETE', '/stores/words/words', {'words': ['word1', 'xxx']})
+            self.assertEqual(404, status)
+            self.assertEqual(['xxx'], result['missing'])
+            status, result = await self.request('POST', '/sessions/xxx',
+                                                {'skip': True})
+            self.assertEqual(404, status)
+        self.serve(test)
+
+    def test_training(self):
+        async def test():
+            status, result = await self.request(
+                'POST', '/stores/words/sessions',
+                {'srs': True, 'learner': 'me'})
+            self.assertEqual(200, status)
+            key, challenge = result['session'], result['challenge']
+            answer = 'meaning' + challenge[-1]
+            status, result = await self.request(
+                'POST', '/sessions/' + key, {'answer': 'xxx'})
+            self.assertEqual({'correct': False, 'challenge': challenge},
+                             result)
+            status, result = await self.request(
+                'POST', '/sessions/' + key, {'answer': answer})
+            self.assertTrue(result['correct'])
+            self.assertNotEqual(challenge, result['challenge'])
+            status, result = await self.request('DELETE', '/sessions/' + key)
+            self.assertEqual(200, status)
+            self.assertEqual({}, self.server.sessions)
+        self.serve(test)
+        reviews = store.Store(self.filename).table('reviews.direct.me')
+        self.assertEqual(1, len(reviews))
+
+    def test_history_flushed(self):
+        async def test():
+            status, result = await self.request(
+                'POST', '/stores/words/sessions', {'learner': 'me'})
+            await self.request('POST', '/sessions/' + result['session'],
+                               {'answer': 'xxx'})
+            shared = self.server.stores['words']
+            self.assertFalse(shared.store.dirty)
+            await self.server.save()
+            records = list(history.read(shared.store.history_filename))
+            self.assertEqual([('me', 'xxx')],
+                             [(x.learner, x.answer) for x in records])
+        self.serve(test)
+
+    def test_concurrent_sessions(self):
+        async def session():
+            status, result = await self.request(
+                'POST', '/stores/words/sessions', {'kind': 'reverse'})
+            key = result['session']
+            for _ in range(5):
+                status, result = await self.request(
+                    'POST', '/sessions/' + key,
+                    {'answer': 'word' + result['challenge'][-1]})
+                self.assertTrue(result['correct'])
+
+        async def test():
+            await asyncio.gather(*[session() for _ in range(20)])
+            self.assertEqual(20, len(self.server.sessions))
+        self.serve(test)
+
+    def test_keep_alive(self):
+        async def test():
+            reader, writer = await asyncio.open_connection(*self.address)
+            for _ in range(2):
+                writer.write(b'GET /stores HTTP/1.1\r\n\r\n')
+                head = await reader.readuntil(b'\r\n\r\n')
+                self.assertIn(b'Connection: keep-alive', head)
+                length = int(head.split(b'Content-Length: ')[1].split()[0])
+                await reader.readexactly(length)
+            writer.close()
+        self.serve(test)
+
+    def test_expire_sessions(self):
+        clock = iter([0, 100]).__next__
+        test_server = server.Server([self.filename], session_timeout=10,
+                                    clock=clock, memory_budget=0)
+
+        # locks of shared stores belong to the running loop
+        async def test():
+            shared = await test_server._acquire('words')
+            test_server.sessions['key'] = server.Session(shared, None, clock)
+            test_server.expire_sessions()
+            self.assertEqual({}, test_server.sessions)
+            # not used any more
+            test_server.manager.evict()
+            self.assertEqual({}, test_server.stores)
+        asyncio.run(test())
+
+    def test_open_in_executor(self):
+        test_server = server.Server([self.filename])
+        threads = []
+        open_ = test_server.manager.open
+
+        def open_mock(name):
+            threads.append(threading.current_thread())
+            return open_(name)
+
+        async def test():
+            with patch.object(test_server.manager, 'open',
+                              side_effect=open_mock):
+                first, second = await asyncio.gather(
+                    test_server._acquire('words'),
+                    test_server._acquire('words'))
+            self.assertIs(first, second)
+            self.assertEqual(2, len(first.store.direct_index))
+            await test_server.close()
+        asyncio.run(test())
+        self.assertEqual(1, len(threads))
+        self.assertIsNot(threading.current_thread(), threads[0])
+
+    def test_lookup(self):
+        other = os.path.join(self.dir, 'other')
+        store.create(other, ('Xx', 'Oo'), format='binary')
+        with store.Store(other) as new_store:
+            new_store.add('word5', 'meaning1')
+
+        async def test():
+            status, result = await self.request(
+                'GET', '/languages/Oo/words/meaning1')
+            self.assertEqual({'meanings': {'words': 'word1',
+                                           'other': 'word5'}}, result)
+            status, result = await self.request(
+                'GET', '/languages/Xx/words/word1')
+            self.assertEqual({'meanings': {}}, result)
+            status, result = await self.request('GET', '/stores')
+            self.assertEqual({'words': ['Oo', 'Oo'], 'other': ['Xx', 'Oo']},
+                             result['stores'])
+
+        async def run():
+            self.server = server.Server([self.filename, other],
+                                        memory_budget=0)
+            self.address = await self.server.start('127.0.0.1', 0)
+            try:
+                await test()
+                # idle stores do not fit into the budget
+                self.assertEqual({}, self.server.stores)
+                self.assertFalse(self.server.manager.is_open('words'))
+            finally:
+                await self.server.close()
+        asyncio.run(run())
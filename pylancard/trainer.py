@@ -1,5 +1,11 @@
 import logging
-import random
+import time
+
+from . import fuzzy
+from . import history
+from . import index as index_
+from . import scheduler
+from . import utils
 
 
 DIRECT = 'direct'
@@ -9,43 +15,150 @@ LOG = logging.getLogger(__name__)
 
 class Trainer:
 
-    def __init__(self, store, kind=DIRECT):
+    def __init__(self, store, kind=DIRECT, spaced=False, tolerant=False,
+                 learner=None):
         self.store = store
         if kind == DIRECT:
-            self._words = list(store.direct_index.items())
+            index = store.direct_index
             self._plugin = store.meaning_plugin
         elif kind == REVERSE:
-            self._words = list(store.reverse_index.items())
+            index = store.reverse_index
             self._plugin = store.original_plugin
         else:
             raise ValueError("Expected kind, got %r", kind)
         self.challenge = self.answer = None
-        self._init()
+        # all accepted answers: meanings of the word or words having the
+        # meaning
+        self.answers = ()
+        # accepted answer when the last check only matched tolerantly
+        self.near_miss = None
+        self._index = index
+        self._reverse = kind == REVERSE
+        self._tolerant = tolerant
+        self._matcher = None
+        self._mistakes = 0
+        self._graded = True
+        # (challenge, answer, answers) chosen by prefetch()
+        self._prefetched = None
+        # answers are recorded to the history of the store if it has one
+        self._history = store.history
+        self._learner = learner
+        self._answered = True
+        self._asked_at = None
+        if spaced:
+            # learners sharing a store keep separate review states
+            reviews = 'reviews.%s' % kind
+            if learner is not None:
+                reviews += '.%s' % learner
+            self._scheduler = scheduler.Scheduler(index, store.table(reviews))
+        else:
+            self._scheduler = None
+            self._init()
 
     def check(self, answer):
         converted = self._plugin.convert_word(answer.strip())
-        if converted != self.answer:
+        self.near_miss = None
+        correct = converted in self.answers
+        if not correct and self._tolerant:
+            if self._matcher is None:
+                self._matcher = fuzzy.Matcher(self.answers)
+            self.near_miss = self._matcher.match(converted)
+        if not correct and self.near_miss is None:
             LOG.info("'%(converted)s' (converted from '%(answer)s') "
                      "is incorrect",
                      locals())
+            self._record(0, converted)
+            self._mistakes += 1
             return False
         else:
             LOG.debug("%s is accepted", converted)
+            self._record(history.CORRECT if correct else history.NEAR_MISS,
+                         converted)
+            self._answered = True
+            if not self._graded:
+                # an answer after mistakes still counts as a lapse
+                if self._mistakes:
+                    quality = 2
+                elif self.near_miss is not None:
+                    quality = 3
+                else:
+                    quality = 4
+                self._scheduler.record(self.challenge, quality)
+                self._graded = True
             return True
 
     def next(self):
-        assert len(self._words) != 0
-        try:
-            self.challenge, self.answer = self._words[self._ptr]
-        except IndexError:
-            LOG.info("All words finished, starting from the beginning")
-            self._init()
-            return self.next()
-        else:
-            self._ptr += 1
-        LOG.debug("Next challenge is '%s'", self.challenge)
+        self._matcher = None
+        if not self._answered:
+            self._record(history.SKIPPED)
+        if self._scheduler is not None:
+            if not self._graded:
+                # skipped without a correct answer
+                self._scheduler.record(self.challenge, 0)
+            self.challenge = self._scheduler.next()
+            self.answer = self._index[self.challenge]
+            self.answers = self._answers(self.challenge, self.answer)
+            self._mistakes = 0
+            self._graded = False
+            self._asked()
+            return self.challenge
+
+        if not self._index:
+            raise IndexError("No words to train")
+        prefetched, self._prefetched = self._prefetched, None
+        # the prefetched word may have been changed or deleted meanwhile
+        if (prefetched is None or
+                self._index.get(prefetched[0]) != prefetched[1]):
+            prefetched = self._pick()
+        self.challenge, self.answer, self.answers = prefetched
+        self._asked()
         return self.challenge
 
+    def prefetch(self):
+        """Choose the challenge of the next call to next() in advance.
+
+        Meant to run while waiting for an answer. Does nothing with
+        spaced repetition, where the next challenge depends on the answer.
+        """
+        if self._scheduler is None and self._prefetched is None:
+            self._prefetched = self._pick()
+
+    def _pick(self):
+        while True:
+            try:
+                position = next(self._order)
+            except StopIteration:
+                LOG.info("All words finished, starting from the beginning")
+                self._init()
+                continue
+            # the index may have shrunk since the permutation started
+            if position < self._index.positions:
+                item = self._index.item_at(position)
+                if item is not None:
+                    break
+        challenge, answer = item
+        return challenge, answer, self._answers(challenge, answer)
+
+    def _asked(self):
+        LOG.debug("Next challenge is '%s'", self.challenge)
+        self._answered = False
+        self._asked_at = time.monotonic()
+
+    def _record(self, flags, answer=''):
+        if self._history is None:
+            return
+        now = time.monotonic()
+        if self._reverse:
+            flags |= history.REVERSE
+        # the time since the challenge or the previous wrong answer
+        self._history.append(time.time(), now - self._asked_at, flags,
+                             self.challenge, answer, self._learner)
+        self._asked_at = now
+
+    def _answers(self, challenge, answer):
+        if self._reverse:
+            return self._index.originals(challenge)
+        return index_.split_meanings(answer)
+
     def _init(self):
-        self._ptr = 0
-        random.shuffle(self._words)
+        self._order = utils.lazy_permutation(self._index.positions)
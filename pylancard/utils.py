@@ -1,19 +1,84 @@
-def matching_command(command, commands_set):
-    candidates = {name: function
-                  for (name, function) in commands_set.items()
-                  if name is not None and name.startswith(command.strip())}
-    if len(candidates) == 1:
-        return next(iter(candidates.items()))
-    elif command in candidates:
-        return command, candidates[command]
-    elif not candidates and None in commands_set:
-        return command, commands_set[None]
-    else:
-        if not candidates:
-            raise KeyError("No such command: %s" % command)
-        else:
+import collections.abc
+import random
+
+
+class CommandTable(collections.abc.Mapping):
+    """Commands compiled into a table of all their prefixes.
+
+    Every prefix of every command (and alias) maps to the matching
+    command or to the list of candidates when it is ambiguous, so finding
+    a command is a single lookup. The None key is the default command
+    for input matching nothing. Aliases (name -> command) may be any
+    mapping, a Table is followed for changes.
+    """
+
+    def __init__(self, commands, aliases=None):
+        self._commands = dict(commands)
+        self._aliases = {} if aliases is None else aliases
+        listeners = getattr(self._aliases, 'listeners', None)
+        if listeners is not None:
+            listeners.append(lambda *_: self._compile())
+        self._compile()
+
+    def __getitem__(self, name):
+        return self._commands[name]
+
+    def __iter__(self):
+        return iter(self._commands)
+
+    def __len__(self):
+        return len(self._commands)
+
+    def match(self, command):
+        """Return (command name, function), raise KeyError if none."""
+        command = command.strip()
+        entry = self._prefixes.get(command)
+        if isinstance(entry, tuple):
+            return entry
+        elif entry is not None:
             raise KeyError("Ambiguous command %s, candidates are %s" %
-                           (command, ', '.join(x[0] for x in candidates)))
+                           (command, ', '.join(entry)))
+        elif None in self._commands:
+            return command, self._commands[None]
+        else:
+            raise KeyError("No such command: %s" % command)
+
+    def complete(self, prefix):
+        """Sorted names of commands and aliases starting with prefix."""
+        return self._completions.get(prefix, [])
+
+    def _compile(self):
+        targets = {name: name for name in self._commands if name is not None}
+        for alias, name in self._aliases.items():
+            if alias not in targets and name in self._commands:
+                targets[alias] = name
+        candidates = {}
+        for name in targets:
+            for end in range(len(name) + 1):
+                candidates.setdefault(name[:end], []).append(name)
+        prefixes = {}
+        for prefix, names in candidates.items():
+            matching = {targets[name] for name in names}
+            if prefix in targets:
+                matching = {targets[prefix]}
+            if len(matching) == 1:
+                name = matching.pop()
+                prefixes[prefix] = (name, self._commands[name])
+            else:
+                prefixes[prefix] = names
+        self._prefixes = prefixes
+        self._completions = {prefix: sorted(names)
+                             for (prefix, names) in candidates.items()}
+
+
+def matching_command(command, commands_set):
+    """Find the command by its prefix, see CommandTable.
+
+    Compile commands_set into a CommandTable once to look up many times.
+    """
+    if not isinstance(commands_set, CommandTable):
+        commands_set = CommandTable(commands_set)
+    return commands_set.match(command)
 
 
 def split_key_value(arguments):
@@ -29,3 +94,49 @@ def split_key_value(arguments):
         raise ValueError("Value required for keys: %s" % ', '.join(bad_format))
 
     return words
+
+
+def parse_options(arguments, **defaults):
+    """Split arguments into positional ones and name=value options.
+
+    Only names present in defaults are treated as options, values are
+    converted to the type of the default. Returns (positional, options).
+    """
+    options = dict(defaults)
+    positional = []
+    for argument in arguments:
+        name, sep, value = argument.partition('=')
+        if not sep or name not in defaults:
+            positional.append(argument)
+            continue
+        default = defaults[name]
+        if isinstance(default, bool):
+            options[name] = value.lower() in ('1', 'yes', 'true', 'on')
+        elif isinstance(default, int):
+            try:
+                options[name] = int(value)
+            except ValueError:
+                raise ValueError("Integer required for %s" % name)
+            if options[name] < 0:
+                raise ValueError("Non-negative value required for %s" % name)
+        else:
+            options[name] = value
+    return positional, options
+
+
+def lazy_permutation(size, rng=random):
+    """Yield a uniformly random permutation of range(size) lazily.
+
+    Fisher-Yates shuffle where only swapped positions are remembered, so
+    starting is O(1) and memory grows with the number of items produced.
+    """
+    swapped = {}
+    for i in range(size):
+        j = rng.randrange(i, size)
+        current = swapped.pop(i, i)
+        if j == i:
+            yield current
+        else:
+            value = swapped.get(j, j)
+            swapped[j] = current
+            yield value